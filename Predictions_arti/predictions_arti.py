@@ -26,17 +26,21 @@ import sys
 import time
 sys.path.append("..")
 from Training.model import my_ac2art_model
+from Training.tools_learning import precisions
 
 import numpy as np
-import librosa
-from Preprocessing.tools_preprocessing import get_delta_features
+from Preprocessing.tools_preprocessing import compact_context, mfcc_with_context
+from Preprocessing.features_extraction import get_mfcc_extractor
+from Preprocessing.audio_io import load_wav
 import argparse
 
 root_folder = os.path.dirname(os.getcwd())
 
 
-def preprocess_my_wav_files(wav_folder, mfcc_folder, Nmax=0):
+def preprocess_my_wav_files(wav_folder, mfcc_folder, Nmax=0, compact_mfcc=False, batch_size=32):
     """
+    :param compact_mfcc: whether to save only the frames (K+10,39), the context is added when they are loaded
+    :param batch_size: # of wav files whose acoustic features are calculated together
     Read all the wav files in "my_wav_files_for_inversion" and preprocess them the extract their acoustic features,
     so that it can be used as input of the my_ac2art model.
     Save the mfcc in "my_mfcc_files_for_inversion" , with the same filename as the corresponding wav.
@@ -54,32 +58,33 @@ def preprocess_my_wav_files(wav_folder, mfcc_folder, Nmax=0):
     frame_length = int(frame_time * sampling_rate_wav_wanted)
     window = 5
     n_coeff = 13
+    extractor = get_mfcc_extractor(sampling_rate_wav_wanted, frame_length, hop_length, n_coeff, window)
     wav_files = os.listdir(path_wav)
     if Nmax > 0:
         wav_files = wav_files[:Nmax]
-    for filename in wav_files:
-        if not filename.endswith('.wav'):
-            continue
-        filename = filename[:-4]  #remove extension
-        wav, sr = librosa.load(os.path.join(path_wav,filename+".wav"), sr=sampling_rate_wav_wanted)  # chargement de données
-        wav = 0.5 * wav / np.max(wav)
-        mfcc = librosa.feature.mfcc(y=wav, sr=sr, n_mfcc=n_coeff, n_fft=frame_length, hop_length=hop_length).T
-        dyna_features = get_delta_features(mfcc)
-        dyna_features_2 = get_delta_features(dyna_features)
-        mfcc = np.concatenate((mfcc, dyna_features, dyna_features_2), axis=1)
-        padding = np.zeros((window, mfcc.shape[1]))
-        frames = np.concatenate([padding, mfcc, padding])
-        full_window = 1 + 2 * window
-        mfcc = np.concatenate([frames[j:j + len(mfcc)] for j in range(full_window)], axis=1)  # add context
-        # normalize
-        mfcc =( mfcc - mfcc.mean(axis = 0, keepdims=True) )/ mfcc.std(axis = 0, keepdims=True)
-        np.save(os.path.join(root_folder, "Predictions_arti",mfcc_folder, filename), mfcc)
+    wav_files = [filename[:-4] for filename in wav_files if filename.endswith('.wav')]  #remove extension
+    for start in range(0, len(wav_files), batch_size):
+        filenames = wav_files[start:start + batch_size]
+        wavs = []
+        for filename in filenames:
+            wav, sr = load_wav(os.path.join(path_wav,filename+".wav"), sr=sampling_rate_wav_wanted)  # chargement de données
+            wavs.append(0.5 * wav / np.max(wav))
+        for filename, mfcc in zip(filenames, extractor.get_features(wavs)):
+            if compact_mfcc:  # frames with the zero padding, normalized with the statistics of the frames
+                frames = compact_context(mfcc, window)
+                mfcc = frames[window:-window]
+                mfcc = (frames - mfcc.mean(axis=0, keepdims=True)) / mfcc.std(axis=0, keepdims=True)
+            else:
+                # normalize
+                mfcc =( mfcc - mfcc.mean(axis = 0, keepdims=True) )/ mfcc.std(axis = 0, keepdims=True)
+            np.save(os.path.join(root_folder, "Predictions_arti",mfcc_folder, filename), mfcc)
 
 
 def predictions_arti(model_name,mfcc_folder="my_mfcc_files_for_inversion",
-                     ema_folder="my_articulatory_prediction", output_dim = 18):
+                     ema_folder="my_articulatory_prediction", output_dim = 18, precision="float64"):
     """
     :param model_name: name of model we want to use for the articulatory predictions
+    :param precision: "float64", "float32" or "bfloat16", precision of the predictions (see tools_learning.precisions)
     with the weights in model_name, this script perform articulatory predictions corresponding to the wav files
     it takes as input the mfcc features already calculated
     the arti predictions are saved my "my_articulatory_prediction" as np array (K,18)
@@ -99,8 +104,8 @@ def predictions_arti(model_name,mfcc_folder="my_mfcc_files_for_inversion",
     batch_norma = False  # future work : read from model name if true or false
     model = my_ac2art_model(hidden_dim=hidden_dim, input_dim=input_dim, output_dim=output_dim,
                             batch_size=batch_size, cuda_avail=False, name_file=model_name,
-                            filter_type=filter_type, batch_norma=batch_norma)
-    model = model.double()
+                            filter_type=filter_type, batch_norma=batch_norma, precision=precision,
+                            packed="_packed" in model_name)  # lstm through the frames (see train.py)
     file_weights = os.path.join(root_folder,"Training","saved_models", model_name + ".txt")
     loaded_state = torch.load(file_weights, map_location="cpu")
     model.load_state_dict(loaded_state)
@@ -108,9 +113,10 @@ def predictions_arti(model_name,mfcc_folder="my_mfcc_files_for_inversion",
     all_my_mfcc_files = os.listdir(os.path.join(root_folder,"Predictions_arti",mfcc_folder))
 
     for mfcc_file in all_my_mfcc_files :
-        mfcc = np.load(os.path.join(root_folder,"Predictions_arti",mfcc_folder,mfcc_file))
-        mfcc_torch = torch.from_numpy(mfcc).view(1, -1, input_dim)
-        ema_torch = model(mfcc_torch)
+        mfcc = mfcc_with_context(np.load(os.path.join(root_folder,"Predictions_arti",mfcc_folder,mfcc_file)))
+        mfcc_torch = torch.from_numpy(mfcc).view(1, -1, input_dim).to(model.dtype)
+        with torch.no_grad():
+            ema_torch = model(mfcc_torch)
         ema = ema_torch.detach().numpy().reshape((-1, output_dim))
         np.save(os.path.join(root_folder,"Predictions_arti",ema_folder,model_name,mfcc_file),ema)
 
@@ -130,13 +136,18 @@ if __name__ == '__main__':
     parser.add_argument('model_name', type=str, help='the name of your model')
     parser.add_argument('--already_prepro', type=bool, default=False,
                         help='put to True if preprocessin already done for the wav files')
+    parser.add_argument('--compact_mfcc', action='store_true',
+                        help='save only the 39 features of each frame, the context is added when loading')
+    parser.add_argument('--precision', type=str, default="float64", choices=precisions,
+                        help='dtype of the model for the predictions, float32 is faster')
 
     args = parser.parse_args()
     if not(args.already_prepro):
         print("preprocessing...")
-        preprocess_my_wav_files(wav_folder = args.wav_folder, mfcc_folder = args.mfcc_folder, Nmax=0)
+        preprocess_my_wav_files(wav_folder = args.wav_folder, mfcc_folder = args.mfcc_folder, Nmax=0,
+                                compact_mfcc=args.compact_mfcc)
     predictions_arti(model_name = args.model_name, mfcc_folder=args.mfcc_folder,
-                     ema_folder=args.output_folder, output_dim = args.output_dim)
+                     ema_folder=args.output_folder, output_dim = args.output_dim, precision=args.precision)
 
 
 #example name model "F01_spec_loss_0_filter_fix_bn_False_0"
\ No newline at end of file
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Reading of the wav files of all the corpus and for the predictions on new wav files.
+    The wav files are decoded directly (soundfile if installed, scipy otherwise) and resampled to the sampling rate
+    wanted for the mfcc with the chosen method (see resampling_methods).
+    The resampled wav can be kept in a cache directory, the name of the cached file is made of the hash of the source
+    file, the sampling rate and the method. Then when the preprocessing is done again (other mfcc parameters, new
+    speakers ...) the wav that were already resampled are just loaded.
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import numpy as np
+import scipy.signal
+import scipy.io.wavfile
+import wave
+from fractions import Fraction
+from Preprocessing.tools_preprocessing import hash_file
+
+try:
+    import soundfile
+except ImportError:  # soundfile is optional, scipy can read the PCM and float wav files
+    soundfile = None
+
+""" librosa : librosa.resample with its default method (same as librosa.load), polyphase : scipy.signal.resample_poly,
+ fft : scipy.signal.resample """
+resampling_methods = ["librosa", "polyphase", "fft"]
+
+
+def read_wav(path, start=0, stop=None):
+    """
+    :param path: path of the wav file
+    :param start: index of the first point to read
+    :param stop: index of the point after the last one to read, None to read until the end
+    :return: (wav, sr) the wav in float32 between -1 and 1 (mean of the channels if several), and its sampling rate
+    Only the points between start and stop are decoded.
+    """
+    if soundfile is not None:
+        wav, sr = soundfile.read(path, start=start, stop=stop, dtype="float32", always_2d=True)
+    else:
+        sr, wav = scipy.io.wavfile.read(path, mmap=True)
+        wav = wav[start:stop]
+        if wav.dtype == np.uint8:
+            wav = (wav.astype(np.float32) - 128) / 128
+        elif wav.dtype.kind == "i":
+            wav = wav.astype(np.float32) / (np.iinfo(wav.dtype).max + 1.0)
+        else:
+            wav = wav.astype(np.float32)
+        wav = wav.reshape(len(wav), -1)
+    if wav.shape[1] == 1:
+        return wav[:, 0], sr
+    return np.mean(wav, axis=1), sr
+
+
+def get_sampling_rate(path):
+    """
+    :param path: path of the wav file
+    :return: the sampling rate of the wav file, read in its header. None if it can not be read.
+    """
+    try:
+        return get_wav_info(path)[0]
+    except Exception:
+        return None
+
+
+def get_wav_info(path):
+    """
+    :param path: path of the wav file
+    :return: (sampling rate, # of points) of the wav file, read in its header
+    """
+    if soundfile is not None:
+        info = soundfile.info(path)
+        return info.samplerate, info.frames
+    try:
+        with wave.open(path, "rb") as f:
+            return f.getframerate(), f.getnframes()
+    except wave.Error:  # float wav, not read by the wave module
+        sr, wav = scipy.io.wavfile.read(path, mmap=True)
+        return sr, len(wav)
+
+
+def resample(wav, sr_orig, sr, method="librosa"):
+    """
+    :param wav: one wav
+    :param sr_orig: sampling rate of the wav
+    :param sr: sampling rate wanted
+    :param method: one of resampling_methods
+    :return: the wav at the sampling rate sr, with ceil(len(wav)*sr/sr_orig) points
+    """
+    if sr is None or sr == sr_orig:
+        return wav
+    if method == "librosa":
+        import librosa
+        return librosa.resample(wav, orig_sr=sr_orig, target_sr=sr)
+    n_points = int(np.ceil(len(wav) * float(sr) / sr_orig))
+    if method == "polyphase":
+        ratio = Fraction(int(sr), int(sr_orig))
+        wav = scipy.signal.resample_poly(wav, ratio.numerator, ratio.denominator)
+    elif method == "fft":
+        wav = scipy.signal.resample(wav, n_points)
+    else:
+        raise NameError("unknown resampling method {}, choose among {}".format(method, resampling_methods))
+    return wav[:n_points].astype(np.float32)
+
+
+def get_cached_path(cache_dir, source_hash, sr, method, source_range=None):
+    """
+    :return: path of the resampled wav in the cache
+    """
+    if source_range is not None:
+        source_hash = "{}_{}_{}".format(source_hash, *source_range)
+    return os.path.join(cache_dir, "{}_{}_{}.npy".format(source_hash, sr, method))
+
+
+def resample_cached(load, source_path, sr, method="librosa", cache_dir=None, source_range=None):
+    """
+    :param load: function without argument that returns (wav, sr_orig), called only if the wav is not in the cache
+    :param source_path: path of the file the wav comes from, its hash is the key of the wav in the cache
+    :param sr: sampling rate wanted
+    :param method: one of resampling_methods
+    :param cache_dir: directory of the cache, None for no cache
+    :param source_range: (start, stop) if the wav is only a part of the source file, also in the key of the cache
+    :return: the wav at the sampling rate sr. Only the wav that had to be resampled are saved in the cache.
+    """
+    if cache_dir is None:
+        wav, sr_orig = load()
+        return resample(wav, sr_orig, sr, method)
+    cached_path = get_cached_path(cache_dir, hash_file(source_path), sr, method, source_range)
+    if os.path.exists(cached_path):
+        return np.load(cached_path)
+    wav, sr_orig = load()
+    if sr_orig == sr:
+        return wav
+    wav = resample(wav, sr_orig, sr, method)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = cached_path + ".{}.tmp".format(os.getpid())
+    with open(tmp_path, "wb") as f:
+        np.save(f, wav)
+    os.replace(tmp_path, cached_path)  # several processes can write the same file
+    return wav
+
+
+def load_wav(path, sr=None, method="librosa", cache_dir=None):
+    """
+    :param path: path of the wav file
+    :param sr: sampling rate wanted, None to keep the one of the file
+    :param method: one of resampling_methods
+    :param cache_dir: directory of the cache of the resampled wav, None for no cache
+    :return: (wav, sr) as librosa.load, the wav in float32 at the sampling rate sr
+    """
+    if sr is None or get_sampling_rate(path) == sr:  # nothing to resample, nothing to cache
+        wav, sr_orig = read_wav(path)
+        return resample(wav, sr_orig, sr, method), sr_orig if sr is None else sr
+    return resample_cached(lambda: read_wav(path), path, sr, method, cache_dir), sr
+
+
+def load_wav_range(path, start_time, end_time, sr, method="librosa", cache_dir=None):
+    """
+    :param path: path of the wav file
+    :param start_time: beginning (in sec) of the part of the wav wanted
+    :param end_time: end (in sec) of the part of the wav wanted
+    :param sr: sampling rate wanted
+    :param method: one of resampling_methods
+    :param cache_dir: directory of the cache of the resampled wav, None for no cache
+    :return: the points floor(start_time*sr) to floor(end_time*sr) (included) of the wav at the sampling rate sr,
+    limited to the duration of the file. Only this part of the file is decoded and resampled (and cached).
+    """
+    sr_orig, n_points_orig = get_wav_info(path)
+    start = int(np.floor(start_time * sr))
+    stop = min(int(np.floor(end_time * sr)) + 1, int(np.ceil(n_points_orig * float(sr) / sr_orig)))
+    if sr_orig == sr:
+        return read_wav(path, start, stop)[0]
+    source_range = (int(np.floor(start * float(sr_orig) / sr)),
+                    min(int(np.ceil(stop * float(sr_orig) / sr)), n_points_orig))
+    wav = resample_cached(lambda: read_wav(path, *source_range), path, sr, method, cache_dir, source_range)
+    if len(wav) < stop - start:
+        wav = np.pad(wav, (0, stop - start - len(wav)), "edge")
+    return wav[:stop - start]
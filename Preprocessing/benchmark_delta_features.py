@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Benchmark and equivalence check of the calculation of the Delta features (tools_preprocessing.get_delta_features).
+    Compares the previous implementation (one shifted copy of the frames per lag) with the current one (one
+    convolution along the time axis), on one utterance and on a batch of utterances concatenated (offsets).
+    Raises an AssertionError if the results are not the same.
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import numpy as np
+import time
+import argparse
+from Preprocessing.tools_preprocessing import get_delta_features
+
+
+def get_delta_features_per_lag(array, window=5):
+    """
+    previous implementation of get_delta_features, kept as reference
+    """
+    all_diff = []
+    for lag in range(1, window + 1):
+        padding = np.ones((lag, array.shape[1]))
+        past = np.concatenate([padding * array[0], array[:-lag]])
+        future = np.concatenate([array[lag:], padding * array[-1]])
+        all_diff.append(future - past)
+    tempo = np.array([all_diff[lag] * lag for lag in range(window)])
+    norm = 2 * np.sum([i ** 2 for i in range(1, window + 1)])
+    delta_features = np.sum(tempo, axis=0) / norm
+    return delta_features
+
+
+def check_delta_features(lengths, tolerance=1e-10):
+    """
+    :param lengths: list of # of frames of the utterances
+    :param tolerance: max difference accepted between the two implementations
+    check that the current implementation gives the same results as the previous one, utterance per utterance and
+    for the utterances concatenated
+    """
+    utterances = [np.random.randn(length, 13).cumsum(axis=0) for length in lengths]
+    references = [get_delta_features_per_lag(u) for u in utterances]
+    for utterance, reference in zip(utterances, references):
+        assert np.max(np.abs(get_delta_features(utterance) - reference)) < tolerance
+    offsets = np.cumsum([0] + lengths)
+    batch = get_delta_features(np.concatenate(utterances), offsets=offsets)
+    assert batch.shape == (offsets[-1], 13)
+    assert np.max(np.abs(batch - np.concatenate(references))) < tolerance
+    print("same results for {} utterances (alone and concatenated)".format(len(lengths)))
+
+
+def benchmark_delta_features(lengths, n_repeat):
+    """
+    :param lengths: list of # of frames of the utterances
+    :param n_repeat: # of times each calculation is done
+    print the time to calculate the Delta features of all the utterances with each implementation
+    """
+    utterances = [np.random.randn(length, 13) for length in lengths]
+    offsets = np.cumsum([0] + lengths)
+    batch = np.concatenate(utterances)
+    times = []
+    for calculation in [lambda: [get_delta_features_per_lag(u) for u in utterances],
+                        lambda: [get_delta_features(u) for u in utterances],
+                        lambda: get_delta_features(batch, offsets=offsets)]:
+        t0 = time.perf_counter()
+        for _ in range(n_repeat):
+            calculation()
+        times.append((time.perf_counter() - t0) / n_repeat)
+    print("{} utterances, {} frames : per lag {:.2f}ms, convolution {:.2f}ms (x{:.1f}), "
+          "batch {:.2f}ms (x{:.1f})".format(len(lengths), offsets[-1], times[0] * 1000, times[1] * 1000,
+                                           times[0] / times[1], times[2] * 1000, times[0] / times[2]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark of the calculation of the Delta features')
+    parser.add_argument('--n_utterances', type=int, default=100,
+                        help='# of utterances')
+    parser.add_argument('--n_repeat', type=int, default=20,
+                        help='# of times each calculation is done')
+    args = parser.parse_args()
+    lengths = list(np.random.randint(6, 1000, args.n_utterances))
+    check_delta_features(lengths + [6, 7, 11, 12])
+    benchmark_delta_features(lengths, args.n_repeat)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Benchmark of the smoothing of the ema trajectories (Speaker.smooth_data).
+    Compares the previous implementation (one np.convolve per articulator, filter designed at each call) with the
+    vectorized one (smooth_channels, filter designed once) on random trajectories of the length of long mocha
+    utterances (500Hz), and checks that the results are the same up to the floating point rounding (the sums are not
+    done in the same order, the differences are around 1e-13).
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import numpy as np
+import time
+import argparse
+from Preprocessing.tools_preprocessing import low_pass_filter_weight, get_low_pass_filter, smooth_channels
+
+
+def smooth_data_per_channel(ema, sr, cutoff, pad=30):
+    """
+    previous implementation of Speaker.smooth_data, kept as reference
+    """
+    weights = low_pass_filter_weight(cut_off=cutoff, sampling_rate=sr)
+    my_ema_filtered = np.concatenate([np.expand_dims(np.pad(ema[:, k], (pad, pad), "symmetric"), 1)
+                                      for k in range(ema.shape[1])], axis=1)
+    my_ema_filtered = np.concatenate([np.expand_dims(np.convolve(channel, weights, mode='same'), 1)
+                                      for channel in my_ema_filtered.T], axis=1)
+    return my_ema_filtered[pad:-pad, :]
+
+
+def smooth_data_vectorized(ema, sr, cutoff, pad=30):
+    """
+    current implementation of Speaker.smooth_data
+    """
+    return smooth_channels(ema, get_low_pass_filter(cut_off=cutoff, sampling_rate=sr), pad)
+
+
+def benchmark_smoothing(durations, n_repeat, sr=500, cutoff=10, tolerance=1e-10):
+    """
+    :param durations: list of durations (in sec) of the trajectories to smooth
+    :param n_repeat: # of times each smoothing is done
+    :param sr: sampling rate of the ema (500Hz for mocha)
+    :param cutoff: cutoff of the low pass filter
+    :param tolerance: max difference accepted between the two implementations
+    print for each duration the time per call of each implementation and the max difference between their outputs
+    """
+    for duration in durations:
+        ema = np.random.randn(int(duration * sr), 18).cumsum(axis=0)
+        times = []
+        for smooth in [smooth_data_per_channel, smooth_data_vectorized]:
+            t0 = time.perf_counter()
+            for _ in range(n_repeat):
+                ema_smooth = smooth(ema, sr, cutoff)
+            times.append((time.perf_counter() - t0) / n_repeat)
+        diff = np.max(np.abs(smooth_data_per_channel(ema, sr, cutoff) - smooth_data_vectorized(ema, sr, cutoff)))
+        assert diff < tolerance
+        print("{}s ({} points) : per channel {:.3f}ms, vectorized {:.3f}ms, speedup x{:.1f}, max diff {:.1e}".format(
+            duration, len(ema), times[0] * 1000, times[1] * 1000, times[0] / times[1], diff))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark of the smoothing of the ema trajectories')
+    parser.add_argument('--durations', type=str, default="[1,5,20,60]",
+                        help='durations (in sec) of the trajectories')
+    parser.add_argument('--n_repeat', type=int, default=50,
+                        help='# of times each smoothing is done')
+    args = parser.parse_args()
+    durations = [float(d) for d in args.durations[1:-1].split(",")]
+    benchmark_smoothing(durations, args.n_repeat)
@@ -16,11 +16,22 @@ import os
 import numpy as np
 import scipy.signal
 import scipy.interpolate
-from Preprocessing.tools_preprocessing import low_pass_filter_weight
+from Preprocessing.features_extraction import get_mfcc_extractor
+from Preprocessing.audio_io import load_wav, load_wav_range, resample_cached
+from Preprocessing.tools_preprocessing import low_pass_filter_weight, get_fileset_names, hash_file, update_dataset_index, \
+    normalize_npy_in_place, get_low_pass_filter, smooth_channels, compact_context, resample_ema, interpolate_nan
+from Preprocessing.preprocessing_report import Stage_timer, timed, speaker_report, save_report, Progress_line
 import csv
+import time
+import json
+import hashlib
+import glob
 
 root_folder = os.path.dirname(os.getcwd())
 
+""" to increment each time the preprocessing code changes its output, so that the cached utterances are redone """
+PREPROCESSING_VERSION = 3
+
 class Speaker():
     """
     The speakers share some preprocessing function.
@@ -50,11 +61,22 @@ class Speaker():
         self.speakers_with_velum = ["fsew0", "msak0", "faet0", "ffes0", "falh0"]
         self.init_corpus_param()
         self.EMA_files = None
+        self.path_files_treated = None
+        self.N_max = 0
+        self.utterances = None
         if self.speaker in self.speakers_with_velum:
             self.articulators = ['tt_x', 'tt_y', 'td_x', 'td_y', 'tb_x', 'tb_y', 'li_x', 'li_y',
                                  'ul_x', 'ul_y', 'll_x', 'll_y', 'v_x', 'v_y']
-        self.list_EMA_traj = []
-        self.list_MFCC_frames = []
+        self.norm_accumulators = None
+        self.manifest = None
+        self.smooth_after_normalization = True  # last smoothing at the mfcc frame rate
+        self.compact_mfcc = False  # save only the frames (K+10,39) instead of the frames with context (K,429)
+        self.resampling = "librosa"  # resampling method of the wav (see audio_io.resampling_methods)
+        self.ema_resampling = "fft"  # resampling method of the ema (see tools_preprocessing.ema_resampling_methods)
+        self.keep_unsmoothed_ema = True  # also save the ema before the last smoothing in Preprocessed_data/speaker/ema
+        self.articulators_not_available = None
+        self.wav_cache_dir = os.path.join(root_folder, "Preprocessed_data", "wav_cache")  # None for no cache
+        self.timer = Stage_timer()  # time spent in each stage of the preprocessing (see preprocessing_report)
 
         self.std_ema = None
         self.moving_average_ema = None
@@ -102,55 +124,194 @@ class Speaker():
             self.sampling_rate_ema = 100
             self.cutoff = 20
 
+    @timed("smoothing")
     def smooth_data(self, ema, sr=0):
         """
         :param ema: one ema trajectory
         :param sr: sampling rate of the ema trajectory
         :return:  the smoothed ema trajectory
+        all the articulators are filtered at once (see smooth_channels), the filter is designed only once per
+        sampling rate
         """
         pad = 30
         if sr == 0:
             sr = self.sampling_rate_ema
         cutoff = self.cutoff
-        weights = low_pass_filter_weight(cut_off=cutoff,sampling_rate= sr)
+        weights = get_low_pass_filter(cut_off=cutoff, sampling_rate=sr)
+        my_ema_filtered = smooth_channels(ema, weights, pad)
+        return my_ema_filtered
 
-        my_ema_filtered = np.concatenate([np.expand_dims(np.pad(ema[:, k], (pad, pad), "symmetric"), 1)
-                                          for k in range(ema.shape[1])], axis=1)
+    @timed("wav_read")
+    def load_wav(self, path):
+        """
+        :param path: path of a wav file of the speaker
+        :return: the wav at the sampling rate sampling_rate_wav_wanted, resampled with the method self.resampling
+        The resampled wav are kept in wav_cache_dir, so they are resampled only once (see audio_io)
+        """
+        wav, sr = load_wav(path, self.sampling_rate_wav_wanted, self.resampling, self.wav_cache_dir)
+        return wav
 
-        my_ema_filtered = np.concatenate([np.expand_dims(np.convolve(channel, weights, mode='same'), 1)
-                                          for channel in my_ema_filtered.T], axis=1)
-        my_ema_filtered = my_ema_filtered[pad:-pad, :]
-        return my_ema_filtered
+    @timed("wav_read")
+    def load_wav_range(self, path, start_time, end_time):
+        """
+        :param path: path of a wav file of the speaker
+        :param start_time: beginning of the part wanted (in sec)
+        :param end_time: end of the part wanted (in sec)
+        :return: the part of the wav at the sampling rate sampling_rate_wav_wanted, only this part is decoded and
+        resampled (see audio_io.load_wav_range)
+        """
+        return load_wav_range(path, start_time, end_time, self.sampling_rate_wav_wanted, self.resampling,
+                              self.wav_cache_dir)
+
+    @timed("wav_read")
+    def resample_wav(self, wav, source_path):
+        """
+        :param wav: wav at the sampling rate sampling_rate_wav, that is not read from a wav file
+        :param source_path: path of the file the wav comes from
+        :return: the wav at the sampling rate sampling_rate_wav_wanted, kept in wav_cache_dir as for load_wav
+        """
+        return resample_cached(lambda: (wav, self.sampling_rate_wav), source_path, self.sampling_rate_wav_wanted,
+                               self.resampling, self.wav_cache_dir)
+
+    @timed("mfcc")
+    def from_wav_to_mfcc(self, wav):
+        """
+        :param wav: list of intensity points of the wav file (at the sampling rate sampling_rate_wav_wanted)
+        :return: the acoustic features( K,429); where K in the # of frames.
+        calculations of the mfcc, + Delta and DeltaDelta, + 10 context frames (see features_extraction)
+        # of acoustic features per frame: 13 ==> 13*3 = 39 ==> 39*11 = 429.
+        """
+        extractor = get_mfcc_extractor(self.sampling_rate_wav_wanted, self.frame_length, self.hop_length,
+                                       self.n_coeff, self.window)
+        return extractor.from_wav_to_mfcc(wav)
+
+    @timed("save")
+    def save_unsmoothed_ema(self, name, ema_VT):
+        """
+        :param name: name of the utterance
+        :param ema_VT: the ema (K,18) of the utterance before smoothing
+        save the ema before smoothing in Preprocessed_data/speaker/ema, only if keep_unsmoothed_ema. This copy is not
+        used for the training (ema_final is), so it can be skipped to save disk space and time.
+        """
+        path = os.path.join(self.path_files_treated, "ema", name + ".npy")
+        if self.keep_unsmoothed_ema:
+            np.save(path, ema_VT)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    @timed("norm_values")
+    def utterance_stats(self, ema_VT_smooth, mfcc):
+        """
+        :param ema_VT_smooth: smoothed ema (K,18) of one utterance, not normalized
+        :param mfcc: mfcc (K,429) of one utterance, not normalized
+        :return: dictionnary of the sufficient statistics of the utterance for the calculation of the norm values
+        (# of frames, mean and sum of squared deviations of the ema, mean and std of the mfcc)
+        In compact mode the same mean and std are used for the 11 frames of context, so the statistics of the mfcc are
+        those of the central frame (39 features).
+        """
+        if self.compact_mfcc:
+            n_features = mfcc.shape[1] // (2 * self.window + 1)
+            mfcc = mfcc[:, self.window * n_features:(self.window + 1) * n_features]
+        mean_ema = np.mean(ema_VT_smooth, axis=0)
+        stats = {"n_frames": np.array(len(ema_VT_smooth)),
+                 "mean_ema": mean_ema,
+                 "m2_ema": np.sum((ema_VT_smooth - mean_ema) ** 2, axis=0),
+                 "mean_mfcc": np.mean(mfcc, axis=0),
+                 "std_mfcc": np.std(mfcc, axis=0)}
+        return stats
+
+    @timed("nan_repair")
+    def interpolate_nan(self, ema):
+        """
+        :param ema: ema trajectories with missing values
+        :return: the trajectories where the missing values are interpolated (see tools_preprocessing.interpolate_nan)
+        """
+        return interpolate_nan(ema)
+
+    @timed("save")
+    def save_ema_final(self, name, ema_VT_smooth):
+        """
+        :param name: name of the utterance
+        :param ema_VT_smooth: the smoothed ema (K,18) of the utterance, not normalized
+        save the ema in Preprocessed_data/speaker/ema_final
+        """
+        np.save(os.path.join(self.path_files_treated, "ema_final", name), ema_VT_smooth)
 
+    @timed("save")
+    def save_mfcc(self, name, mfcc):
+        """
+        :param name: name of the utterance
+        :param mfcc: mfcc with context (K,429), not normalized
+        save the mfcc in Preprocessed_data/speaker/mfcc, in compact mode only the frames are saved (K+10,39) and the
+        context is added when the mfcc are loaded (see tools_preprocessing.mfcc_with_context)
+        """
+        if self.compact_mfcc:
+            mfcc = compact_context(mfcc, self.window)
+        np.save(os.path.join(self.path_files_treated, "mfcc", name), mfcc)
+
+    def init_norm_accumulators(self, N):
+        """
+        :param N: # of utterances of the speaker
+        initialize the accumulators of the statistics needed for the norm values. Their size does not depend on the
+        length of the utterances : only the mean ema of each sentence is kept (for the moving average)
+        """
+        self.norm_accumulators = {"n_frames": 0,
+                                  "mean_ema": 0,
+                                  "m2_ema": 0,
+                                  "all_mean_ema": np.zeros((N, 18)),
+                                  "sum_mean_mfcc": 0,
+                                  "sum_std_mfcc": 0,
+                                  "n_utterances": 0,
+                                  "waiting": dict()}
+
+    def accumulate_stats(self, i, stats):
+        """
+        :param i: utterance index (wrt the list given by list_utterances)
+        :param stats: statistics of the utterance (see utterance_stats)
+        add the statistics of one utterance to the accumulators, the mean and the sum of squared deviations of the
+        ema are combined with the ones of the previous utterances (parallel algorithm of Chan et al.)
+        """
+        acc = self.norm_accumulators
+        n_a, n_b = acc["n_frames"], int(stats["n_frames"])
+        n = n_a + n_b
+        if n > 0:
+            delta = stats["mean_ema"] - acc["mean_ema"]
+            acc["mean_ema"] = acc["mean_ema"] + delta * n_b / n
+            acc["m2_ema"] = acc["m2_ema"] + stats["m2_ema"] + delta ** 2 * n_a * n_b / n
+            acc["n_frames"] = n
+        acc["all_mean_ema"][i, :] = stats["mean_ema"]
+        acc["sum_mean_mfcc"] = acc["sum_mean_mfcc"] + stats["mean_mfcc"]
+        acc["sum_std_mfcc"] = acc["sum_std_mfcc"] + stats["std_mfcc"]
+        acc["n_utterances"] += 1
+
+    @timed("norm_values")
     def calculate_norm_values(self):
         """
-        based on all the EMA trajectories and frames MFCC calculate the norm values :
+        based on the statistics of all the EMA trajectories and frames MFCC (norm_accumulators) calculate the norm
+        values :
         - mean of ema and mfcc
         - std of ema and mfcc
         - moving average for ema on 60 sentences
         then save those norm values
         """
-        list_EMA_traj = self.list_EMA_traj
-        list_MFCC_frames = self.list_MFCC_frames
+        acc = self.norm_accumulators
 
         pad = 30
-        all_mean_ema = np.array([np.mean(traj, axis=0) for traj in list_EMA_traj]) # (18, n_sentences)
+        all_mean_ema = acc["all_mean_ema"] # (18, n_sentences)
         np.save(os.path.join("norm_values", "all_mean_ema_" + self.speaker), all_mean_ema)
         #    weights_moving_average = low_pass_filter_weight(cut_off=10, sampling_rate=self.sampling_rate_ema)
-        all_mean_ema = np.concatenate([np.expand_dims(np.pad(all_mean_ema[:, k], (pad, pad), "symmetric"), 1)
-                                       for k in range(all_mean_ema.shape[1])], axis=1)
+        all_mean_ema_pad = np.concatenate([np.expand_dims(np.pad(all_mean_ema[:, k], (pad, pad), "symmetric"), 1)
+                                           for k in range(all_mean_ema.shape[1])], axis=1)
 
         moving_average = np.array(
-            [np.mean(all_mean_ema[k - pad:k + pad], axis=0) for k in range(pad, len(all_mean_ema) - pad)])
+            [np.mean(all_mean_ema_pad[k - pad:k + pad], axis=0) for k in range(pad, len(all_mean_ema_pad) - pad)])
 
-        all_EMA_concat = np.concatenate([traj for traj in list_EMA_traj], axis=0)
-        std_ema = np.std(all_EMA_concat, axis=0)
+        std_ema = np.sqrt(acc["m2_ema"] / acc["n_frames"])
         std_ema[std_ema < 1e-3] = 1
 
-        mean_ema = np.mean(np.array([np.mean(traj, axis=0) for traj in list_EMA_traj]),
-                           axis=0)
-        std_mfcc = np.mean(np.array([np.std(frame, axis=0) for frame in list_MFCC_frames]), axis=0)
-        mean_mfcc = np.mean(np.array([np.mean(frame, axis=0) for frame in list_MFCC_frames]), axis=0)
+        mean_ema = np.mean(all_mean_ema, axis=0)
+        std_mfcc = acc["sum_std_mfcc"] / acc["n_utterances"]
+        mean_mfcc = acc["sum_mean_mfcc"] / acc["n_utterances"]
 
         np.save(os.path.join("norm_values", "moving_average_ema_" + self.speaker), moving_average)
         np.save(os.path.join("norm_values", "std_ema_" + self.speaker), std_ema)
@@ -164,86 +325,61 @@ class Speaker():
         self.mean_mfcc = mean_mfcc
         self.std_mfcc = std_mfcc
 
-    def add_vocal_tract(self , my_ema):
+    def get_articulators_not_available(self):
         """
-        calculate 4 'vocal tract' and reorganize the data into a 18 trajectories in a precised order
-        :param my_ema: EMA trajectory with K points
-        :return: a np array (18,K) where the trajectories are sorted, and unavailable trajectories are at 0
-        """
-        def add_lip_aperture(ema):
-            """
-            :param ema: 1 ema trajectory
-            :return: return lip aperture trajectory upperlip_y - lowerlip_y
-            """
-            ind_1, ind_2 = [self.articulators.index("ul_y"), self.articulators.index("ll_y")]
-            lip_aperture = ema[:, ind_1] - ema[:, ind_2]  # upperlip_y - lowerlip_y
-            return lip_aperture
-
-        def add_lip_protrusion(ema):
-            """
-            :param ema: 1 ema trajectory
-            :return: return lip protrusion trajectory (upperlip_x + lowerlip_x)/2
-            """
-            ind_1, ind_2 = [self.articulators.index("ul_x"), self.articulators.index("ll_x")]
-            lip_protrusion = (ema[:, ind_1] + ema[:, ind_2]) / 2
-            return lip_protrusion
-
-        def add_TTCL(ema):  # tongue tip constriction location in degree
-            """
-           :param ema: 1 ema trajectory
-           :return: return tongue tip constriction location in degree trajectory .
-           Formula to check again , corresponds to the cos of the angle between the horizontal and the tongue tip location
-           """
-            ind_1, ind_2 = [self.articulators.index("tt_x"), self.articulators.index("tt_y")]
-            TTCL = ema[:, ind_1] / np.sqrt(ema[:, ind_1] ** 2 + ema[:, ind_2] ** 2)
-            return TTCL
-
-        def add_TBCL(ema):
-            """
-            :param ema: 1 ema trajectory
-           :return: return tongue body constriction location in degree trajectory .
-           Formula to check again , corresponds to the cos of the angle between the horizontal and the tongue body location
-            """
-            ind_1, ind_2 = [self.articulators.index("tb_x"), self.articulators.index("tb_y")]
-            TBCL = ema[:, ind_1] / np.sqrt(ema[:, ind_1] ** 2 + ema[:, ind_2] ** 2)  # upperlip_y - lowerlip_y
-            return TBCL
-
-        def arti_not_available():
-            """
-            reads a csv that contains for each speaker a list of 18 0/1 , element i is 1 if the arti i is available.
-            :return: index of articulations that are not available for this speaker. Based on the local csv file
-            """
+        reads a csv that contains for each speaker a list of 18 0/1 , element i is 1 if the arti i is available.
+        :return: index of articulations that are not available for this speaker. Based on the local csv file.
+        The csv is read only once per speaker.
+        """
+        if self.articulators_not_available is None:
             arti_per_speaker = os.path.join(root_folder, "Preprocessing", "articulators_per_speaker.csv")
             csv.register_dialect('myDialect', delimiter=';')
             with open(arti_per_speaker, 'r') as csvFile:
                 reader = csv.reader(csvFile, dialect="myDialect")
                 next(reader)
                 for row in reader:
-                    if row[0] == self.speaker: # we look for our speaker
+                    if row[0] == self.speaker:  # we look for our speaker
                         arti_to_consider = row[1:19]  # 1 if available
-            arti_not_avail = [k for k, n in enumerate(arti_to_consider) if n == "0"] # 1 of NOT available
-            return arti_not_avail
-
-        lip_aperture = add_lip_aperture(my_ema)
-        lip_protrusion = add_lip_protrusion(my_ema)
-        TTCL = add_TTCL(my_ema)
-        TBCL = add_TBCL(my_ema)
+            self.articulators_not_available = [k for k, n in enumerate(arti_to_consider) if n == "0"]
+        return self.articulators_not_available
 
+    @timed("vocal_tract")
+    def add_vocal_tract(self , my_ema):
+        """
+        calculate 4 'vocal tract' and reorganize the data into a 18 trajectories in a precised order
+        :param my_ema: EMA trajectory with K points
+        :return: a np array (K,18) where the trajectories are sorted, and unavailable trajectories are at 0
+        The 18 trajectories are written in an array allocated once :
+            - 0 to 11 : the 12 articulators (tt, td, tb, li, ul, ll)
+            - 12 : lip aperture upperlip_y - lowerlip_y
+            - 13 : lip protrusion (upperlip_x + lowerlip_x)/2
+            - 14 : tongue tip constriction location (TTCL), cos of the angle between the horizontal and the tongue tip
+            - 15 : tongue body constriction location (TBCL), same for the tongue body
+            - 16, 17 : velum (only for the speakers with velum)
+        """
+        ind = {arti: self.articulators.index(arti) for arti in ["ul_x", "ul_y", "ll_x", "ll_y", "tt_x", "tt_y",
+                                                               "tb_x", "tb_y"]}
+        ema_VT = np.zeros((len(my_ema), 18))
+        ema_VT[:, :12] = my_ema[:, :12]
         if self.speaker in self.speakers_with_velum:  # 14 arti de 0 à 13 (2*6 + 2)
-            my_ema = np.concatenate((my_ema, np.zeros((len(my_ema), 4))), axis=1)
-            my_ema[:, 16:18] = my_ema[:, 12:14]  # met les velum dans les 2 dernieres arti
-            my_ema[:, 12:16] = 0  # les 4 autres colonnes vont etre remplies avec les VT par la suite
-
-        else:
-            my_ema = np.concatenate((my_ema, np.zeros((len(my_ema), 6))), axis=1)
-
-        my_ema[:, 12] = lip_aperture
-        my_ema[:, 13] = lip_protrusion
-        my_ema[:, 14] = TTCL
-        my_ema[:, 15] = TBCL
-        idx_to_ignore = arti_not_available()
-        my_ema[:, idx_to_ignore] = 0
-        return my_ema
+            ema_VT[:, 16:18] = my_ema[:, 12:14]  # met les velum dans les 2 dernieres arti
+        ema_VT[:, 12] = my_ema[:, ind["ul_y"]] - my_ema[:, ind["ll_y"]]
+        ema_VT[:, 13] = (my_ema[:, ind["ul_x"]] + my_ema[:, ind["ll_x"]]) / 2
+        ema_VT[:, 14] = my_ema[:, ind["tt_x"]] / np.sqrt(my_ema[:, ind["tt_x"]] ** 2 + my_ema[:, ind["tt_y"]] ** 2)
+        ema_VT[:, 15] = my_ema[:, ind["tb_x"]] / np.sqrt(my_ema[:, ind["tb_x"]] ** 2 + my_ema[:, ind["tb_y"]] ** 2)
+        ema_VT[:, self.get_articulators_not_available()] = 0
+        return ema_VT
+
+    def load_norm_values(self):
+        """
+        load the norm values saved by calculate_norm_values, useful when the normalization is done by another
+        process than the one that calculated the norm values
+        """
+        self.std_ema = np.load(os.path.join("norm_values", "std_ema_" + self.speaker + ".npy"))
+        self.moving_average_ema = np.load(os.path.join("norm_values", "moving_average_ema_" + self.speaker + ".npy"))
+        self.mean_ema = np.load(os.path.join("norm_values", "mean_ema_" + self.speaker + ".npy"))
+        self.std_mfcc = np.load(os.path.join("norm_values", "std_mfcc_" + self.speaker + ".npy"))
+        self.mean_mfcc = np.load(os.path.join("norm_values", "mean_mfcc_" + self.speaker + ".npy"))
 
     def normalize_sentence(self,i,my_ema_filtered,my_mfcc):
         """
@@ -256,14 +392,306 @@ class Speaker():
         my_mfcc = (my_mfcc - self.mean_mfcc) / self.std_mfcc
         return my_ema_VT,my_mfcc
 
+    @timed("synchro_ema_mfcc")
     def synchro_ema_mfcc(self,my_ema, my_mfcc):
         """
         :param my_ema: ema traj
         :param my_mfcc: corresponding mfcc frames
         :return: ema and mfcc synchronized
-        the ema traj is downsampled to have 1 position for 1 frame mfcc
+        the ema traj is downsampled to have 1 position for 1 frame mfcc, with the method self.ema_resampling (see
+        tools_preprocessing.resample_ema)
         """
-        my_ema = scipy.signal.resample(my_ema, num=len(my_mfcc))
+        my_ema = resample_ema(my_ema, len(my_mfcc), self.sampling_rate_ema, 1 / self.hop_time, self.ema_resampling)
         return my_ema, my_mfcc
 
+    def list_utterances(self):
+        """
+        :return: the names of the utterances to preprocess for this speaker (takes N_max into account)
+        Only valid once prepare_speaker has been run (for some corpus the utterances are created by it)
+        """
+        if self.utterances is None:
+            N = len(self.EMA_files)
+            if self.N_max != 0:
+                N = min(self.N_max, N)
+            self.utterances = self.EMA_files[:N]
+        return self.utterances
+
+    def get_raw_files(self, i):
+        """
+        :param i: utterance index (wrt the list given by list_utterances)
+        :return: list of the paths of the raw files the utterance is computed from, has to be implemented for each corpus
+        """
+        raise NotImplementedError
+
+    def get_preprocessing_parameters(self):
+        """
+        :return: dictionnary of the parameters that have an influence on the preprocessed data of the speaker
+        """
+        return {"version": PREPROCESSING_VERSION,
+                "sampling_rate_wav": self.sampling_rate_wav,
+                "sampling_rate_wav_wanted": self.sampling_rate_wav_wanted,
+                "sampling_rate_ema": self.sampling_rate_ema,
+                "frame_time": self.frame_time,
+                "hop_time": self.hop_time,
+                "n_coeff": self.n_coeff,
+                "window": self.window,
+                "cutoff": self.cutoff,
+                "articulators": self.articulators,
+                "smooth_after_normalization": self.smooth_after_normalization,
+                "compact_mfcc": self.compact_mfcc,
+                "resampling": self.resampling,
+                "ema_resampling": self.ema_resampling,
+                "keep_unsmoothed_ema": self.keep_unsmoothed_ema,
+                "articulators_per_speaker": hash_file(
+                    os.path.join(root_folder, "Preprocessing", "articulators_per_speaker.csv"))}
+
+    @timed("hash")
+    def utterance_key(self, i):
+        """
+        :param i: utterance index (wrt the list given by list_utterances)
+        :return: the key of the utterance in the manifest : hash of the content of its raw files and of the
+        preprocessing parameters. If the key did not change since the last preprocessing the utterance is not redone.
+        """
+        sha = hashlib.sha1(json.dumps(self.get_preprocessing_parameters(), sort_keys=True).encode())
+        for path in self.get_raw_files(i):
+            sha.update(hash_file(path).encode())
+        return sha.hexdigest()
+
+    def load_manifest(self):
+        """
+        read the manifest of the preprocessed data of the speaker (Preprocessed_data/speaker/manifest.json).
+        For each utterance already preprocessed it gives its key, and the moving average it is normalized with
+        ("ema_offset", None if not normalized yet). The norm values shared by all the normalized utterances are in
+        "applied".
+        """
+        path_manifest = os.path.join(self.path_files_treated, "manifest.json")
+        if os.path.exists(path_manifest):
+            with open(path_manifest, 'r') as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {"applied": None, "utterances": dict()}
+        return self.manifest
+
+    def save_manifest(self):
+        """
+        write the manifest, the previous one is replaced only once the new one is completely written
+        """
+        path_manifest = os.path.join(self.path_files_treated, "manifest.json")
+        with open(path_manifest + ".tmp", 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(path_manifest + ".tmp", path_manifest)
+
+    def remove_utterance_files(self, name):
+        """
+        :param name: name of an utterance
+        delete all the preprocessed files of the utterance
+        """
+        for directory in ["ema", "mfcc", "ema_final"]:
+            path = os.path.join(self.path_files_treated, directory, name + ".npy")
+            if os.path.exists(path):
+                os.remove(path)
+        path = os.path.join(self.path_files_treated, "stats", name + ".npz")
+        if os.path.exists(path):
+            os.remove(path)
+
+    def clean_preprocessed_data(self, force=False):
+        """
+        :param force: whether to delete all previous preprocessing of the speaker
+        When there is no manifest (or force) all the previous preprocessed data are deleted since we do not know how
+        they were computed. Otherwise, only the utterances that are not to preprocess anymore are deleted.
+        """
+        if force and os.path.exists(os.path.join(self.path_files_treated, "manifest.json")):
+            os.remove(os.path.join(self.path_files_treated, "manifest.json"))
+        self.load_manifest()
+        if not self.manifest["utterances"]:
+            files = glob.glob(os.path.join(self.path_files_treated, "ema", "*"))
+            files += glob.glob(os.path.join(self.path_files_treated, "mfcc", "*"))
+            files += glob.glob(os.path.join(self.path_files_treated, "ema_final", "*"))
+            files += glob.glob(os.path.join(self.path_files_treated, "stats", "*"))
+            for f in files:
+                os.remove(f)
+        to_keep = set(self.list_utterances())
+        for name in list(self.manifest["utterances"].keys()):
+            if name not in to_keep:
+                self.remove_utterance_files(name)
+                del self.manifest["utterances"][name]
+        self.save_manifest()
+
+    def prepare_speaker(self, force=False):
+        """
+        :param force: whether to redo all the utterances even if they did not change
+        steps to do once for the speaker before its utterances can be treated independently from each other
+        """
+        self.create_missing_dir()
+        self.clean_preprocessed_data(force)
+
+    def preprocess_utterance_cached(self, i, previous_key=None):
+        """
+        :param i: utterance index (wrt the list given by list_utterances)
+        :param previous_key: key of the utterance in the manifest (None if the utterance was not preprocessed)
+        :return: the key of the utterance, and its statistics (None if the utterance did not change and was skipped)
+        first pass on the utterance only if its raw files or the parameters changed, the statistics are saved in
+        Preprocessed_data/speaker/stats so that the norm values can be calculated without redoing the utterance.
+        """
+        name = self.list_utterances()[i]
+        key = self.utterance_key(i)
+        path_stats = os.path.join(self.path_files_treated, "stats", name + ".npz")
+        if key == previous_key and os.path.exists(path_stats) and \
+                os.path.exists(os.path.join(self.path_files_treated, "ema_final", name + ".npy")):
+            return key, None
+        ema_VT_smooth, mfcc = self.preprocess_utterance(i)
+        stats = self.utterance_stats(ema_VT_smooth, mfcc)
+        with self.timer.stage("save"):
+            np.savez(path_stats, **stats)
+        self.timer.add_files(self.get_raw_files(i))
+        self.timer.add_files([os.path.join(self.path_files_treated, directory, name + ".npy")
+                              for directory in ["ema", "mfcc", "ema_final"]] + [path_stats], written=True)
+        return key, stats
+
+    def register_utterance(self, i, key, stats):
+        """
+        :param i: utterance index (wrt the list given by list_utterances)
+        :param key: key of the utterance, returned by preprocess_utterance_cached
+        :param stats: statistics of the utterance, None if it was skipped (then the saved statistics are read)
+        update the manifest and the norm accumulators with the result of the first pass on the utterance
+        """
+        name = self.list_utterances()[i]
+        if stats is None:
+            stats = dict(np.load(os.path.join(self.path_files_treated, "stats", name + ".npz")))
+        else:
+            self.manifest["utterances"][name] = {"key": key, "n_frames": int(stats["n_frames"]), "ema_offset": None}
+        if self.norm_accumulators is None:
+            self.init_norm_accumulators(len(self.list_utterances()))
+        # the statistics are accumulated in the order of the utterances so that the norm values do not depend on the
+        # order in which the processes finish (else an unchanged speaker would be normalized again)
+        acc = self.norm_accumulators
+        acc["waiting"][i] = stats
+        while acc["n_utterances"] in acc["waiting"]:
+            self.accumulate_stats(acc["n_utterances"], acc["waiting"].pop(acc["n_utterances"]))
+
+    def normalization_to_do(self, i):
+        """
+        :param i: utterance index (wrt the list given by list_utterances)
+        :return: (whether the utterance has to be normalized, the norm values it is currently normalized with or None
+        if it is not normalized yet)
+        If the utterance has to be normalized its key is put aside until register_normalization, so that if the
+        preprocessing is stopped before the end the utterance is redone the next time.
+        """
+        entry = self.manifest["utterances"][self.list_utterances()[i]]
+        applied = self.manifest["applied"]
+        if entry["ema_offset"] is None:
+            previous = None
+        elif np.array_equal(entry["ema_offset"], self.moving_average_ema[i, :]) and \
+                np.array_equal(applied["std_ema"], self.std_ema) and \
+                np.array_equal(applied["mean_mfcc"], self.mean_mfcc) and \
+                np.array_equal(applied["std_mfcc"], self.std_mfcc):
+            return False, None
+        else:
+            previous = {k: np.array(v) for k, v in applied.items()}
+            previous["ema_offset"] = np.array(entry["ema_offset"])
+        entry["pending_key"] = entry.pop("key")
+        return True, previous
+
+    def register_normalization(self, i):
+        """
+        :param i: utterance index (wrt the list given by list_utterances)
+        update the manifest once the utterance is normalized with the current norm values
+        """
+        entry = self.manifest["utterances"][self.list_utterances()[i]]
+        entry["ema_offset"] = self.moving_average_ema[i, :].tolist()
+        entry["key"] = entry.pop("pending_key")
 
+    def register_norm_values(self):
+        """
+        update the manifest once all the utterances are normalized with the current norm values, and write it
+        """
+        self.manifest["applied"] = {"std_ema": self.std_ema.tolist(), "mean_mfcc": self.mean_mfcc.tolist(),
+                                    "std_mfcc": self.std_mfcc.tolist()}
+        self.save_manifest()
+
+    def preprocess_utterance(self, i):
+        """
+        :param i: utterance index (wrt the list given by list_utterances)
+        :return: the smoothed ema (K,18) and the mfcc (K,429) of the utterance, not normalized yet
+        first pass on one utterance, has to be implemented for each corpus
+        """
+        raise NotImplementedError
+
+    @timed("normalization")
+    def normalize_utterance(self, i, previous=None):
+        """
+        :param i: utterance index (wrt the list given by list_utterances)
+        :param previous: norm values the utterance is already normalized with (see normalization_to_do), None if the
+        utterance is not normalized yet
+        second pass on one utterance, once the norm values are known : normalization and last smoothing of the
+        trajectories. Final data are in Preprocessed_data/speaker/ema_final and mfcc
+        If the utterance was normalized with previous norm values, it is first unnormalized. Since the low pass filter
+        has a gain of 1 the last smoothing commutes with the normalization, so it is not done twice.
+        The files are normalized in place (memory mapped) instead of being loaded and saved again.
+        """
+        name = self.list_utterances()[i]
+        if previous is None:
+            previous = {"ema_offset": None, "std_ema": None, "mean_mfcc": None, "std_mfcc": None}
+        normalize_npy_in_place(os.path.join(self.path_files_treated, "mfcc", name + ".npy"), self.mean_mfcc,
+                               self.std_mfcc, previous["mean_mfcc"], previous["std_mfcc"])
+        if self.smooth_after_normalization and previous["std_ema"] is None:
+            ema_VT_smooth = np.load(os.path.join(self.path_files_treated, "ema_final", name + ".npy"), mmap_mode='r+')
+            ema_VT_smooth_norma = (ema_VT_smooth - self.moving_average_ema[i, :]) / self.std_ema
+            new_sr = 1 / self.hop_time  # we did undersampling of ema traj for 1 point per frame mfcc
+                                        # so about 1 point every hoptime sec.
+            ema_VT_smooth[:] = self.smooth_data(ema_VT_smooth_norma, new_sr)
+            ema_VT_smooth.flush()
+            del ema_VT_smooth
+        else:
+            normalize_npy_in_place(os.path.join(self.path_files_treated, "ema_final", name + ".npy"),
+                                   self.moving_average_ema[i, :], self.std_ema,
+                                   previous["ema_offset"], previous["std_ema"])
+        self.timer.add_files([os.path.join(self.path_files_treated, directory, name + ".npy")
+                              for directory in ["mfcc", "ema_final"]], written=True)
+
+    def Preprocessing_general_speaker(self, force=False):
+        """
+        :param force: whether to redo all the utterances even if they did not change since the last preprocessing
+        Go through the sentences one by one.
+            - reads ema data and turn it to a (K,18) array where arti are in a precise order, interploate missing values,
+        smooth the trajectories, remove silences at the beginning and the end, undersample to have 1 position per
+        frame mfcc, calculate the statistics needed for the norm values
+            - reads the wav file, calculate the associated acoustic features (mfcc+delta+ deltadelta+contextframes) ,
+        add their statistics
+        The utterances whose raw files and parameters did not change since the last preprocessing are skipped.
+        Then calculate the normvalues based on the statistics of all the utterances for this speaker
+        Finally : normalization and last smoothing of the trajectories (only for those whose norm values changed)
+        Final data are in Preprocessed_data/speaker/ema_final.npy and  mfcc.npy
+        This is the serial version, main_preprocessing schedules the same steps over several processes.
+        The time spent in each stage is added to Preprocessed_data/preprocessing_report.json (see
+        preprocessing_report), and a progress line gives the ETA.
+        """
+        start = time.perf_counter()
+        self.timer.reset()
+        with self.timer.stage("other"):
+            self.prepare_speaker(force)
+        N = len(self.list_utterances())
+        progress = Progress_line(N, "utterances of " + self.speaker)
+        n_preprocessed = 0
+        for i in range(N):
+            with self.timer.stage("other"):
+                entry = self.manifest["utterances"].get(self.list_utterances()[i], dict())
+                key, stats = self.preprocess_utterance_cached(i, entry.get("key"))
+                self.register_utterance(i, key, stats)
+            n_preprocessed += stats is not None
+            progress.update()
+        self.calculate_norm_values()
+        to_do = [self.normalization_to_do(i) for i in range(N)]
+        self.save_manifest()
+        for i in range(N):
+            if to_do[i][0]:
+                with self.timer.stage("other"):
+                    self.normalize_utterance(i, to_do[i][1])
+                    self.register_normalization(i)
+        self.register_norm_values()
+        #  split_sentences(speaker)   #possibility to cut to long sentences, see also max_length in train.py
+        get_fileset_names(self.speaker)
+        update_dataset_index(self.speaker)
+        wall_time = time.perf_counter() - start
+        save_report({self.speaker: speaker_report(self, wall_time, n_preprocessed, sum(t[0] for t in to_do))},
+                    wall_time)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Extraction of the acoustic features, shared by all the corpus and by the predictions on new wav files.
+    For one wav file the acoustic features are (K,429) : 13 mfcc + Delta + DeltaDelta = 39 features per frame, with the
+    features of the 5 frames before and after each frame (context).
+    The mfcc are the same as librosa.feature.mfcc of librosa 0.6.3 (the version of the requirements) : hann window,
+    128 mel bands, log power with a dynamic of 80dB, orthonormal DCT, and the wav padded by reflection at both ends
+    (pad_mode "reflect", the default of librosa 0.6.3 ; since librosa 0.10 the default is "constant", which changes the
+    first and last 2 frames). The window, the mel basis and the DCT matrix are calculated only once, and
+    the frames of several wav files are transformed together in the same calls.
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import numpy as np
+import scipy.signal
+import librosa
+from numpy.lib.stride_tricks import as_strided
+from Preprocessing.tools_preprocessing import get_delta_features, add_context
+
+
+class MFCC_extractor(object):
+    """
+    calculates the acoustic features of wav files, for given parameters (sampling rate, size of the frames ...).
+    Use get_mfcc_extractor to get an extractor, so that the one with the same parameters is reused.
+    """
+    def __init__(self, sampling_rate=16000, frame_length=400, hop_length=160, n_coeff=13, window=5, n_mels=128,
+                 top_db=80.0, pad_mode="reflect"):
+        """
+        :param sampling_rate: sampling rate of the wav
+        :param frame_length: # of points of the wav in one frame (size of the fft)
+        :param hop_length: # of points of the wav between two frames
+        :param n_coeff: # of mfcc per frame
+        :param window: # of frames of context added on each side
+        :param n_mels: # of mel bands
+        :param top_db: dynamic (in dB) kept in the log mel spectrogram of each wav
+        :param pad_mode: mode of np.pad for the frame_length/2 points added at each end of the wav, "reflect" as
+        librosa 0.6.3 (used for the preprocessed data), "constant" (zeros) as librosa >= 0.10
+        """
+        self.sampling_rate = sampling_rate
+        self.frame_length = frame_length
+        self.hop_length = hop_length
+        self.n_coeff = n_coeff
+        self.window = window
+        self.top_db = top_db
+        self.pad_mode = pad_mode
+        self.fft_window = scipy.signal.get_window("hann", frame_length, fftbins=True)
+        self.mel_basis = librosa.filters.mel(sr=sampling_rate, n_fft=frame_length, n_mels=n_mels).T  # (n_fft/2+1,n_mels)
+        samples = np.arange(1, 2 * n_mels, 2) * np.pi / (2.0 * n_mels)
+        dct_basis = np.cos(np.outer(np.arange(n_coeff), samples)) * np.sqrt(2.0 / n_mels)
+        dct_basis[0, :] = 1.0 / np.sqrt(n_mels)
+        self.dct_basis = dct_basis.T  # (n_mels,n_coeff)
+
+    def get_frames(self, wav):
+        """
+        :param wav: one wav (N points)
+        :return: (K, frame_length) view on the wav padded (pad_mode) of frame_length/2 points on each side, K frames
+        """
+        wav = np.pad(np.ascontiguousarray(wav), int(self.frame_length // 2), mode=self.pad_mode)
+        n_frames = 1 + (len(wav) - self.frame_length) // self.hop_length
+        return as_strided(wav, shape=(n_frames, self.frame_length),
+                          strides=(wav.strides[0] * self.hop_length, wav.strides[0]), writeable=False)
+
+    def get_mfcc(self, wavs):
+        """
+        :param wavs: list of wav
+        :return: list of the mfcc (K,n_coeff) of each wav
+        the frames of all the wav are stacked to do the fft, the mel projection and the DCT in one call each
+        """
+        frames = [self.get_frames(wav) for wav in wavs]
+        offsets = np.cumsum([0] + [len(f) for f in frames])
+        spectrum = np.fft.rfft(np.concatenate(frames) * self.fft_window, axis=1)
+        power = np.abs(spectrum.astype(np.complex64)) ** 2  # the stft of librosa is in complex64
+        log_mel = 10.0 * np.log10(np.maximum(1e-10, np.dot(power, self.mel_basis)))
+        if self.top_db is not None:
+            max_per_wav = np.array([np.max(log_mel[offsets[k]:offsets[k + 1]]) for k in range(len(wavs))])
+            log_mel = np.maximum(log_mel, np.repeat(max_per_wav - self.top_db, np.diff(offsets))[:, None])
+        mfcc = np.dot(log_mel, self.dct_basis)
+        return [mfcc[offsets[k]:offsets[k + 1]] for k in range(len(wavs))]
+
+    def get_features(self, wavs):
+        """
+        :param wavs: list of wav
+        :return: list of the acoustic features (K,429) of each wav : mfcc + Delta + DeltaDelta and context
+        """
+        all_mfcc = self.get_mfcc(wavs)
+        offsets = np.cumsum([0] + [len(mfcc) for mfcc in all_mfcc])
+        mfcc = np.concatenate(all_mfcc)
+        dyna_features = get_delta_features(mfcc, offsets=offsets)
+        dyna_features_2 = get_delta_features(dyna_features, offsets=offsets)
+        mfcc = np.concatenate((mfcc, dyna_features, dyna_features_2), axis=1)
+        return [add_context(mfcc[offsets[k]:offsets[k + 1]], self.window) for k in range(len(wavs))]
+
+    def from_wav_to_mfcc(self, wav):
+        """
+        :param wav: one wav
+        :return: the acoustic features (K,429) of the wav
+        """
+        return self.get_features([wav])[0]
+
+
+mfcc_extractors = dict()  # extractors already created, per parameters
+
+
+def get_mfcc_extractor(sampling_rate=16000, frame_length=400, hop_length=160, n_coeff=13, window=5,
+                       pad_mode="reflect"):
+    """
+    :return: the MFCC_extractor for those parameters, created only once per process
+    """
+    parameters = (sampling_rate, frame_length, hop_length, n_coeff, window, pad_mode)
+    if parameters not in mfcc_extractors:
+        mfcc_extractors[parameters] = MFCC_extractor(*parameters[:5], pad_mode=pad_mode)
+    return mfcc_extractors[parameters]
@@ -5,12 +5,17 @@ parentdir = os.path.dirname(currentdir)
 sys.path.insert(0, parentdir)
 from os.path import dirname
 
-from Preprocessing.preprocessing_haskins import Preprocessing_general_haskins
-from Preprocessing.preprocessing_mngu0 import Preprocessing_general_mngu0
-from Preprocessing.preprocessing_usc_timit import Preprocessing_general_usc
-from Preprocessing.preprocessing_mocha import Preprocessing_general_mocha
+from Preprocessing.preprocessing_haskins import Preprocessing_general_haskins, Speaker_Haskins
+from Preprocessing.preprocessing_mngu0 import Preprocessing_general_mngu0, Speaker_MNGU0
+from Preprocessing.preprocessing_usc_timit import Preprocessing_general_usc, Speaker_usc
+from Preprocessing.preprocessing_mocha import Preprocessing_general_mocha, Speaker_mocha
+from Preprocessing.tools_preprocessing import get_speakers_per_corpus, get_fileset_names, ema_resampling_methods, \
+    pack_speaker, update_dataset_index
+from Preprocessing.audio_io import resampling_methods
+from Preprocessing.preprocessing_report import speaker_report, save_report, Progress_line
 import argparse
-from multiprocessing import Process
+import time
+from multiprocessing import Pool
 
 
 def Preprocessing_general_per_corpus(corp, max, path_to_corpus):
@@ -29,13 +34,206 @@ def Preprocessing_general_per_corpus(corp, max, path_to_corpus):
         Preprocessing_general_mocha(max, path_to_raw=path_to_corpus)
 
 
+def create_speaker(corp, sp, path_to_raw, N_max, compact_mfcc=False, resampling="librosa", wav_cache=True,
+                   ema_resampling="fft", keep_unsmoothed_ema=True):
+    """
+    :param corp: corpus of the speaker
+    :param sp: name of the speaker
+    :param compact_mfcc: whether to save the mfcc without the context frames (see Speaker.save_mfcc)
+    :param resampling: resampling method of the wav (see audio_io.resampling_methods)
+    :param wav_cache: whether to keep the resampled wav in the cache (see Speaker.load_wav)
+    :param ema_resampling: resampling method of the ema (see tools_preprocessing.ema_resampling_methods)
+    :param keep_unsmoothed_ema: whether to save also the ema before the last smoothing (see save_unsmoothed_ema)
+    :return: the Speaker instance (of the child class of the corpus) for this speaker
+    """
+    if corp == "MNGU0":
+        speaker = Speaker_MNGU0(path_to_raw=path_to_raw, N_max=N_max)
+    elif corp == "usc":
+        speaker = Speaker_usc(sp, path_to_raw=path_to_raw, N_max=N_max)
+    elif corp == "Haskins":
+        speaker = Speaker_Haskins(sp, path_to_raw=path_to_raw, N_max=N_max)
+    elif corp == "mocha":
+        speaker = Speaker_mocha(sp, path_to_raw=path_to_raw, N_max=N_max)
+    else:
+        raise NameError("vous navez pas choisi un des corpus")
+    speaker.compact_mfcc = compact_mfcc
+    speaker.resampling = resampling
+    speaker.ema_resampling = ema_resampling
+    speaker.keep_unsmoothed_ema = keep_unsmoothed_ema
+    if not wav_cache:
+        speaker.wav_cache_dir = None
+    return speaker
+
+
+speakers_of_this_process = dict()  # each worker keeps its Speaker instances between two tasks
+
+
+def get_speaker_of_this_process(*speaker_args):
+    """
+    :param speaker_args: arguments of create_speaker
+    :return: the Speaker instance for sp, created once per process
+    """
+    sp = speaker_args[1]
+    if sp not in speakers_of_this_process:
+        speakers_of_this_process[sp] = create_speaker(*speaker_args)
+    return speakers_of_this_process[sp]
+
+
+def prepare_speaker_task(task):
+    """
+    :param task: ((arguments of create_speaker), force)
+    :return: (corpus, speaker, number of utterances to preprocess for this speaker, timing of the preparation)
+    """
+    speaker_args, force = task
+    corp, sp = speaker_args[:2]
+    speaker = create_speaker(*speaker_args)
+    with speaker.timer.stage("other"):
+        speaker.prepare_speaker(force)
+    return corp, sp, len(speaker.list_utterances()), speaker.timer.as_dict()
+
+
+def preprocess_utterance_task(task):
+    """
+    :param task: ((arguments of create_speaker), utterance index, key of the utterance in the
+    manifest)
+    :return: (speaker, utterance index, key, statistics of the utterance or None if it did not change, timing of
+    the task)
+    """
+    speaker_args, i, previous_key = task
+    speaker = get_speaker_of_this_process(*speaker_args)
+    speaker.timer.reset()
+    with speaker.timer.stage("other"):
+        key, stats = speaker.preprocess_utterance_cached(i, previous_key)
+    return speaker.speaker, i, key, stats, speaker.timer.as_dict()
+
+
+def normalize_utterance_task(task):
+    """
+    :param task: ((arguments of create_speaker), utterance index, norm values already applied
+    or None)
+    the norm values of the speaker have to be already saved in norm_values
+    :return: (speaker, utterance index, timing of the task)
+    """
+    speaker_args, i, previous = task
+    speaker = get_speaker_of_this_process(*speaker_args)
+    speaker.timer.reset()
+    with speaker.timer.stage("other"):
+        if speaker.std_ema is None:
+            speaker.load_norm_values()
+        speaker.normalize_utterance(i, previous)
+    return speaker.speaker, i, speaker.timer.as_dict()
+
+
+def Preprocessing_general_parallel(corpus, N_max, path_to_raw, n_jobs, force=False, compact_mfcc=False,
+                                   resampling="librosa", wav_cache=True, ema_resampling="fft",
+                                   keep_unsmoothed_ema=True, pack=False, only_speakers=None):
+    """
+    :param corpus: list of the corpus to preprocess
+    :param N_max: max of files to preprocess per speaker (useful for test), 0 to treat all files
+    :param path_to_raw: path to the directory where the folders with the raw data of each corpus are
+    :param n_jobs: number of worker processes
+    :param force: whether to redo all the utterances, even those that did not change since the last preprocessing
+    :param compact_mfcc: whether to save the mfcc without the context frames (K+10,39) instead of (K,429)
+    :param resampling: resampling method of the wav (see audio_io.resampling_methods)
+    :param wav_cache: whether to keep the wav resampled at 16kHz in Preprocessed_data/wav_cache
+    :param ema_resampling: resampling method of the ema to have one position per mfcc frame
+    :param keep_unsmoothed_ema: whether to save also the ema before the last smoothing in Preprocessed_data/sp/ema
+    :param pack: whether to export the data of each speaker in 2 packed arrays for the training (see pack_speaker)
+    :param only_speakers: list of the speakers to preprocess among those of the corpus, None for all of them
+    The preprocessing is split into tasks (corpus, speaker, utterance) that are put in a single work queue
+    shared by n_jobs processes, so that all the processors are busy whatever the size of each corpus.
+    For each speaker :
+        - preparation of the speaker (directories, one file per sentence for usc, manifest)
+        - first pass on each utterance (read, smooth, mfcc, silences, synchronisation), skipped if the raw files and
+        the parameters did not change (see Speaker.utterance_key)
+        - when all its utterances are done (join barrier) the norm values are calculated
+        - second pass on each utterance (normalization), only for the utterances whose norm values changed
+    The speakers are not waiting for each other : the normalization of a speaker starts as soon as its own first
+    pass is over, while the other speakers are still in progress.
+    The workers send the time spent in each stage with the result of each task, the report of the time, bytes and
+    utterances per second per speaker is written in Preprocessed_data/preprocessing_report.json (see
+    preprocessing_report). A progress line gives the ETA of the first pass.
+    """
+    start = time.perf_counter()
+    speakers = [(co, sp) for co in corpus for sp in get_speakers_per_corpus(co)
+                if only_speakers is None or sp in only_speakers]
+    pool = Pool(n_jobs)
+
+    speaker_args = {sp: (co, sp, path_to_raw, N_max, compact_mfcc, resampling, wav_cache, ema_resampling,
+                         keep_unsmoothed_ema)
+                    for co, sp in speakers}
+    n_utterances = dict()
+    timings_prepare = dict()
+    tasks_prepare = [(speaker_args[sp], force) for co, sp in speakers]
+    for co, sp, N, timing in pool.imap_unordered(prepare_speaker_task, tasks_prepare):
+        n_utterances[sp] = N
+        timings_prepare[sp] = timing
+        print("{} utterances to preprocess for {} {}".format(N, co, sp))
+    # speakers with the most utterances first, so that the last tasks in the queue are the shortest ones
+    speakers = sorted([(co, sp) for co, sp in speakers if n_utterances[sp] > 0], key=lambda s: -n_utterances[s[1]])
+
+    main_speakers = {sp: create_speaker(*speaker_args[sp]) for co, sp in speakers}
+    for sp in main_speakers:
+        main_speakers[sp].timer.add(timings_prepare[sp])
+    corpus_of = {sp: co for co, sp in speakers}
+    tasks = []
+    for co, sp in speakers:
+        speaker = main_speakers[sp]
+        speaker.load_manifest()
+        for i, name in enumerate(speaker.list_utterances()):
+            entry = speaker.manifest["utterances"].get(name, dict())
+            tasks.append((speaker_args[sp], i, entry.get("key")))
+    n_left = dict(n_utterances)
+    n_redone = {sp: 0 for sp in n_utterances}
+    progress = Progress_line(len(tasks))
+
+    normalizations = []
+    for sp, i, key, stats, timing in pool.imap_unordered(preprocess_utterance_task, tasks):
+        speaker = main_speakers[sp]
+        speaker.timer.add(timing)
+        speaker.register_utterance(i, key, stats)
+        n_redone[sp] += stats is not None
+        n_left[sp] -= 1
+        progress.update()
+        if n_left[sp] == 0:  # join barrier for this speaker
+            speaker.calculate_norm_values()
+            speaker.norm_accumulators = None
+            tasks_norma = []
+            for j in range(n_utterances[sp]):
+                to_do, previous = speaker.normalization_to_do(j)
+                if to_do:
+                    tasks_norma.append((speaker_args[sp], j, previous))
+            speaker.save_manifest()
+            normalizations.append((sp, pool.map_async(normalize_utterance_task, tasks_norma)))
+            progress.message("norm values done for {}, {} utterances preprocessed, {} to normalize".format(
+                sp, n_redone[sp], len(tasks_norma)))
+
+    reports = dict()
+    for sp, result in normalizations:
+        n_normalized = 0
+        for _, j, timing in result.get():
+            main_speakers[sp].timer.add(timing)
+            main_speakers[sp].register_normalization(j)
+            n_normalized += 1
+        with main_speakers[sp].timer.stage("other"):
+            main_speakers[sp].register_norm_values()
+            get_fileset_names(sp)
+            if pack:
+                pack_speaker(sp)
+            update_dataset_index(sp)
+        reports[sp] = speaker_report(main_speakers[sp], time.perf_counter() - start, n_redone[sp], n_normalized)
+        print("Done", corpus_of[sp], sp)
+    pool.close()
+    pool.join()
+    save_report(reports, time.perf_counter() - start, n_jobs)
+    print("report of the time spent per stage in Preprocessed_data/preprocessing_report.json")
+
+
 if __name__ == '__main__':
     """
     from the cmd to launch preprocess for all the corpuses,
-    parallel computing, 1 processor per corpus 
+    parallel computing, the utterances of all the speakers are shared between n_jobs processes
     """
-    procs = []
-
     parser = argparse.ArgumentParser(description='preprocessing of all the corpuses with parallelization')
     parser.add_argument('--N_max',  type=int, default=0,
                         help='by default ')
@@ -43,6 +241,25 @@ if __name__ == '__main__':
                         help='corpus to preprocess')
     parser.add_argument('--path_to_raw_data', type=str,
                         help='path to the directory where all the folders with the raw data of each corpus are')
+    parser.add_argument('--n_jobs', type=int, default=os.cpu_count(),
+                        help='number of processes used for the preprocessing, by default all the cpu')
+    parser.add_argument('--force', action='store_true',
+                        help='redo all the preprocessing, even the utterances that did not change')
+    parser.add_argument('--compact_mfcc', action='store_true',
+                        help='save only the 39 features of each frame, the 11 frames context is added when loading')
+    parser.add_argument('--resampling', type=str, default="librosa", choices=resampling_methods,
+                        help='resampling method of the wav files that are not at 16kHz')
+    parser.add_argument('--no_wav_cache', action='store_true',
+                        help='do not keep the wav resampled at 16kHz in Preprocessed_data/wav_cache')
+    parser.add_argument('--ema_resampling', type=str, default="fft", choices=ema_resampling_methods,
+                        help='resampling method of the ema to have one position per mfcc frame')
+    parser.add_argument('--no_unsmoothed_ema', action='store_true',
+                        help='do not save the ema before the last smoothing (Preprocessed_data/speaker/ema)')
+    parser.add_argument('--speakers', type=str, default=None,
+                        help='speakers to preprocess among those of the corpus, eg [fsew0,F1], by default all of them')
+    parser.add_argument('--pack', action='store_true',
+                        help='export the mfcc and ema_final of each speaker in 2 packed arrays, faster to load for '
+                             'the training')
 
     root_folder = os.path.dirname(os.getcwd())
 
@@ -57,11 +274,7 @@ if __name__ == '__main__':
         corpus = args.corpus[1:-1].split(",")
     else:
         corpus = args.corpus
-    for co in corpus:
-        proc = Process(target=Preprocessing_general_per_corpus, args=(co, args.N_max, args.path_to_raw_data))
-        procs.append(proc)
-        proc.start()
-
-    for proc in procs:
-        proc.join()
-
+    only_speakers = args.speakers[1:-1].split(",") if args.speakers is not None else None
+    Preprocessing_general_parallel(corpus, args.N_max, args.path_to_raw_data, args.n_jobs, args.force,
+                                   args.compact_mfcc, args.resampling, not args.no_wav_cache, args.ema_resampling,
+                                   not args.no_unsmoothed_ema, args.pack, only_speakers)
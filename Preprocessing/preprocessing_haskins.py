@@ -20,7 +20,7 @@ sys.path.insert(0,parentdir)
 import scipy.signal
 import scipy.interpolate
 import scipy.io as sio
-from Preprocessing.tools_preprocessing import get_fileset_names, get_delta_features, split_sentences
+import scipy.io.wavfile
 
 from os.path import dirname
 import numpy as np
@@ -29,6 +29,7 @@ import scipy.interpolate
 import librosa
 from Preprocessing.tools_preprocessing import get_speakers_per_corpus
 from Preprocessing.class_corpus import Speaker
+from Preprocessing.preprocessing_report import timed
 import glob
 
 root_path = dirname(dirname(os.path.realpath(__file__)))
@@ -69,7 +70,7 @@ class Speaker_Haskins(Speaker):
 
     def create_missing_dir(self):
         """
-        delete all previous preprocessing, create needed directories
+        create needed directories, the previous preprocessing is deleted only if needed (see clean_preprocessed_data)
         """
         if not os.path.exists(os.path.join(self.path_files_treated, "ema")):
             os.makedirs(os.path.join(self.path_files_treated, "ema"))
@@ -77,24 +78,27 @@ class Speaker_Haskins(Speaker):
             os.makedirs(os.path.join(self.path_files_treated, "mfcc"))
         if not os.path.exists(os.path.join(self.path_files_treated, "ema_final")):
             os.makedirs(os.path.join(self.path_files_treated, "ema_final"))
+        if not os.path.exists(os.path.join(self.path_files_treated, "stats")):
+            os.makedirs(os.path.join(self.path_files_treated, "stats"))
 
         # We are going tp create the wav files form the matlab format files given for haskins
         if not os.path.exists(os.path.join(self.root_path, "Raw_data", self.corpus, self.speaker, "wav")):
             os.makedirs(os.path.join(self.root_path, "Raw_data", self.corpus, self.speaker, "wav"))
 
-        files = glob.glob(os.path.join(self.path_files_treated, "ema", "*"))
-        files += glob.glob(os.path.join(self.path_files_treated, "mfcc", "*"))
-        files += glob.glob(os.path.join(self.path_files_treated, "ema_final", "*"))
-        files += glob.glob(os.path.join(self.root_path, "Raw_data", self.corpus, self.speaker, "wav", "*"))
-        for f in files:
-            os.remove(f)
+    def get_raw_files(self, i):
+        """
+        :param i: utterance index (wrt the list EMA_files)
+        :return: path of the matlab file of the utterance (the wav file is created from it)
+        """
+        return [os.path.join(self.path_files_brutes, self.EMA_files[i] + ".mat")]
 
+    @timed("ema_read")
     def read_ema_and_wav(self, k):
         """
         :param k: index wrt EMA_files list of the file to read
         :return: ema positions for 12 arti (K',12) , acoustic features (K,429); where K in the # of frames.
         read and reorganize the ema traj,
-        calculations of the mfcc with librosa , + Delta and DeltaDelta, + 10 context frames
+        calculations of the mfcc (see features_extraction), + Delta and DeltaDelta, + 10 context frames
         # of acoustic features per frame: 13 ==> 13*3 = 39 ==> 39*11 = 429.
         parameters for mfcc calculation are defined in class_corpus
         """
@@ -115,22 +119,14 @@ class Speaker_Haskins(Speaker):
 
         # We create wav files form intensity matlab files
         wav_data = data[0][2][:, 0]
-        librosa.output.write_wav(os.path.join(self.root_path, "Raw_data", self.corpus, self.speaker,
-                                              "wav", self.EMA_files[k] + ".wav"), wav_data, self.sampling_rate_wav)
-        wav, sr = librosa.load(os.path.join(self.root_path, "Raw_data", self.corpus, self.speaker, "wav",
-                                            self.EMA_files[k] + ".wav"), sr=self.sampling_rate_wav_wanted)
+        scipy.io.wavfile.write(os.path.join(self.root_path, "Raw_data", self.corpus, self.speaker,
+                                            "wav", self.EMA_files[k] + ".wav"), self.sampling_rate_wav, wav_data)
+        wav = self.resample_wav(wav_data.astype(np.float32),
+                                os.path.join(self.path_files_brutes, self.EMA_files[k] + ".mat"))
         # np.save(os.path.join(root_path, "Raw_data", corpus, speaker, "wav",
         #                      EMA_files[k]), wav)
         wav = 0.5 * wav / np.max(wav)
-        mfcc = librosa.feature.mfcc(y=wav, sr=self.sampling_rate_wav_wanted, n_mfcc=self.n_coeff,
-                                       n_fft=self.frame_length, hop_length=self.hop_length).T
-        dyna_features = get_delta_features(mfcc)
-        dyna_features_2 = get_delta_features(dyna_features)
-        mfcc = np.concatenate((mfcc, dyna_features, dyna_features_2), axis=1)
-        padding = np.zeros((self.window, mfcc.shape[1]))
-        frames = np.concatenate([padding, mfcc, padding])
-        full_window = 1 + 2 * self.window
-        mfcc = np.concatenate([frames[i:i + len(mfcc)] for i in range(full_window)], axis=1)
+        mfcc = self.from_wav_to_mfcc(wav)
 
         marge = 0
         xtrm = detect_silence(data)
@@ -143,54 +139,22 @@ class Speaker_Haskins(Speaker):
         ema = ema[xtrm_temp_ema[0]:xtrm_temp_ema[1], :]
         mfcc = mfcc[xtrm_temp_mfcc[0]:xtrm_temp_mfcc[1]]
 
-        n_frames_wanted = mfcc.shape[0]
-        ema = scipy.signal.resample(ema, num=n_frames_wanted)
+        ema, mfcc = self.synchro_ema_mfcc(ema, mfcc)
         return ema, mfcc
 
-    def Preprocessing_general_speaker(self):
+    def preprocess_utterance(self, i):
         """
-        Go through the sentences one by one.
-            - reads ema data and turn it to a (K,18) array where arti are in a precise order, interploate missing values,
-        smooth the trajectories, remove silences at the beginning and the end, undersample to have 1 position per
-        frame mfcc, add it to the list of EMA traj for this speaker
-            - reads the wav file, calculate the associated acoustic features (mfcc+delta+ deltadelta+contextframes) ,
-        add it to the list of the MFCC FEATURES for this speaker.
-        Then calculate the normvalues based on the list of ema/mfcc data for this speaker
-        Finally : normalization and last smoothing of the trajectories.
-        Final data are in Preprocessed_data/speaker/ema_final.npy and  mfcc.npy
+        :param i: utterance index (wrt the list EMA_files)
+        :return: the smoothed ema (K,18) and the mfcc (K,429) of the utterance, not normalized yet
+        reads ema and wav data (see read_ema_and_wav), turns the ema to a (K,18) array and smooth the trajectories
         """
-
-        self.create_missing_dir()
-        N = len(self.EMA_files)
-        if self.N_max != 0:
-            N = int(self.N_max)
-
-        for i in range(N):
-            ema, mfcc = self.read_ema_and_wav(i)
-            ema_VT = self.add_vocal_tract(ema)
-            ema_VT_smooth = self.smooth_data(ema_VT)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema", self.EMA_files[i]), ema_VT)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "mfcc", self.EMA_files[i]), mfcc)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema_final",
-                                 self.EMA_files[i]), ema_VT_smooth)
-            self.list_EMA_traj.append(ema_VT_smooth)
-            self.list_MFCC_frames.append(mfcc)
-        self.calculate_norm_values()
-
-        for i in range(N):
-            ema_VT_smooth = np.load(os.path.join(
-                root_path, "Preprocessed_data", self.speaker, "ema_final", self.EMA_files[i] + ".npy"))
-            mfcc = np.load(os.path.join(
-                root_path, "Preprocessed_data", self.speaker, "mfcc", self.EMA_files[i] + ".npy"))
-            ema_VT_smooth_norma, mfcc = self.normalize_sentence(i, ema_VT_smooth, mfcc)
-            new_sr = 1 / self.hop_time
-            ema_VT_smooth_norma = self.smooth_data(ema_VT_smooth_norma, new_sr)
-
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "mfcc", self.EMA_files[i]), mfcc)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema_final", self.EMA_files[i]),
-                    ema_VT_smooth_norma)
-        #  split_sentences(speaker)
-        get_fileset_names(self.speaker)
+        ema, mfcc = self.read_ema_and_wav(i)
+        ema_VT = self.add_vocal_tract(ema)
+        ema_VT_smooth = self.smooth_data(ema_VT)
+        self.save_unsmoothed_ema(self.EMA_files[i], ema_VT)
+        self.save_mfcc(self.EMA_files[i], mfcc)
+        self.save_ema_final(self.EMA_files[i], ema_VT_smooth)
+        return ema_VT_smooth, mfcc
 
 
 def Preprocessing_general_haskins(N_max, path_to_raw):
@@ -14,7 +14,6 @@ sys.path.insert(0,parentdir)
 import scipy.signal
 import scipy.interpolate
 import scipy.io as sio
-from Preprocessing.tools_preprocessing import get_fileset_names, get_delta_features, split_sentences
 
 from os.path import dirname
 import numpy as np
@@ -22,6 +21,7 @@ import scipy.signal
 import scipy.interpolate
 import librosa
 from Preprocessing.class_corpus import Speaker
+from Preprocessing.preprocessing_report import timed
 import glob
 
 root_path = dirname(dirname(os.path.realpath(__file__)))
@@ -60,11 +60,12 @@ class Speaker_MNGU0(Speaker):
             'jaw_py', 'jaw_pz', 'upperlip_py', 'upperlip_pz',
             'lowerlip_py', 'lowerlip_pz']
         self.n_columns =  87
+        self.smooth_after_normalization = False
 
 
     def create_missing_dir(self):
         """
-        delete all previous preprocessing, create needed directories
+        create needed directories, the previous preprocessing is deleted only if needed (see clean_preprocessed_data)
         """
         if not os.path.exists(os.path.join(os.path.join(self.path_files_treated, "ema"))):
             os.makedirs(os.path.join(self.path_files_treated, "ema"))
@@ -72,15 +73,19 @@ class Speaker_MNGU0(Speaker):
             os.makedirs(os.path.join(self.path_files_treated, "ema_final"))
         if not os.path.exists(os.path.join(os.path.join(self.path_files_treated, "mfcc"))):
             os.makedirs(os.path.join(self.path_files_treated, "mfcc"))
+        if not os.path.exists(os.path.join(os.path.join(self.path_files_treated, "stats"))):
+            os.makedirs(os.path.join(self.path_files_treated, "stats"))
 
-        files = glob.glob(os.path.join(self.path_files_treated, "ema", "*"))
-        files += glob.glob(os.path.join(self.path_files_treated, "ema_final", "*"))
-        files += glob.glob(os.path.join(self.path_files_treated, "mfcc", "*"))
-
-        for f in files:
-            os.remove(f)
-
+    def get_raw_files(self, i):
+        """
+        :param i: utterance index (wrt EMA files)
+        :return: paths of the ema, wav and annotation files of the utterance
+        """
+        return [os.path.join(self.path_ema_files, self.EMA_files[i] + ".ema"),
+                os.path.join(self.path_wav_files, self.EMA_files[i] + ".wav"),
+                os.path.join(self.path_files_annotation, self.EMA_files[i] + ".lab")]
 
+    @timed("ema_read")
     def read_ema_file(self,k):
         """
         read the ema file, first preprocessing,
@@ -105,13 +110,10 @@ class Speaker_MNGU0(Speaker):
             ema_data = ema_data[:, cols_index]
             ema_data = ema_data*100  #initial data in  10^-5m , we turn it to mm
             if np.isnan(ema_data).sum() != 0:
-                # Build a cubic spline out of non-NaN values.
-                spline = scipy.interpolate.splrep( np.argwhere(~np.isnan(ema_data).ravel()), ema_data[~np.isnan(ema_data)], k=3)
-                # Interpolate missing values and replace them.
-                for j in np.argwhere(np.isnan(ema_data)).ravel():
-                    ema_data[j] = scipy.interpolate.splev(j, spline)
+                ema_data = self.interpolate_nan(ema_data)  # cubic spline of the available points, per trajectory
             return ema_data
 
+    @timed("remove_silences")
     def remove_silences(self,k, ema, mfcc):
         """
         :param k:  utterance index (wrt the list EMA_files)
@@ -142,70 +144,28 @@ class Speaker_MNGU0(Speaker):
         ema = ema[xtrm_temp_ema[0]:xtrm_temp_ema[1], :]
         return ema, mfcc
 
-    def from_wav_to_mfcc(self,wav):
-        """
-        :param wav: list of intensity points of the wav file
-        :return: the acoustic features( K,429); where K in the # of frames.
-        calculations of the mfcc with librosa , + Delta and DeltaDelta, + 10 context frames
-        # of acoustic features per frame: 13 ==> 13*3 = 39 ==> 39*11 = 429.
-        parameters for mfcc calculation are defined in class_corpus
+    def preprocess_utterance(self, i):
         """
-        mfcc = librosa.feature.mfcc(y=wav, sr=self.sampling_rate_wav, n_mfcc=self.n_coeff,
-                                    n_fft=self.frame_length, hop_length=self.hop_length
-                                    ).T
-        dyna_features = get_delta_features(mfcc)
-        dyna_features_2 = get_delta_features(dyna_features)
-        mfcc = np.concatenate((mfcc, dyna_features, dyna_features_2), axis=1)
-        padding = np.zeros((self.window, mfcc.shape[1]))
-        frames = np.concatenate([padding, mfcc, padding])
-        full_window = 1 + 2 * self.window
-        mfcc = np.concatenate([frames[i:i + len(mfcc)] for i in range(full_window)], axis=1)
-        return mfcc
-
-    def Preprocessing_general_speaker(self):
-        """
-        Go through the sentences one by one.
+        :param i: utterance index (wrt the list EMA_files)
+        :return: the smoothed ema (K,18) and the mfcc (K,429) of the utterance, not normalized yet
             - reads ema data and turn it to a (K,18) array where arti are in a precise order, interploate missing values,
         smooth the trajectories, remove silences at the beginning and the end, undersample to have 1 position per
-        frame mfcc, add it to the list of EMA traj for this speaker
-            - reads the wav file, calculate the associated acoustic features (mfcc+delta+ deltadelta+contextframes) ,
-        add it to the list of the MFCC FEATURES for this speaker.
-        Then calculate the normvalues based on the list of ema/mfcc data for this speaker
-        Finally : normalization and last smoothing of the trajectories.
-        Final data are in Preprocessed_data/speaker/ema_final.npy and  mfcc.npy
+        frame mfcc
+            - reads the wav file, calculate the associated acoustic features (mfcc+delta+ deltadelta+contextframes)
         """
-
-        self.create_missing_dir()
-        N = len(self.EMA_files)
-        if self.N_max != 0:
-            N = self.N_max
-        for i in range(N):
-            ema = self.read_ema_file(i)
-            ema_VT = self.add_vocal_tract(ema)
-            ema_VT_smooth = self.smooth_data(ema_VT)
-            path_wav = os.path.join(self.path_wav_files, self.EMA_files[i] + '.wav')
-            wav, sr = librosa.load(path_wav, sr=self.sampling_rate_wav)
-            wav = 0.5 * wav / np.max(wav)
-            mfcc = self.from_wav_to_mfcc(wav)
-            ema_VT_smooth, mfcc = self.remove_silences(i, ema_VT_smooth, mfcc)
-            ema_VT_smooth, mfcc = self.synchro_ema_mfcc(ema_VT_smooth, mfcc)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema", self.EMA_files[i]), ema_VT)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "mfcc", self.EMA_files[i]), mfcc)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema_final", self.EMA_files[i]), ema_VT_smooth)
-            self.list_EMA_traj.append(ema_VT_smooth)
-            self.list_MFCC_frames.append(mfcc)
-        self.calculate_norm_values()
-
-        for i in range(N):
-            ema_VT_smooth = np.load(
-                os.path.join(root_path, "Preprocessed_data", self.speaker, "ema_final", self.EMA_files[i] + ".npy"))
-            mfcc = np.load(os.path.join(root_path, "Preprocessed_data", self.speaker, "mfcc", self.EMA_files[i] + ".npy"))
-            ema_VT_smooth_norma, mfcc = self.normalize_sentence(i, ema_VT_smooth, mfcc)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "mfcc", self.EMA_files[i]), mfcc)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema_final", self.EMA_files[i]),
-                    ema_VT_smooth_norma)
-        #  split_sentences(speaker)
-        get_fileset_names(self.speaker)
+        ema = self.read_ema_file(i)
+        ema_VT = self.add_vocal_tract(ema)
+        ema_VT_smooth = self.smooth_data(ema_VT)
+        path_wav = os.path.join(self.path_wav_files, self.EMA_files[i] + '.wav')
+        wav = self.load_wav(path_wav)
+        wav = 0.5 * wav / np.max(wav)
+        mfcc = self.from_wav_to_mfcc(wav)
+        ema_VT_smooth, mfcc = self.remove_silences(i, ema_VT_smooth, mfcc)
+        ema_VT_smooth, mfcc = self.synchro_ema_mfcc(ema_VT_smooth, mfcc)
+        self.save_unsmoothed_ema(self.EMA_files[i], ema_VT)
+        self.save_mfcc(self.EMA_files[i], mfcc)
+        self.save_ema_final(self.EMA_files[i], ema_VT_smooth)
+        return ema_VT_smooth, mfcc
 
 
 def Preprocessing_general_mngu0(N_max, path_to_raw):
@@ -15,7 +15,7 @@ parentdir = os.path.dirname(currentdir)
 sys.path.insert(0,parentdir)
 import scipy.signal
 import scipy.interpolate
-from Preprocessing.tools_preprocessing import get_fileset_names, get_delta_features, split_sentences
+from Preprocessing.tools_preprocessing import normalize_npy_in_place
 
 from os.path import dirname
 import numpy as np
@@ -25,6 +25,7 @@ import scipy.interpolate
 import librosa
 from Preprocessing.tools_preprocessing import get_speakers_per_corpus
 from Preprocessing.class_corpus import Speaker
+from Preprocessing.preprocessing_report import timed
 import glob
 
 root_path = dirname(dirname(os.path.realpath(__file__)))
@@ -54,7 +55,7 @@ class Speaker_mocha(Speaker):
 
     def create_missing_dir(self):
         """
-        delete all previous preprocessing, create needed directories
+        create needed directories, the previous preprocessing is deleted only if needed (see clean_preprocessed_data)
         """
         if not os.path.exists(os.path.join(self.path_files_treated, "ema")):
             os.makedirs(os.path.join(self.path_files_treated, "ema"))
@@ -62,17 +63,28 @@ class Speaker_mocha(Speaker):
             os.makedirs(os.path.join(self.path_files_treated, "mfcc"))
         if not os.path.exists(os.path.join(self.path_files_treated, "ema_final")):
             os.makedirs(os.path.join(self.path_files_treated, "ema_final"))
+        if not os.path.exists(os.path.join(self.path_files_treated, "stats")):
+            os.makedirs(os.path.join(self.path_files_treated, "stats"))
 
         if not os.path.exists(os.path.join(self.path_files_brutes, "wav_cut")):
             os.makedirs(os.path.join(self.path_files_brutes, "wav_cut"))
-        files = glob.glob(os.path.join(self.path_files_treated, "ema", "*"))
-        files += glob.glob(os.path.join(self.path_files_treated, "mfcc", "*"))
-        files += glob.glob(os.path.join(self.path_files_treated, "ema_final", "*"))
-        files += glob.glob(os.path.join(self.path_files_brutes, "wav_cut", "*"))
+        files = glob.glob(os.path.join(self.path_files_brutes, "wav_cut", "*"))
 
         for f in files:
             os.remove(f)
 
+    def get_raw_files(self, i):
+        """
+        :param i: utterance index (wrt the list EMA_files)
+        :return: paths of the ema and wav files of the utterance, and of the annotation file if used
+        """
+        raw_files = [os.path.join(self.path_files_brutes, self.EMA_files[i] + ".ema"),
+                     os.path.join(self.path_files_brutes, self.wav_files[i] + ".wav")]
+        if self.speaker in self.sp_with_trans:
+            raw_files.append(os.path.join(self.path_files_brutes, self.wav_files[i] + ".lab"))
+        return raw_files
+
+    @timed("ema_read")
     def read_ema_file(self,k):
         """
         read the ema file, first preprocessing,
@@ -99,14 +111,10 @@ class Speaker_mocha(Speaker):
             ema_data = ema_data / 100  # met en mm, initallement en 10^-1m
             if np.isnan(ema_data).sum() != 0:
                 print("nombre de nan ", np.isnan(ema_data).sum())
-                # Build a cubic spline out of non-NaN values.
-                spline = scipy.interpolate.splrep(np.argwhere(~np.isnan(ema_data).ravel()),
-                                                  ema_data[~np.isnan(ema_data)], k=3)
-                # Interpolate missing values and replace them.
-                for j in np.argwhere(np.isnan(ema_data)).ravel():
-                    ema_data[j] = scipy.interpolate.splev(j, spline)
+                ema_data = self.interpolate_nan(ema_data)  # cubic spline of the available points, per trajectory
             return ema_data
 
+    @timed("remove_silences")
     def remove_silences(self,ema, mfcc, k):
         """
           :param k:  utterance index (wrt the list EMA_files)
@@ -137,84 +145,50 @@ class Speaker_mocha(Speaker):
 
         return ema, mfcc
 
-    def from_wav_to_mfcc(self,wav):
+    def preprocess_utterance(self, i):
         """
-       :param wav: list of intensity points of the wav file
-       :return: the acoustic features( K,429); where K in the # of frames.
-       calculations of the mfcc with librosa , + Delta and DeltaDelta, + 10 context frames
-       # of acoustic features per frame: 13 ==> 13*3 = 39 ==> 39*11 = 429.
-       parameters for mfcc calculation are defined in class_corpus
-       """
-        mfcc = librosa.feature.mfcc(y=wav, sr=self.sampling_rate_wav, n_mfcc=self.n_coeff,
-                                       n_fft=self.frame_length, hop_length=self.hop_length
-                                       ).T
-        dyna_features = get_delta_features(mfcc)
-        dyna_features_2 = get_delta_features(dyna_features)
-        mfcc = np.concatenate((mfcc, dyna_features, dyna_features_2), axis=1)
-        padding = np.zeros((self.window, mfcc.shape[1]))
-        frames = np.concatenate([padding, mfcc, padding])
-        full_window = 1 + 2 * self.window
-        mfcc = np.concatenate([frames[j:j + len(mfcc)] for j in range(full_window)], axis=1)  # add context
-        return mfcc
-
-    def Preprocessing_general_speaker(self):
-        """
-        Go through the sentences one by one.
+        :param i: utterance index (wrt the list EMA_files)
+        :return: the smoothed ema (K,18) and the mfcc (K,429) of the utterance, not normalized yet
             - reads ema data and turn it to a (K,18) array where arti are in a precise order, interploate missing values,
         smooth the trajectories, remove silences at the beginning and the end, undersample to have 1 position per
-        frame mfcc, add it to the list of EMA traj for this speaker
-            - reads the wav file, calculate the associated acoustic features (mfcc+delta+ deltadelta+contextframes) ,
-        add it to the list of the MFCC FEATURES for this speaker.
-        Then calculate the normvalues based on the list of ema/mfcc data for this speaker
-        Finally : normalization and last smoothing of the trajectories.
-        Final data are in Preprocessed_data/speaker/ema_final.npy and  mfcc.npy
+        frame mfcc
+            - reads the wav file, calculate the associated acoustic features (mfcc+delta+ deltadelta+contextframes)
+        """
+        ema = self.read_ema_file(i)
+        ema_VT = self.add_vocal_tract(ema)
+        ema_VT_smooth = self.smooth_data(ema_VT)  # smooth for a better calculation of norm values
+        path_wav = os.path.join(self.path_files_brutes, self.wav_files[i] + '.wav')
+        wav = self.load_wav(path_wav)
+        wav = 0.5 * wav / np.max(wav)
+        mfcc = self.from_wav_to_mfcc(wav)
+        ema_VT_smooth, mfcc = self.remove_silences(ema_VT_smooth, mfcc, i)
+        ema_VT_smooth, mfcc = self.synchro_ema_mfcc(ema_VT_smooth, mfcc)
+
+        ema_VT, rien = self.remove_silences(ema_VT, mfcc, i)
+        ema_VT, rien = self.synchro_ema_mfcc(ema_VT, mfcc)
+
+        self.save_unsmoothed_ema(self.EMA_files[i], ema_VT)
+        self.save_mfcc(self.EMA_files[i], mfcc)
+        self.save_ema_final(self.EMA_files[i], ema_VT_smooth)
+        return ema_VT_smooth, mfcc
+
+    @timed("normalization")
+    def normalize_utterance(self, i, previous=None):
+        """
+        :param i: utterance index (wrt the list EMA_files)
+        :param previous: norm values the utterance is already normalized with, None if not normalized yet
+        normalization and last smoothing of the trajectories, for mocha the not smoothed ema is also normalized
         """
-        self.create_missing_dir()
-
-        N = len(self.EMA_files)
-        if self.N_max != 0:
-            N = self.N_max
-
-        for i in range(N):
-            ema = self.read_ema_file(i)
-            ema_VT = self.add_vocal_tract(ema)
-            ema_VT_smooth = self.smooth_data(ema_VT)  # smooth for a better calculation of norm values
-            path_wav = os.path.join(self.path_files_brutes, self.wav_files[i] + '.wav')
-            wav, sr = librosa.load(path_wav, sr=None)
-            wav = 0.5 * wav / np.max(wav)
-            mfcc = self.from_wav_to_mfcc(wav)
-            ema_VT_smooth, mfcc = self.remove_silences(ema_VT_smooth, mfcc, i)
-            ema_VT_smooth, mfcc = self.synchro_ema_mfcc(ema_VT_smooth, mfcc)
-
-            ema_VT, rien = self.remove_silences(ema_VT, mfcc, i)
-            ema_VT, rien = self.synchro_ema_mfcc(ema_VT, mfcc)
-
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema", self.EMA_files[i]), ema_VT)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "mfcc", self.EMA_files[i]), mfcc)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema_final", self.EMA_files[i]), ema_VT_smooth)
-            self.list_EMA_traj.append(ema_VT_smooth)
-            self.list_MFCC_frames.append(mfcc)
-
-        self.calculate_norm_values()
-
-        for i in range(N):
-            ema_pas_smooth = np.load(
-                os.path.join(root_path, "Preprocessed_data", self.speaker, "ema", self.EMA_files[i] + ".npy"))
-            ema_VT_smooth = np.load(
-                os.path.join(root_path, "Preprocessed_data", self.speaker, "ema_final", self.EMA_files[i] + ".npy"))
-            mfcc = np.load(os.path.join(root_path, "Preprocessed_data", self.speaker, "mfcc", self.EMA_files[i] + ".npy"))
-            ema_VT_smooth_norma, mfcc = self.normalize_sentence(i, ema_VT_smooth, mfcc)
-            ema_pas_smooth_norma, rien = self.normalize_sentence(i, ema_pas_smooth, mfcc)
-            new_sr = 1 / self.hop_time   # we did undersampling of ema traj for 1 point per frame mfcc
-                                        # so about 1 point every hoptime sec.
-            ema_VT_smooth_norma = self.smooth_data(ema_VT_smooth_norma, new_sr)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema", self.EMA_files[i]), ema_pas_smooth_norma)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "mfcc", self.EMA_files[i]), mfcc)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema_final", self.EMA_files[i]),
-                    ema_VT_smooth_norma)
-
-        #  split_sentences(speaker)   #possibility to cut to long sentences
-        get_fileset_names(self.speaker)
+        super().normalize_utterance(i, previous)
+        if not self.keep_unsmoothed_ema:
+            return
+        if previous is None:
+            previous = {"ema_offset": None, "std_ema": None}
+        normalize_npy_in_place(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema",
+                                            self.EMA_files[i] + ".npy"),
+                               self.moving_average_ema[i, :], self.std_ema, previous["ema_offset"], previous["std_ema"])
+        self.timer.add_files([os.path.join(root_path, "Preprocessed_data", self.speaker, "ema",
+                                           self.EMA_files[i] + ".npy")], written=True)
 
 
 def Preprocessing_general_mocha(N_max, path_to_raw):
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Instrumentation of the preprocessing : time spent in each stage (reading of the raw files, NaN repair, mfcc,
+    smoothing, removal of the silences, synchronisation, norm values, saving ...), bytes read and written, and
+    utterances per second for each speaker.
+    The methods of the Speaker class are decorated with timed(stage), each Speaker has a Stage_timer. With several
+    processes, each worker sends the timing of its task to the main process that adds them (see main_preprocessing).
+    At the end the report is written in Preprocessed_data/preprocessing_report.json, and a progress line with the
+    ETA is printed during the preprocessing.
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import time
+import json
+import functools
+import contextlib
+
+root_folder = os.path.dirname(os.getcwd())
+
+
+class Stage_timer(object):
+    """
+    time spent in each stage of the preprocessing, and bytes read and written.
+    The time of a stage is its own time : the time of the stages called inside it is given to them, so that the
+    times of all the stages add up to the time of the preprocessing.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        forget all the timings (the stages in progress are kept)
+        """
+        self.stages = dict()
+        self.bytes_read = 0
+        self.bytes_written = 0
+        if not hasattr(self, "running"):
+            self.running = []  # stages in progress [name, start, time of the stages called inside]
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        :param name: name of the stage
+        context in which the time is given to the stage name. The calls are counted only for the outermost stage
+        with this name (mocha normalize_utterance calls the one of Speaker)
+        """
+        outermost = all(running[0] != name for running in self.running)
+        self.running.append([name, time.perf_counter(), 0.])
+        try:
+            yield
+        finally:
+            name, start, nested = self.running.pop()
+            duration = time.perf_counter() - start
+            if self.running:
+                self.running[-1][2] += duration
+            stage = self.stages.setdefault(name, {"time": 0., "calls": 0})
+            stage["time"] += duration - nested
+            stage["calls"] += int(outermost)
+
+    def add_files(self, paths, written=False):
+        """
+        :param paths: list of paths of files read (or written)
+        :param written: whether the files were written
+        add the size of the files to the bytes read (or written), missing files are ignored
+        """
+        n_bytes = sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+        if written:
+            self.bytes_written += n_bytes
+        else:
+            self.bytes_read += n_bytes
+
+    def as_dict(self):
+        """
+        :return: the timings in a dictionnary that can be sent to another process or saved in json
+        """
+        return {"stages": {name: dict(stage) for name, stage in self.stages.items()},
+                "bytes_read": self.bytes_read,
+                "bytes_written": self.bytes_written}
+
+    def add(self, timing):
+        """
+        :param timing: timings of another Stage_timer (see as_dict), typically of a worker process
+        add the timings to this timer
+        """
+        for name, stage in timing["stages"].items():
+            total = self.stages.setdefault(name, {"time": 0., "calls": 0})
+            total["time"] += stage["time"]
+            total["calls"] += stage["calls"]
+        self.bytes_read += timing["bytes_read"]
+        self.bytes_written += timing["bytes_written"]
+
+
+def timed(stage):
+    """
+    :param stage: name of the stage
+    :return: decorator of a method of Speaker, the time spent in the method is given to the stage in self.timer
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def timed_method(self, *args, **kwargs):
+            with self.timer.stage(stage):
+                return method(self, *args, **kwargs)
+        return timed_method
+    return decorator
+
+
+def speaker_report(speaker, wall_time, n_preprocessed, n_normalized):
+    """
+    :param speaker: Speaker instance, its timer has the timings of all its utterances
+    :param wall_time: time (sec) between the preparation of the speaker and the end of its normalization
+    :param n_preprocessed: # of utterances preprocessed (not skipped)
+    :param n_normalized: # of utterances normalized
+    :return: dictionnary with the timings of the speaker. process_time is the sum of the time of the stages, in all
+    the processes. utterances_per_sec is the number of utterances preprocessed per second by one process.
+    """
+    timing = speaker.timer.as_dict()
+    process_time = sum(stage["time"] for stage in timing["stages"].values())
+    n_utterances = len(speaker.list_utterances())
+    report = {"corpus": speaker.corpus,
+              "n_utterances": n_utterances,
+              "n_preprocessed": n_preprocessed,
+              "n_skipped": n_utterances - n_preprocessed,
+              "n_normalized": n_normalized,
+              "wall_time": wall_time,
+              "process_time": process_time,
+              "utterances_per_sec": n_preprocessed / process_time if process_time > 0 else None}
+    report.update(timing)
+    for stage in report["stages"].values():
+        stage["share"] = stage["time"] / process_time if process_time > 0 else 0
+    return report
+
+
+def save_report(speaker_reports, wall_time=None, n_jobs=1):
+    """
+    :param speaker_reports: dictionnary speaker : report of the speaker (see speaker_report)
+    :param wall_time: duration (sec) of the whole preprocessing, None if only the speakers are updated
+    :param n_jobs: # of processes
+    update Preprocessed_data/preprocessing_report.json with the reports of the speakers, the speakers not
+    preprocessed this time keep their previous report
+    """
+    path_report = os.path.join(root_folder, "Preprocessed_data", "preprocessing_report.json")
+    report = {"speakers": dict()}
+    if os.path.exists(path_report):
+        with open(path_report, 'r') as f:
+            report = json.load(f)
+    report["speakers"].update(speaker_reports)
+    if wall_time is not None:
+        n_preprocessed = sum(r["n_preprocessed"] for r in speaker_reports.values())
+        report["last_run"] = {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                              "speakers": sorted(speaker_reports.keys()),
+                              "n_jobs": n_jobs,
+                              "wall_time": wall_time,
+                              "n_preprocessed": n_preprocessed,
+                              "utterances_per_sec": n_preprocessed / wall_time if wall_time > 0 else None}
+    with open(path_report + ".tmp", 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    os.replace(path_report + ".tmp", path_report)
+
+
+def format_duration(seconds):
+    """
+    :param seconds: duration in sec
+    :return: the duration as 1h02m03s, 2m03s or 3s
+    """
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return "{}h{:02d}m{:02d}s".format(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+    if seconds >= 60:
+        return "{}m{:02d}s".format(seconds // 60, seconds % 60)
+    return "{}s".format(seconds)
+
+
+class Progress_line(object):
+    """
+    line rewritten in place with the # of utterances done, the throughput and the ETA
+    """
+    def __init__(self, total, label="utterances", min_interval=0.5, stream=sys.stdout):
+        """
+        :param total: # of utterances to do
+        :param label: what is counted
+        :param min_interval: min time (sec) between two updates of the line
+        """
+        self.total = total
+        self.label = label
+        self.min_interval = min_interval
+        self.stream = stream
+        self.done = 0
+        self.start = time.perf_counter()
+        self.last_print = 0
+        self.width = 0
+
+    def get_line(self):
+        """
+        :return: the progress line, eg "120/2000 utterances (6%) 12.3/s ETA 2m33s"
+        """
+        elapsed = time.perf_counter() - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0
+        eta = format_duration((self.total - self.done) / rate) if rate > 0 else "?"
+        return "{}/{} {} ({:.0f}%) {:.1f}/s elapsed {} ETA {}".format(
+            self.done, self.total, self.label, 100. * self.done / max(self.total, 1), rate,
+            format_duration(elapsed), eta)
+
+    def print_line(self, line, end=""):
+        """
+        write the line over the previous one
+        """
+        self.stream.write("\r" + line.ljust(self.width) + end)
+        self.stream.flush()
+        self.width = 0 if end else len(line)
+
+    def update(self, n=1):
+        """
+        :param n: # of utterances done since the last update
+        """
+        self.done += n
+        now = time.perf_counter()
+        if self.done >= self.total or now - self.last_print >= self.min_interval:
+            self.last_print = now
+            self.print_line(self.get_line(), "\n" if self.done >= self.total else "")
+
+    def message(self, text):
+        """
+        :param text: message to print without breaking the progress line
+        """
+        self.print_line(text, "\n")
+        if self.done < self.total:
+            self.print_line(self.get_line())
@@ -7,7 +7,8 @@
     It's free and available here "https://sail.usc.edu/span/usc-timit/"
     data for speaker X has to be in "Raw_data/X"
     the format is special : 1 file for 18sec of recording, so several sentences per file,
-    sometimes 1 sentence over 2 files ==> we use the trans file to have 1 file per sentence
+    sometimes 1 sentence over 2 files ==> we use the trans file to know where each sentence is, and only the parts
+    of the recordings of the sentence are read when it is preprocessed (nothing is cut on the disk)
 """
 import os,sys,inspect
 currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
@@ -15,7 +16,6 @@ parentdir = os.path.dirname(currentdir)
 sys.path.insert(0,parentdir)
 import scipy.signal
 import scipy.interpolate
-from Preprocessing.tools_preprocessing import get_fileset_names, get_delta_features, split_sentences
 import scipy.io as sio
 
 from os.path import dirname
@@ -26,7 +26,8 @@ import scipy.interpolate
 import librosa
 from Preprocessing.tools_preprocessing import get_speakers_per_corpus
 from Preprocessing.class_corpus import Speaker
-import glob
+from Preprocessing.preprocessing_report import timed
+import json
 
 root_path = dirname(dirname(os.path.realpath(__file__)))
 
@@ -49,10 +50,12 @@ class Speaker_usc(Speaker):
         self.EMA_files = sorted([name[:-4] for name in os.listdir(
             os.path.join(self.path_files_brutes, "mat")) if name.endswith(".mat")])
         self.EMA_files_2 = None
+        self.sentences = None
+        self.last_ema_recording = (None, None)
 
     def create_missing_dir(self):
         """
-        delete all previous preprocessing, create needed directories
+        create needed directories. The previous preprocessing is deleted only if needed (see clean_preprocessed_data)
         """
         if not os.path.exists(os.path.join(self.path_files_treated, "ema")):
             os.makedirs(os.path.join(self.path_files_treated, "ema"))
@@ -60,96 +63,72 @@ class Speaker_usc(Speaker):
             os.makedirs(os.path.join(self.path_files_treated, "mfcc"))
         if not os.path.exists(os.path.join(self.path_files_treated, "ema_final")):
             os.makedirs(os.path.join(self.path_files_treated, "ema_final"))
-        if not os.path.exists(os.path.join(self.path_files_brutes, "mat_cut")):
-            os.makedirs(os.path.join(self.path_files_brutes, "mat_cut"))
-        if not os.path.exists(os.path.join(self.path_files_brutes, "wav_cut")):
-            os.makedirs(os.path.join(self.path_files_brutes, "wav_cut"))
+        if not os.path.exists(os.path.join(self.path_files_treated, "stats")):
+            os.makedirs(os.path.join(self.path_files_treated, "stats"))
 
-        files = glob.glob(os.path.join(self.path_files_treated, "ema", "*"))
-        files += glob.glob(os.path.join(self.path_files_treated, "mfcc", "*"))
-        files += glob.glob(os.path.join(self.path_files_treated, "ema_final", "*"))
-        files += glob.glob(os.path.join(self.path_files_brutes, "wav_cut","*"))
-        files += glob.glob(os.path.join(self.path_files_brutes, "mat_cut","*"))
-
-        for f in files:
-            os.remove(f)
-
-    def get_data_per_sentence(self):
+    @timed("other")
+    def index_sentences(self):
         """
         Initially 1 file for several sentences pronounced successively (with silence between them).
-        The scripts reads the transcription file and generates new files to have 1 EMA and 1 WAV per sentence.
-
-        For the sentence with id 7 the names of the files will be "usctimit_ema_sp_7". Sometimes one sentence is
-        pronounced over 2 files. If we want to save a file with a name already in our directory it means that we are
-        in that case. So we just concatenate the 2 ema and the 2 MFCC files.
-
-        After this function in ema_cut and in wav_cut we have 1 file per sentence, just as in other corpus
-
+        The script reads the transcription file of each recording once and gives for each sentence the parts of the
+        recordings where it is pronounced : {sentence name : [[recording, beginning (sec), end (sec)], ...]}.
+        For the sentence with id 7 the name is "usctimit_ema_sp_7". Sometimes one sentence is pronounced over 2
+        files, then it has 2 parts, in the order of the recordings.
+        Nothing is cut on the disk : the parts are read when the sentence is preprocessed (see read_ema_file and
+        read_wav), so the memory needed depends on the length of the sentences and not of the recordings.
+        The index is saved in Preprocessed_data/speaker/sentences.json for the other processes.
         """
         N = len(self.EMA_files)
         if self.N_max != 0:
             N = max(min(int(self.N_max / 3), N), 1)   # 1 file contains several sentences
-        marge = 0
+        sentences = dict()
         for j in range(N):    # run through the files
-            path_wav = os.path.join(self.path_files_brutes, "wav", self.EMA_files[j] + '.wav')
-            wav, sr = librosa.load(path_wav, sr=self.sampling_rate_wav_wanted)    # 1 wav containing several sentences
-            wav = 0.5 * wav / np.max(wav)
-
-            ema = sio.loadmat(os.path.join(self.path_files_brutes, "mat",
-                                           self.EMA_files[j] + ".mat"))  # 1 ema containing several sentnces
+            with open(os.path.join(self.path_files_annotation, self.EMA_files[j] + ".trans")) as file:
+                boundaries = dict()  # id of the sentence : [beginning of its first phone, end of its last phone]
+                for row in file:
+                    row = row.strip("\n").split(",")
+                    if row[-1] == "":
+                        continue
+                    if row[-1] not in boundaries:
+                        boundaries[row[-1]] = [float(row[0]), float(row[1])]
+                    boundaries[row[-1]][1] = float(row[1])
+            for k in sorted([int(id) for id in boundaries]):
+                name = self.EMA_files[j][:-7] + str(k)
+                sentences.setdefault(name, []).append([self.EMA_files[j]] + boundaries[str(k)])
+        self.sentences = sentences
+        with open(os.path.join(self.path_files_treated, "sentences.json.tmp"), 'w') as f:
+            json.dump(sentences, f)
+        os.replace(os.path.join(self.path_files_treated, "sentences.json.tmp"),
+                   os.path.join(self.path_files_treated, "sentences.json"))
+
+    def get_sentences(self):
+        """
+        :return: the index of the sentences (see index_sentences), read once from sentences.json
+        """
+        if self.sentences is None:
+            with open(os.path.join(self.path_files_treated, "sentences.json"), 'r') as f:
+                self.sentences = json.load(f)
+        return self.sentences
 
+    def read_ema_recording(self, recording):
+        """
+        :param recording: name of a recording (wrt the list "EMA_files")
+        :return: npy array (K,12) all the ema trajectories of the recording. The last recording read is kept, since the
+        consecutive sentences often come from the same recording.
+        """
+        if self.last_ema_recording[0] != recording:
+            ema = sio.loadmat(os.path.join(self.path_files_brutes, "mat", recording + ".mat"))
             # two lines of code to obtain the ema traj as a np array
-            ema = ema[self.EMA_files[j]][0]
+            ema = ema[recording][0]
             ema = np.concatenate([ema[arti][2][:, [0, 1]] for arti in range(1, 7)], axis=1)
+            self.last_ema_recording = (recording, ema)
+        return self.last_ema_recording[1]
 
-            with open(os.path.join(self.path_files_annotation, self.EMA_files[j] + ".trans")) as file:
-                labels = np.array([row.strip("\n").split(",") for row in file])
-                phone_details = labels[:, [0, 1, -1]]    # all the info about bebginning/end of sentences if here
-
-                # 3 lines of code to get the id of the sentences of this file
-                id_sentence = set(phone_details[:, 2])
-                id_sentence.remove("")
-                id_sentence = sorted([int(id) for id in id_sentence])
-
-                for k in id_sentence:
-                    temp = phone_details[phone_details[:, 2] == str(k)]     # we focus on one sentence
-                    xtrm = [max(float(temp[:, 0][0]) - marge, 0),
-                            float(temp[:, 1][-1]) + marge]               # beginning and end of the sentences in second
-
-                    xtrm_temp_ema = [int(np.floor(xtrm[0] * self.sampling_rate_ema)), int(
-                        min(np.floor(xtrm[1] * self.sampling_rate_ema) + 1, len(ema)))]
-                    xtrm_temp_wav = [int(int(np.floor(xtrm[0] * self.sampling_rate_wav_wanted))),
-                                     int(min(int(np.floor(xtrm[1] * self.sampling_rate_wav_wanted) + 1), len(wav)))]
-
-                    ema_temp = ema[xtrm_temp_ema[0]:xtrm_temp_ema[1], :]
-                    wav_temp = wav[xtrm_temp_wav[0]:xtrm_temp_wav[1]]
-
-                    # if we already have a file for id k it means that the sentence was pronounced over the 2 files
-                    # we have to concatenante the previous and current data.
-                    if os.path.exists(os.path.join(self.path_files_brutes, "mat_cut",
-                                                   self.EMA_files[j][:-7] + str(k) + ".npy")):
-
-                        premiere_partie_ema = np.load(os.path.join(self.path_files_brutes,"mat_cut",
-                                                                   self.EMA_files[j][:-7] + str(k) + ".npy"))
-
-                        ema_temp = np.concatenate((ema_temp, premiere_partie_ema), axis=0) # Final ema for id k
-
-                        premiere_partie_wav, sr = librosa.load(os.path.join(self.path_files_brutes, "wav_cut",
-                                                                            self.EMA_files[j][:-7] + str(k) + ".wav"),
-                                                               sr=self.sampling_rate_wav_wanted)
-                        wav_temp = np.concatenate((wav_temp, premiere_partie_wav), axis=0)  # Final wav for id k
-
-                    np.save(os.path.join(self.path_files_brutes, "mat_cut", self.EMA_files[j][:-7] + str(k)),
-                            ema_temp)
-
-                    librosa.output.write_wav(
-                        os.path.join(self.path_files_brutes, "wav_cut", self.EMA_files[j][:-7] + str(k) + ".wav"),
-                        wav_temp, self.sampling_rate_wav_wanted)
-
+    @timed("ema_read")
     def read_ema_file(self,m):
         """
-        read the ema file, first preprocessing,
-        :param m: utterance index (wrt the list "EMA_files")
+        read the ema of the sentence, first preprocessing,
+        :param m: utterance index (wrt the list "EMA_files_2")
         :return: npy array (K,12) , K depends on the duration of the recording, 12 trajectories
         """
 
@@ -162,37 +141,32 @@ class Speaker_usc(Speaker):
 
         new_order_arti = [articulators.index(col) for col in order_arti_usctimit]  # change the order from the initial
 
-        ema = np.load(os.path.join(self.path_files_brutes, "mat_cut", self.EMA_files_2[m] + ".npy"))
+        parts = []
+        for recording, beginning, end in self.get_sentences()[self.EMA_files_2[m]]:
+            ema = self.read_ema_recording(recording)
+            xtrm_temp_ema = [int(np.floor(beginning * self.sampling_rate_ema)),
+                             int(min(np.floor(end * self.sampling_rate_ema) + 1, len(ema)))]
+            parts.append(ema[xtrm_temp_ema[0]:xtrm_temp_ema[1], :])
+        ema = np.concatenate(parts, axis=0)
 
         if np.isnan(ema).sum() != 0:
             #        print(np.isnan(ema).sum())
-            spline = scipy.interpolate.splrep(np.argwhere(~np.isnan(ema).ravel()), ema[~np.isnan(ema)], k=3)
-            for j in np.argwhere(np.isnan(ema)).ravel():
-                ema[j] = scipy.interpolate.splev(j, spline)
+            ema = self.interpolate_nan(ema)
         ema = ema[:, new_order_arti]  # change order of arti to have the one wanted
         return ema
 
-    def from_wav_to_mfcc(self,k):
+    def read_wav(self,k):
         """
-          :param k: index of the sentence (wrt the list 'EMA_files'
-          :return: the acoustic features( K,429); where K in the # of frames.
-          calculations of the mfcc with librosa , + Delta and DeltaDelta, + 10 context frames
-          # of acoustic features per frame: 13 ==> 13*3 = 39 ==> 39*11 = 429.
-          parameters for mfcc calculation are defined in class_corpus
+          :param k: index of the sentence (wrt the list 'EMA_files_2')
+          :return: the wav of the sentence at the sampling rate wanted for the mfcc
+          only the parts of the recordings where the sentence is are decoded
           """
-        path_wav = os.path.join(self.path_files_brutes, "wav_cut", self.EMA_files_2[k] + '.wav')
-        data, sr = librosa.load(path_wav, sr=self.sampling_rate_wav_wanted)  # chargement de données
-        mfcc = librosa.feature.mfcc(y=data, sr=self.sampling_rate_wav_wanted, n_mfcc=self.n_coeff,
-                                       n_fft=self.frame_length, hop_length=self.hop_length).T
-        dyna_features = get_delta_features(mfcc)
-        dyna_features_2 = get_delta_features(dyna_features)
-        mfcc = np.concatenate((mfcc, dyna_features, dyna_features_2), axis=1)
-        padding = np.zeros((self.window, mfcc.shape[1]))
-        frames = np.concatenate([padding, mfcc, padding])
-        full_window = 1 + 2 * self.window
-        mfcc = np.concatenate([frames[j:j + len(mfcc)] for j in range(full_window)], axis=1)
-        return mfcc
+        wav = np.concatenate([self.load_wav_range(os.path.join(self.path_files_brutes, "wav", recording + '.wav'),
+                                                  beginning, end)
+                              for recording, beginning, end in self.get_sentences()[self.EMA_files_2[k]]])
+        return 0.5 * wav / np.max(wav)
 
+    @timed("remove_silences")
     def remove_silences(self,k, ema, mfcc):
         """
        :param k:  utterance index (wrt the list EMA_files)
@@ -214,63 +188,55 @@ class Speaker_usc(Speaker):
         # print("apres",mfcc.shape)
         return ema, mfcc
 
-    def Preprocessing_general_speaker(self):
+    def prepare_speaker(self, force=False):
         """
-        Go through the sentences one by one.
-            - reads ema data and turn it to a (K,18) array where arti are in a precise order, interploate missing values,
-        smooth the trajectories, remove silences at the beginning and the end, undersample to have 1 position per
-        frame mfcc, add it to the list of EMA traj for this speaker
-            - reads the wav file, calculate the associated acoustic features (mfcc+delta+ deltadelta+contextframes) ,
-        add it to the list of the MFCC FEATURES for this speaker.
-        Then calculate the normvalues based on the list of ema/mfcc data for this speaker
-        Finally : normalization and last smoothing of the trajectories.
-        Final data are in Preprocessed_data/speaker/ema_final.npy and  mfcc.npy
+        :param force: whether to redo all the sentences even if they did not change
+        create the directories and the index of the sentences in the recordings
         """
-
         self.create_missing_dir()
-        EMA_files = sorted(
-            [name[:-4] for name in os.listdir(os.path.join(self.path_files_brutes, "mat")) if name.endswith(".mat")])
+        self.index_sentences()   # one file contains several sentences, this gives where each sentence is
+        self.clean_preprocessed_data(force)
 
-        N = len(EMA_files)
-        if self.N_max != 0:
-            N = min(int(self.N_max / 3), N)  # majoration:if we want to preprocess N_max sentences, about N_max/6 files
-
-        self.get_data_per_sentence()   # one file contains several sentences, this create one file per sentence
-        self.EMA_files_2 = sorted(
-            [name[:-4] for name in os.listdir(os.path.join(self.path_files_brutes, "wav_cut")) if name.endswith(".wav")])
-        N_2 = len(self.EMA_files_2)
-        if self.N_max != 0:
-            N_2 = min(self.N_max, N_2)
-
-        for i in range(N_2):
-            ema = self.read_ema_file(i)
-            ema_VT = self.add_vocal_tract(ema)
-            ema_VT_smooth = self.smooth_data(ema_VT)  # smooth for better calculation of norm values
-            mfcc = self.from_wav_to_mfcc(i)
-            ema_VT_smooth, mfcc = self.remove_silences(i, ema_VT_smooth, mfcc)
-            ema_VT_smooth, mfcc = self.synchro_ema_mfcc(ema_VT_smooth, mfcc)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema", self.EMA_files_2[i]), ema_VT)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "mfcc", self.EMA_files_2[i]), mfcc)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema_final",
-                                 self.EMA_files_2[i]), ema_VT_smooth)
-            self.list_EMA_traj.append(ema_VT_smooth)
-            self.list_MFCC_frames.append(mfcc)
-        self.calculate_norm_values()
+    def get_raw_files(self, i):
+        """
+        :param i: sentence index (wrt the list EMA_files_2)
+        :return: paths of the wav, ema and transcription files of the recordings where the sentence is
+        """
+        self.list_utterances()
+        return [os.path.join(self.path_files_brutes, directory, recording + extension)
+                for recording, beginning, end in self.get_sentences()[self.EMA_files_2[i]]
+                for directory, extension in [("wav", ".wav"), ("mat", ".mat"), ("trans", ".trans")]]
 
-        for i in range(N_2):
-            ema_VT_smooth = np.load(
-                os.path.join(root_path, "Preprocessed_data", self.speaker, "ema_final", self.EMA_files_2[i] + ".npy"))
-            mfcc = np.load(os.path.join(root_path, "Preprocessed_data", self.speaker, "mfcc",
-                                        self.EMA_files_2[i] + ".npy"))
-            ema_VT_smooth_norma, mfcc = self.normalize_sentence(i, ema_VT_smooth, mfcc)
-            new_sr = 1 / self.hop_time
-            ema_VT_smooth_norma = self.smooth_data(ema_VT_smooth_norma, new_sr)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "mfcc", self.EMA_files_2[i]), mfcc)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema_final", self.EMA_files_2[i]),
-                    ema_VT_smooth_norma)
+    def list_utterances(self):
+        """
+        :return: the names of the sentences to preprocess (see index_sentences)
+        """
+        if self.EMA_files_2 is None:
+            self.EMA_files_2 = sorted(self.get_sentences().keys())
+            if self.N_max != 0:
+                self.EMA_files_2 = self.EMA_files_2[:self.N_max]
+        return self.EMA_files_2
 
-      #  split_sentences(self.speaker)
-        get_fileset_names(self.speaker)
+    def preprocess_utterance(self, i):
+        """
+        :param i: sentence index (wrt the list EMA_files_2)
+        :return: the smoothed ema (K,18) and the mfcc (K,429) of the sentence, not normalized yet
+            - reads ema data and turn it to a (K,18) array where arti are in a precise order, interploate missing values,
+        smooth the trajectories, remove silences at the beginning and the end, undersample to have 1 position per
+        frame mfcc
+            - reads the wav file, calculate the associated acoustic features (mfcc+delta+ deltadelta+contextframes)
+        """
+        self.list_utterances()
+        ema = self.read_ema_file(i)
+        ema_VT = self.add_vocal_tract(ema)
+        ema_VT_smooth = self.smooth_data(ema_VT)  # smooth for better calculation of norm values
+        mfcc = self.from_wav_to_mfcc(self.read_wav(i))
+        ema_VT_smooth, mfcc = self.remove_silences(i, ema_VT_smooth, mfcc)
+        ema_VT_smooth, mfcc = self.synchro_ema_mfcc(ema_VT_smooth, mfcc)
+        self.save_unsmoothed_ema(self.EMA_files_2[i], ema_VT)
+        self.save_mfcc(self.EMA_files_2[i], mfcc)
+        self.save_ema_final(self.EMA_files_2[i], ema_VT_smooth)
+        return ema_VT_smooth, mfcc
 
 
 def Preprocessing_general_usc(N_max, path_to_raw):
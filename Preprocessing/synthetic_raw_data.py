@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Generation of synthetic raw data in the formats of the 4 corpus, to run and benchmark the preprocessing and the
+    training without the real corpus (that can not be copied on every machine).
+    The files are written in path_to_raw_data/Raw_data with the same layout and format as the real ones, so that the
+    preprocessing scripts read them without any change :
+        - mocha : Raw_data/mocha/sp/ with for each utterance the .ema (EST header + binary float32, 20 channels, 500Hz),
+        the .wav (16kHz) and the .lab (start end label, for the speakers with transcription)
+        - MNGU0 : Raw_data/MNGU0/ema (EST, 87 channels, 200Hz), wav (16kHz) and phone_labels (.lab)
+        - usc : Raw_data/usc/sp/ wav (20kHz), mat (one struct per sensor, 100Hz) and trans, 1 recording contains
+        several sentences and the last sentence of a recording can continue in the next one
+        - Haskins : Raw_data/Haskins/sp/data/*.mat, one struct array "data" per utterance with the audio (44.1kHz) and
+        the 8 sensors (100Hz), the words and phones give the silences at the beginning and the end
+    The trajectories are smooth random movements around the position of each sensor (with some NaN sometimes), the
+    wav is a harmonic signal with a varying pitch and syllables, with silences before and after the speech.
+    Exemple : python synthetic_raw_data.py --path_to_raw_data /tmp/synthetic --corpus [mocha,usc] --n_utterances 50
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import numpy as np
+import scipy.io as sio
+import scipy.io.wavfile
+import scipy.signal
+import argparse
+from Preprocessing.tools_preprocessing import get_speakers_per_corpus
+
+
+def synthetic_trajectories(n_points, n_channels, sampling_rate, rng, amplitude=5., nan_rate=0.):
+    """
+    :param n_points: # of points of each trajectory
+    :param n_channels: # of trajectories
+    :param sampling_rate: sampling rate of the trajectories
+    :param rng: np.random.RandomState
+    :param amplitude: std of the movements (in mm)
+    :param nan_rate: probability that one trajectory has a gap of missing values
+    :return: (n_points, n_channels) smooth trajectories (movements under ~10Hz) around a random position, in mm
+    """
+    noise = rng.randn(n_points + 200, n_channels)
+    smoothing = scipy.signal.get_window("hann", max(int(sampling_rate / 8), 3))
+    movements = scipy.signal.fftconvolve(noise, smoothing[:, None] / smoothing.sum(), mode="same", axes=0)[100:-100]
+    movements = movements / np.maximum(np.std(movements, axis=0), 1e-8) * amplitude
+    trajectories = rng.uniform(-40, 40, n_channels) + movements
+    for channel in np.nonzero(rng.uniform(size=n_channels) < nan_rate)[0]:
+        start = rng.randint(0, max(n_points - 10, 1))
+        trajectories[start:start + rng.randint(1, 10), channel] = np.nan
+    return trajectories
+
+
+def synthetic_wav(duration, speech_start, speech_end, sampling_rate, rng):
+    """
+    :param duration: duration of the wav (sec)
+    :param speech_start: beginning of the speech (sec), silence before
+    :param speech_end: end of the speech (sec), silence after
+    :param sampling_rate: sampling rate of the wav
+    :param rng: np.random.RandomState
+    :return: the wav (float32 between -1 and 1) : harmonics of a varying pitch, modulated by syllables of ~4Hz,
+    over a low noise
+    """
+    t = np.arange(int(duration * sampling_rate)) / float(sampling_rate)
+    f0 = rng.uniform(100, 220) * (1 + 0.1 * np.sin(2 * np.pi * rng.uniform(0.5, 2) * t + rng.uniform(0, 6)))
+    phase = 2 * np.pi * np.cumsum(f0) / sampling_rate
+    harmonics = sum(np.sin(h * phase) / h for h in range(1, 11))
+    syllables = np.maximum(np.sin(2 * np.pi * rng.uniform(3, 5) * t + rng.uniform(0, 6)), 0) ** 2
+    speech = (t >= speech_start) & (t <= speech_end)
+    wav = 0.3 * harmonics * syllables * speech + 0.003 * rng.randn(len(t))
+    return np.clip(wav, -1, 1).astype(np.float32)
+
+
+def write_wav(path, wav, sampling_rate):
+    """
+    write the wav in PCM 16 bits, as the wav files of the corpus
+    """
+    scipy.io.wavfile.write(path, sampling_rate, (wav * 32767).astype(np.int16))
+
+
+def write_est_ema(path, data, column_names):
+    """
+    :param path: path of the .ema file
+    :param data: (K, # of channels) trajectories
+    :param column_names: name of each channel
+    write the trajectories in the EST binary format read by the mocha and MNGU0 scripts : the header gives the # of
+    frames and the name of each channel, then the frames in float32 (channels, then the time and a validity flag)
+    """
+    n_frames = len(data)
+    header = ["EST_File Track", "DataType binary", "ByteOrder 01", "NumFrames {}".format(n_frames),
+              "NumChannels {}".format(len(column_names))]
+    header += ["Channel_{} {}".format(k, name) for k, name in enumerate(column_names)]
+    header += ["EST_Header_End"]
+    frames = np.concatenate([data, np.zeros((n_frames, 1)), np.ones((n_frames, 1))], axis=1)
+    frames[:, -2] = np.arange(n_frames)
+    with open(path, "wb") as f:
+        f.write(("\n".join(header) + "\n").encode("latin-1"))
+        f.write(frames.astype(np.float32).tobytes())
+
+
+def random_timing(rng, min_duration, max_duration):
+    """
+    :return: (duration, beginning of the speech, end of the speech) of one utterance, in sec
+    """
+    duration = rng.uniform(min_duration, max_duration)
+    return duration, rng.uniform(0.1, 0.4), duration - rng.uniform(0.1, 0.4)
+
+
+def phone_boundaries(speech_start, speech_end, rng):
+    """
+    :return: the boundaries (sec) of the phones between the beginning and the end of the speech, ~12 phones per sec
+    """
+    n_phones = max(int((speech_end - speech_start) * 12), 1)
+    inside = np.sort(rng.uniform(speech_start, speech_end, n_phones - 1))
+    return np.concatenate([[speech_start], inside, [speech_end]])
+
+
+def generate_mocha(path_to_raw, sp, n_utterances, min_duration, max_duration, rng, nan_rate):
+    """
+    write n_utterances for the mocha speaker sp : .ema (500Hz, 20 channels), .wav (16kHz) and .lab
+    """
+    sampling_rate_ema, sampling_rate_wav = 500, 16000
+    column_names = ['tt_x', 'tt_y', 'td_x', 'td_y', 'tb_x', 'tb_y', 'li_x', 'li_y', 'ul_x', 'ul_y', 'll_x', 'll_y',
+                    'v_x', 'v_y', 'bn_x', 'bn_y', 'bt_x', 'bt_y', 'ui_x', 'ui_y']
+    path = os.path.join(path_to_raw, "Raw_data", "mocha", sp)
+    if not os.path.exists(path):
+        os.makedirs(path)
+    for k in range(n_utterances):
+        name = "{}_{:03d}".format(sp, k + 1)
+        duration, speech_start, speech_end = random_timing(rng, min_duration, max_duration)
+        ema = synthetic_trajectories(int(duration * sampling_rate_ema), len(column_names), sampling_rate_ema, rng,
+                                     nan_rate=nan_rate)
+        write_est_ema(os.path.join(path, name + ".ema"), ema * 100, column_names)  # the script divides by 100
+        write_wav(os.path.join(path, name + ".wav"),
+                  synthetic_wav(duration, speech_start, speech_end, sampling_rate_wav, rng), sampling_rate_wav)
+        boundaries = phone_boundaries(speech_start, speech_end, rng)
+        with open(os.path.join(path, name + ".lab"), "w") as f:
+            f.write("0.000 {:.3f} sil\n".format(speech_start))
+            for start, end in zip(boundaries[:-1], boundaries[1:]):
+                f.write("{:.3f} {:.3f} a\n".format(start, end))
+            f.write("{:.3f} {:.3f} sil\n".format(speech_end, duration))
+
+
+def generate_mngu0(path_to_raw, n_utterances, min_duration, max_duration, rng, nan_rate):
+    """
+    write n_utterances for MNGU0 : ema/*.ema (200Hz, 87 channels), wav/*.wav (16kHz) and phone_labels/*.lab
+    """
+    sampling_rate_ema, sampling_rate_wav = 200, 16000
+    sensors = ["T1", "T2", "T3", "jaw", "upperlip", "lowerlip", "ref", "bridge", "left", "right", "head", "spare"]
+    column_names = [sensor + "_" + channel for sensor in sensors
+                    for channel in ["px", "py", "pz", "ox", "oy", "oz", "rms"]]
+    column_names += ["extra_{}".format(k) for k in range(87 - len(column_names))]
+    path = os.path.join(path_to_raw, "Raw_data", "MNGU0")
+    for directory in ["ema", "wav", "phone_labels"]:
+        if not os.path.exists(os.path.join(path, directory)):
+            os.makedirs(os.path.join(path, directory))
+    for k in range(n_utterances):
+        name = "mngu0_s1_{:04d}".format(k + 1)
+        duration, speech_start, speech_end = random_timing(rng, min_duration, max_duration)
+        ema = synthetic_trajectories(int(duration * sampling_rate_ema), len(column_names), sampling_rate_ema, rng,
+                                     nan_rate=nan_rate)
+        write_est_ema(os.path.join(path, "ema", name + ".ema"), ema / 100, column_names)  # the script multiplies by 100
+        write_wav(os.path.join(path, "wav", name + ".wav"),
+                  synthetic_wav(duration, speech_start, speech_end, sampling_rate_wav, rng), sampling_rate_wav)
+        boundaries = phone_boundaries(speech_start, speech_end, rng)
+        with open(os.path.join(path, "phone_labels", name + ".lab"), "w") as f:
+            f.write("separator ;\nnfields 1\n#\n")  # then the end of each label
+            f.write("{:.6f}\t 26 #\n".format(speech_start))
+            for end in boundaries[1:]:
+                f.write("{:.6f}\t 26 a\n".format(end))
+            f.write("{:.6f}\t 26 #\n".format(duration))
+
+
+def mat_struct(records, fields):
+    """
+    :param records: list of tuples, one per element of the struct array
+    :param fields: names of the fields
+    :return: struct array (1, # of records) as saved by matlab
+    """
+    struct = np.zeros((1, len(records)), dtype=[(field, "O") for field in fields])
+    for k, record in enumerate(records):
+        struct[0, k] = record
+    return struct
+
+
+def generate_usc(path_to_raw, sp, n_utterances, min_duration, max_duration, rng, nan_rate, sentences_per_file=5):
+    """
+    write recordings of sentences_per_file sentences for the usc speaker sp, until n_utterances sentences :
+    wav/*.wav (20kHz), mat/*.mat (6 sensors, 100Hz) and trans/*.trans (start,end,phone,word,sentence id). The last
+    sentence of a recording continues at the beginning of the next one.
+    """
+    sampling_rate_ema, sampling_rate_wav = 100, 20000
+    path = os.path.join(path_to_raw, "Raw_data", "usc", sp)
+    for directory in ["wav", "mat", "trans"]:
+        if not os.path.exists(os.path.join(path, directory)):
+            os.makedirs(os.path.join(path, directory))
+    sentence = 1
+    continued = 0  # duration of the end of the previous sentence, at the beginning of this recording
+    while sentence <= n_utterances:
+        name = "usctimit_ema_{}_{:03d}_{:03d}".format(sp.lower(), sentence, sentence + sentences_per_file - 1)
+        rows = []
+        t = rng.uniform(0.2, 0.5)  # silence at the beginning of the recording
+        if continued > 0:
+            rows.append((0., continued, sentence - 1))
+            t = continued + rng.uniform(0.3, 0.8)
+        for s in range(sentence, min(sentence + sentences_per_file, n_utterances + 1)):
+            sentence_duration = rng.uniform(min_duration, max_duration)
+            rows.append((t, t + sentence_duration, s))
+            t += sentence_duration + rng.uniform(0.3, 0.8)  # silence between two sentences
+        sentence = rows[-1][2] + 1
+        continued = 0
+        if sentence <= n_utterances and rng.uniform() < 0.5:  # the last sentence is cut by the end of the recording
+            continued = rng.uniform(0.3, (rows[-1][1] - rows[-1][0]) / 2)
+            rows[-1] = (rows[-1][0], rows[-1][1] - continued, rows[-1][2])
+            duration = rows[-1][1]
+        else:
+            duration = t
+        wav = 0.003 * rng.randn(int(np.ceil(duration * sampling_rate_wav)) + 1).astype(np.float32)
+        for start, end, s in rows:
+            i_start = int(start * sampling_rate_wav)
+            speech = synthetic_wav(end - start, 0, end - start, sampling_rate_wav, rng)[:len(wav) - i_start]
+            wav[i_start:i_start + len(speech)] = speech
+        write_wav(os.path.join(path, "wav", name + ".wav"), wav, sampling_rate_wav)
+        n_points = int(np.ceil(duration * sampling_rate_ema)) + 1
+        sensors = [("audio", sampling_rate_wav, wav[:, None])]
+        for sensor in ["ul", "ll", "li", "td", "tb", "tt"]:
+            trajectories = synthetic_trajectories(n_points, 3, sampling_rate_ema, rng, nan_rate=nan_rate)
+            sensors.append((sensor, sampling_rate_ema, trajectories))
+        sio.savemat(os.path.join(path, "mat", name + ".mat"), {name: mat_struct(sensors, ["NAME", "SRATE", "SIGNAL"])})
+        with open(os.path.join(path, "trans", name + ".trans"), "w") as f:
+            f.write("0.000,{:.3f},sil,,\n".format(rows[0][0]))
+            for start, end, s in rows:
+                boundaries = phone_boundaries(start, end, rng)
+                for phone_start, phone_end in zip(boundaries[:-1], boundaries[1:]):
+                    f.write("{:.3f},{:.3f},a,word,{}\n".format(phone_start, phone_end, s))
+
+
+def generate_haskins(path_to_raw, sp, n_utterances, min_duration, max_duration, rng, nan_rate):
+    """
+    write n_utterances for the Haskins speaker sp : data/*.mat with the struct array of the audio (44.1kHz) and of
+    the 8 sensors (100Hz). The words and phones of the audio begin and end with a silence (see detect_silence)
+    """
+    sampling_rate_ema, sampling_rate_wav = 100, 44100
+    fields = ["NAME", "SRATE", "SIGNAL", "SOURCE", "SENTENCE", "WORDS", "PHONES"]
+    path = os.path.join(path_to_raw, "Raw_data", "Haskins", sp, "data")
+    if not os.path.exists(path):
+        os.makedirs(path)
+    for k in range(n_utterances):
+        name = "{}_B01_S{:02d}_R01_N".format(sp, k + 1)
+        duration, speech_start, speech_end = random_timing(rng, min_duration, max_duration)
+        wav = synthetic_wav(duration, speech_start, speech_end, sampling_rate_wav, rng)
+        boundaries = phone_boundaries(speech_start, speech_end, rng)
+        labels = mat_struct([("sp", np.array([[0., speech_start]]))] +
+                            [("a", np.array([[start, end]])) for start, end in zip(boundaries[:-1], boundaries[1:])] +
+                            [("sp", np.array([[speech_end, duration]]))], ["LABEL", "OFFS"])
+        records = [("audio", float(sampling_rate_wav), wav[:, None].astype(np.float64), "", "sentence", labels,
+                    labels)]
+        n_points = int(duration * sampling_rate_ema)
+        for sensor in ["TD", "TB", "TT", "UL", "LL", "ML", "JAW", "JAWL"]:
+            trajectories = synthetic_trajectories(n_points, 3, sampling_rate_ema, rng, nan_rate=0)
+            records.append((sensor, float(sampling_rate_ema), trajectories, "", "", np.zeros((0, 0)), np.zeros((0, 0))))
+        sio.savemat(os.path.join(path, name + ".mat"), {name: mat_struct(records, fields)})
+
+
+def generate_raw_data(path_to_raw, corpus, speakers=None, n_utterances=20, min_duration=1., max_duration=4.,
+                      nan_rate=0.05, seed=0):
+    """
+    :param path_to_raw: directory where Raw_data is created
+    :param corpus: list of the corpus
+    :param speakers: list of the speakers to generate (None for all the speakers of the corpus)
+    :param n_utterances: # of utterances per speaker
+    :param min_duration: min duration (sec) of an utterance
+    :param max_duration: max duration (sec) of an utterance
+    :param nan_rate: probability that a trajectory has missing values (in one utterance)
+    :param seed: seed of the random generator, the same seed gives the same data
+    write the synthetic raw data of the speakers of the corpus
+    """
+    rng = np.random.RandomState(seed)
+    for co in corpus:
+        for sp in get_speakers_per_corpus(co):
+            if speakers is not None and sp not in speakers:
+                continue
+            print("generating {} utterances for {} {}".format(n_utterances, co, sp))
+            if co == "mocha":
+                generate_mocha(path_to_raw, sp, n_utterances, min_duration, max_duration, rng, nan_rate)
+            elif co == "MNGU0":
+                generate_mngu0(path_to_raw, n_utterances, min_duration, max_duration, rng, nan_rate)
+            elif co == "usc":
+                generate_usc(path_to_raw, sp, n_utterances, min_duration, max_duration, rng, nan_rate)
+            elif co == "Haskins":
+                generate_haskins(path_to_raw, sp, n_utterances, min_duration, max_duration, rng, nan_rate)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='synthetic raw data in the formats of the corpus')
+    parser.add_argument('--path_to_raw_data', type=str, required=True,
+                        help='directory where the folder Raw_data is created')
+    parser.add_argument('--corpus', type=str, default=["MNGU0", "mocha", "usc", "Haskins"],
+                        help='corpus to generate, eg [mocha,usc]')
+    parser.add_argument('--speakers', type=str, default=None,
+                        help='speakers to generate, eg [fsew0,F1], by default all the speakers of the corpus')
+    parser.add_argument('--n_utterances', type=int, default=20,
+                        help='# of utterances per speaker')
+    parser.add_argument('--min_duration', type=float, default=1.,
+                        help='min duration of an utterance (sec)')
+    parser.add_argument('--max_duration', type=float, default=4.,
+                        help='max duration of an utterance (sec)')
+    parser.add_argument('--nan_rate', type=float, default=0.05,
+                        help='probability that a trajectory has missing values')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the random generator')
+    args = parser.parse_args()
+    corpus = args.corpus[1:-1].split(",") if type(args.corpus) is str else args.corpus
+    speakers = args.speakers[1:-1].split(",") if args.speakers is not None else None
+    generate_raw_data(args.path_to_raw_data, corpus, speakers, args.n_utterances, args.min_duration,
+                      args.max_duration, args.nan_rate, args.seed)
@@ -19,27 +19,141 @@ from random import shuffle
 import csv
 import json
 import scipy
+import scipy.ndimage
+import scipy.signal
+import scipy.interpolate
+from fractions import Fraction
+from numpy.lib.stride_tricks import as_strided
+import hashlib
 
 root_folder = os.path.dirname(os.getcwd())
 
 
-def get_delta_features(array, window=5):
+def get_delta_features(array, window=5, offsets=None):
     """
-    :param array: nparray (K,N) N features per frame, K frames.
+    :param array: nparray (K,N) N features per frame, K frames. It can also be the frames of several utterances
+    concatenated, then offsets gives where each utterance starts
     :param window: size of the window to calculate the average speed of the features
+    :param offsets: None if array is one utterance, else array (n_utterances+1) with the index of the first frame of
+    each utterance in array, and the total # of frames at the end (0, K1, K1+K2, ...)
     :return: the speed of each feature wrt 5 future and 5 past frames
+    The speed is sum_lag (lag-1)*(x[t+lag]-x[t-lag]) / (2*sum_lag lag**2) for lag in 1..window (weights of the
+    previous implementation), the first and last frame of each utterance being repeated.
+    It is calculated as one convolution along the time axis for all the features (product of the sliding windows of
+    frames with the weights).
+    """
+    lags = np.arange(-window, window + 1)
+    weights = np.sign(lags) * np.maximum(np.abs(lags) - 1, 0) / (2 * np.sum(np.arange(1, window + 1) ** 2))
+    if offsets is None:
+        padded = np.pad(array, ((window, window), (0, 0)), "edge")
+        keep = slice(None)
+    else:
+        offsets = np.asarray(offsets)
+        lengths_padded = np.diff(offsets) + 2 * window
+        first = np.repeat(offsets[:-1], lengths_padded)
+        last = np.repeat(offsets[1:] - 1, lengths_padded)
+        # position in array of each frame of the utterances padded with window frames on each side
+        positions = np.arange(len(first)) - np.repeat(np.cumsum(lengths_padded) - lengths_padded, lengths_padded) \
+            - window + first
+        padded = array[np.minimum(np.maximum(positions, first), last)]  # the first and last frames are repeated
+        keep = ((positions >= first) & (positions <= last))[window:len(positions) - window]
+    padded = np.ascontiguousarray(padded)
+    # for each frame, the features of the 2*window+1 frames around it (view), weighted in one product
+    frames = as_strided(padded, shape=(len(padded) - 2 * window, padded.shape[1], 2 * window + 1),
+                        strides=(padded.strides[0], padded.strides[1], padded.strides[0]), writeable=False)
+    delta_features = np.matmul(frames, weights)
+    return delta_features[keep]
+
+
+def context_view(frames, window=5):
+    """
+    :param frames: nparray (K+2*window, N) the frames of an utterance with window frames of context before the first
+    frame and after the last one
+    :return: nparray (K, N*(2*window+1)), for each of the K frames the 2*window+1 frames around it concatenated.
+    The result is a read only view on frames (no copy) : since the frames are contiguous in memory, the features of
+    the 2*window+1 consecutive frames are already next to each other.
+    """
+    frames = np.ascontiguousarray(frames)
+    n_frames = len(frames) - 2 * window
+    return as_strided(frames, shape=(n_frames, frames.shape[1] * (2 * window + 1)),
+                      strides=(frames.strides[0], frames.strides[1]), writeable=False)
+
+
+def add_context(mfcc, window=5):
+    """
+    :param mfcc: nparray (K,N) N features per frame, K frames
+    :param window: # of frames of context added on each side
+    :return: nparray (K, N*(2*window+1)) the features of the 2*window+1 frames around each frame, padded with zeros
+    (view on the padded frames, see context_view)
+    """
+    padding = np.zeros((window, mfcc.shape[1]))
+    frames = np.concatenate([padding, mfcc, padding])
+    return context_view(frames, window)
+
+
+def compact_context(mfcc, window=5):
+    """
+    :param mfcc: nparray (K, N*(2*window+1)) features with context (see add_context)
+    :param window: # of frames of context on each side
+    :return: nparray (K+2*window, N) the frames without the redundancy of the context : the K frames plus the window
+    frames before and after them. context_view of the result gives mfcc back.
+    """
+    n_features = mfcc.shape[1] // (2 * window + 1)
+    return np.concatenate([mfcc[:, :n_features], mfcc[-1, n_features:].reshape(2 * window, n_features)])
 
+
+def mfcc_with_context(mfcc, window=5, n_features=39):
+    """
+    :param mfcc: nparray, either (K, n_features*(2*window+1)) the features with context, or (K+2*window,n_features)
+    if the mfcc were saved in compact mode
+    :return: the features with context (K, n_features*(2*window+1)), a view for compact mfcc
     """
-    all_diff = []
-    for lag in range(1, window + 1):
-        padding = np.ones((lag, array.shape[1]))
-        past = np.concatenate([padding * array[0], array[:-lag]])
-        future = np.concatenate([array[lag:], padding * array[-1]])
-        all_diff.append(future - past)
-    tempo =np.array([all_diff[lag] * lag for lag in range(window)])
-    norm = 2 * np.sum(i ** 2 for i in range(1, window + 1))
-    delta_features = np.sum(tempo,axis=0)/norm
-    return delta_features
+    if mfcc.shape[1] == n_features:
+        return context_view(mfcc, window)
+    return mfcc
+
+
+hashes_of_files = dict()  # hashes already calculated in this process, per (path, size, modification time)
+
+
+def hash_file(path, block_size=2 ** 20):
+    """
+    :param path: path of the file
+    :param block_size: size of the blocks read
+    :return: the sha1 (hex string) of the content of the file, used to know if a raw file has changed. The file is
+    read again only if its size or its modification time changed since the last call in this process.
+    """
+    status = os.stat(path)
+    key = (os.path.abspath(path), status.st_size, status.st_mtime_ns)
+    if key not in hashes_of_files:
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                sha.update(block)
+        hashes_of_files[key] = sha.hexdigest()
+    return hashes_of_files[key]
+
+
+def normalize_npy_in_place(path, mean, std, previous_mean=None, previous_std=None, block_size=1024):
+    """
+    :param path: path of a .npy file (K,N)
+    :param mean: (N) values to substract
+    :param std: (N) values to divide by
+    :param previous_mean: (N) if the data are already normalized, mean they were normalized with (else None)
+    :param previous_std: (N) if the data are already normalized, std they were normalized with (else None)
+    :param block_size: # of frames normalized at once
+    normalize the data of the file without loading them entirely nor rewriting the file : the file is memory mapped
+    and normalized block after block.
+    """
+    data = np.load(path, mmap_mode='r+')
+    for start in range(0, len(data), block_size):
+        block = data[start:start + block_size]
+        if previous_std is not None:
+            block = block * previous_std + previous_mean
+        data[start:start + block_size] = (block - mean) / std
+    data.flush()
+    del data
+
 
 def get_speakers_per_corpus(corpus):
     """
@@ -94,6 +208,108 @@ def get_fileset_names(speaker):
     outF.close()
 
 
+def pack_speaker(speaker, block_size=256):
+    """
+    :param speaker: name of a speaker, already preprocessed
+    :param block_size: # of utterances read before the packed arrays are written
+    export of the preprocessed data of the speaker for the training : the mfcc and the ema_final of all the utterances
+    are concatenated in 2 arrays Preprocessed_data/speaker/packed/mfcc.npy and ema_final.npy, and index.json gives for
+    each utterance where its frames start in each array and its # of frames. The training can then load the 2 arrays
+    memory mapped once and take each utterance as a slice (see load_packed_speaker), instead of opening 2 files per
+    utterance at each batch. The files per utterance are kept (they are needed to preprocess again only what changed)
+    The arrays are written with open_memmap, so that all the data of the speaker is never in memory.
+    """
+    files_path = os.path.join(root_folder, "Preprocessed_data", speaker)
+    path_packed = os.path.join(files_path, "packed")
+    if not os.path.exists(path_packed):
+        os.makedirs(path_packed)
+    names = sorted([name[:-4] for name in os.listdir(os.path.join(files_path, "ema_final")) if name.endswith('.npy')])
+    if not names:
+        return
+    path_manifest = os.path.join(files_path, "manifest.json")
+    index = {"names": names, "manifest": hash_file(path_manifest) if os.path.exists(path_manifest) else None}
+    for directory in ["mfcc", "ema_final"]:
+        arrays = [np.load(os.path.join(files_path, directory, name + ".npy"), mmap_mode='r') for name in names]
+        lengths = [len(a) for a in arrays]
+        offsets = np.cumsum([0] + lengths)
+        tmp_path = os.path.join(path_packed, directory + ".tmp.npy")
+        packed = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=arrays[0].dtype,
+                                           shape=(int(offsets[-1]), arrays[0].shape[1]))
+        for start in range(0, len(arrays), block_size):
+            end = min(start + block_size, len(arrays))
+            packed[offsets[start]:offsets[end]] = np.concatenate(arrays[start:end])
+        packed.flush()
+        del packed, arrays
+        os.replace(tmp_path, os.path.join(path_packed, directory + ".npy"))
+        index[directory + "_offsets"] = offsets[:-1].tolist()
+        index[directory + "_lengths"] = lengths
+    with open(os.path.join(path_packed, "index.json.tmp"), 'w') as f:
+        json.dump(index, f)
+    os.replace(os.path.join(path_packed, "index.json.tmp"), os.path.join(path_packed, "index.json"))
+
+
+def load_packed_speaker(speaker):
+    """
+    :param speaker: name of a speaker
+    :return: None if the data of the speaker is not packed (see pack_speaker) or if it was preprocessed again since it
+    was packed, else a dictionnary {"mfcc" : memory mapped array, "ema_final" : memory mapped array, "index" :
+    {utterance name : (mfcc offset, mfcc length, ema offset, ema length)}}
+    """
+    files_path = os.path.join(root_folder, "Preprocessed_data", speaker)
+    path_index = os.path.join(files_path, "packed", "index.json")
+    if not os.path.exists(path_index):
+        return None
+    with open(path_index, 'r') as f:
+        index = json.load(f)
+    path_manifest = os.path.join(files_path, "manifest.json")
+    if index["manifest"] != (hash_file(path_manifest) if os.path.exists(path_manifest) else None):
+        print("the packed data of {} is older than its preprocessing, the files per utterance are used".format(speaker))
+        return None
+    packed = {directory: np.load(os.path.join(files_path, "packed", directory + ".npy"), mmap_mode='r')
+              for directory in ["mfcc", "ema_final"]}
+    packed["index"] = {name: (index["mfcc_offsets"][k], index["mfcc_lengths"][k],
+                              index["ema_final_offsets"][k], index["ema_final_lengths"][k])
+                       for k, name in enumerate(index["names"])}
+    return packed
+
+
+def update_dataset_index(speaker):
+    """
+    :param speaker: name of a speaker, already preprocessed (and its fileset written by get_fileset_names)
+    update the entries of the speaker in Preprocessed_data/dataset_index.json, the index of all the preprocessed
+    utterances used by the training to find the files without looking for the speaker names in the filenames.
+    For each utterance : speaker, corpus, category (see articulators_per_speaker.csv), split (train/valid/test, from
+    the fileset), # of frames, and offsets in the packed arrays of the speaker (None if not packed, see pack_speaker)
+    The utterances are in the order of the fileset files.
+    """
+    path_index = os.path.join(root_folder, "Preprocessed_data", "dataset_index.json")
+    index = {"utterances": dict()}
+    if os.path.exists(path_index):
+        with open(path_index, 'r') as f:
+            index = json.load(f)
+    index["utterances"] = {name: entry for name, entry in index["utterances"].items()
+                           if entry["speaker"] != speaker}
+    with open(os.path.join(root_folder, "Preprocessing", "articulators_per_speaker.csv"), 'r') as csvFile:
+        reader = csv.reader(csvFile, delimiter=';')
+        next(reader)
+        category, corpus = [row[19:21] for row in reader if row[0] == speaker][0]
+    files_path = os.path.join(root_folder, "Preprocessed_data", speaker)
+    packed = load_packed_speaker(speaker)
+    for split in ["train", "valid", "test"]:
+        names = open(os.path.join(root_folder, "Preprocessed_data", "fileset", speaker + "_" + split + ".txt"),
+                     "r").read().split()
+        for name in names:
+            entry = {"speaker": speaker, "corpus": corpus, "category": category, "split": split,
+                     "n_frames": len(np.load(os.path.join(files_path, "ema_final", name + ".npy"), mmap_mode='r')),
+                     "mfcc_offset": None, "ema_offset": None}
+            if packed is not None and name in packed["index"]:
+                entry["mfcc_offset"], _, entry["ema_offset"], _ = packed["index"][name]
+            index["utterances"][name] = entry
+    with open(path_index + ".tmp", 'w') as f:
+        json.dump(index, f)
+    os.replace(path_index + ".tmp", path_index)
+
+
 def read_csv_arti_ok_per_speaker():
     """
     create a dictionnary , with different categories as keys (from A to F).
@@ -168,6 +384,90 @@ def low_pass_filter_weight(cut_off,sampling_rate):
     return h
 
 
+low_pass_filters = dict()  # weights of the low pass filters already designed, per (cut_off, sampling_rate)
+
+
+def get_low_pass_filter(cut_off, sampling_rate):
+    """
+    :param cut_off:  cutoff of the filter
+    :param sampling_rate:  sampling rate of the data
+    :return: the weights of the lowpass filter (see low_pass_filter_weight), designed only once per
+    (cut_off, sampling_rate)
+    """
+    if (cut_off, sampling_rate) not in low_pass_filters:
+        weights = low_pass_filter_weight(cut_off, sampling_rate)
+        weights.flags.writeable = False
+        low_pass_filters[(cut_off, sampling_rate)] = weights
+    return low_pass_filters[(cut_off, sampling_rate)]
+
+
+def smooth_channels(data, weights, pad=30):
+    """
+    :param data: nparray (K,N) N channels (ema trajectories), K points
+    :param weights: weights of the filter (odd length)
+    :param pad: # of points added at each extremity (symmetric) before filtering to limit edge effects
+    :return: the N channels filtered, (K,N)
+    All the channels are filtered in one call, the channels are put in contiguous rows so that the convolution runs
+    along contiguous memory. Same result as np.convolve(mode='same') on each padded channel.
+    """
+    channels = np.pad(np.ascontiguousarray(data.T), ((0, 0), (pad, pad)), "symmetric")
+    channels = scipy.ndimage.convolve1d(channels, weights, axis=1, mode='constant')
+    return channels[:, pad:-pad].T
+
+
+def interpolate_nan(ema):
+    """
+    :param ema: nparray (K,N) N ema trajectories, with missing values (nan)
+    :return: the trajectories where the missing values are replaced (in place) by a cubic spline built with the
+    available points of the same trajectory. One spline per trajectory with nan, evaluated once at all its missing
+    points.
+    """
+    missing = np.isnan(ema)
+    for channel in np.nonzero(missing.any(axis=0))[0]:
+        available = np.nonzero(~missing[:, channel])[0]
+        to_fill = np.nonzero(missing[:, channel])[0]
+        if len(available) > 3:
+            spline = scipy.interpolate.splrep(available, ema[available, channel], k=3)
+            ema[to_fill, channel] = scipy.interpolate.splev(to_fill, spline)
+        elif len(available) > 0:  # not enough points for a cubic spline
+            ema[to_fill, channel] = np.interp(to_fill, available, ema[available, channel])
+        else:
+            ema[to_fill, channel] = 0
+    return ema
+
+
+""" fft : scipy.signal.resample, polyphase : scipy.signal.resample_poly with the ratio of the sampling rates,
+interpolation : linear interpolation of the trajectories (they are smoothed before, so no anti aliasing needed) """
+ema_resampling_methods = ["fft", "polyphase", "interpolation"]
+
+
+def resample_ema(ema, n_points, sr_ema=None, sr_wanted=None, method="fft"):
+    """
+    :param ema: nparray (K,N) N ema trajectories
+    :param n_points: # of points wanted
+    :param sr_ema: sampling rate of the ema (only for polyphase)
+    :param sr_wanted: sampling rate wanted (only for polyphase)
+    :param method: one of ema_resampling_methods
+    :return: the trajectories resampled (n_points,N), all the trajectories at once. Point k of the output
+    corresponds to the position k*K/n_points of the input, as for scipy.signal.resample.
+    """
+    if method == "fft":
+        return scipy.signal.resample(ema, num=n_points)
+    if method == "polyphase":
+        ratio = Fraction(sr_wanted).limit_denominator(1000) / Fraction(sr_ema).limit_denominator(1000)
+        ema = scipy.signal.resample_poly(ema, ratio.numerator, ratio.denominator, axis=0, padtype="line")
+        if len(ema) >= n_points:  # the durations may differ of 1 or 2 points
+            return ema[:n_points]
+        return np.pad(ema, ((0, n_points - len(ema)), (0, 0)), "edge")
+    if method == "interpolation":
+        positions = np.arange(n_points) * (len(ema) / float(n_points))
+        before = np.floor(positions).astype(int)
+        after = np.minimum(before + 1, len(ema) - 1)
+        weights = (positions - before)[:, None]
+        return ema[before] * (1 - weights) + ema[after] * weights
+    raise NameError("unknown resampling method {}, choose among {}".format(method, ema_resampling_methods))
+
+
 def split_sentences(speaker ,max_length = 300):
     """
     :param speaker:
@@ -177,6 +477,8 @@ def split_sentences(speaker ,max_length = 300):
     less than max_lenght points.
     Warning : when split the original file is removed
               ema files are split only in ema_final (those used for the training)
+    The training can also split the sentences without rewriting the files, with its parameter max_length (see
+    split_filenames in Training/tools_learning.py)
     """
     Preprocessed_data_path = os.path.join(root_folder, "Preprocessed_data")
     file_names = os.listdir(os.path.join(Preprocessed_data_path, speaker, "ema_final"))
@@ -187,6 +489,8 @@ def split_sentences(speaker ,max_length = 300):
     Number_cut = 0
     for f in file_names :
         mfcc = np.load(os.path.join(Preprocessed_data_path,speaker,"mfcc",f))
+        compact = mfcc.shape[1] != 429
+        mfcc = mfcc_with_context(mfcc)
         ema_VT = np.load(os.path.join(Preprocessed_data_path,speaker,"ema_final",f))
         cut_in_N = int(len(mfcc)/max_length) +1
         if cut_in_N > 1 :
@@ -195,6 +499,8 @@ def split_sentences(speaker ,max_length = 300):
             cut_size = int(len(mfcc)/cut_in_N)
             for k in range(cut_in_N-1) :
                 mfcc_k = mfcc[temp : temp + cut_size]
+                if compact:
+                    mfcc_k = compact_context(mfcc_k)
                 ema_k_vt = ema_VT[temp:temp+cut_size,:]
 
                 temp = temp + cut_size
@@ -202,6 +508,8 @@ def split_sentences(speaker ,max_length = 300):
                 np.save(os.path.join(Preprocessed_data_path,speaker,"ema_final",f[:-4]+"_split_"+str(k)),ema_k_vt)
 
             mfcc_last = mfcc[temp :]
+            if compact:
+                mfcc_last = compact_context(mfcc_last)
             ema_last_vt = ema_VT[temp:, :]
             np.save(os.path.join(Preprocessed_data_path, speaker, "mfcc", f[:-4] + "_split_" + str(cut_in_N-1)), mfcc_last)
             np.save(os.path.join(Preprocessed_data_path, speaker, "ema_final", f[:-4] + "_split_" + str(cut_in_N-1)), ema_last_vt)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Comparison of the prediction of the test sentences : one sentence at a time with the autograd (as before
+    in evaluate_on_test) and by batches of sentences without gradients (my_ac2art_model.predict).
+    We give the max difference of the predictions, the time and the size of the tensors kept for the backward of the
+    longest sentence (the graph built for nothing before).
+    Checks that a model not packed gives the same predictions when the lengths of the sentences are given (they are
+    ignored, its lstm layers always go through the sentences of the batch).
+    Also compares the rmse and pearson per articulator computed sentence by sentence with np.corrcoef (as before) and
+    by batches with Metrics_accumulator (metrics.py).
+    The sentences are random, or the utterances of a speaker already preprocessed (--speaker).
+    Exemple : python benchmark_evaluation.py --speaker msak0 --precision float32
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import time
+import argparse
+import numpy as np
+import torch
+from Training.model import my_ac2art_model
+from Training.tools_learning import load_filenames, load_np_ema_and_mfcc, precisions
+from Training.metrics import Metrics_accumulator
+
+
+def get_sentences(n_sentences, speaker=None, seed=0):
+    """
+    :return: list of the acoustic features (L,429) of the sentences
+    """
+    if speaker is not None:
+        filenames = load_filenames([speaker], part=["train", "valid", "test"])[:n_sentences]
+        return load_np_ema_and_mfcc(filenames, "float64")[0]
+    rng = np.random.RandomState(seed)
+    return [rng.randn(L, 429) for L in rng.randint(100, 1000, n_sentences)]
+
+
+def predict_one_by_one(model, X):
+    """
+    :return: (predictions not smoothed, predictions smoothed, max bytes of the tensors saved for the backward of a
+    sentence), the sentences predicted one at a time with the autograd
+    """
+    saved = dict()  # storage : bytes, a storage can be saved several times
+    max_saved = 0
+
+    def pack_hook(tensor):
+        saved[tensor.untyped_storage().data_ptr()] = tensor.untyped_storage().nbytes()
+        return tensor
+
+    predictions_not_smoothed, predictions_smoothed = [], []
+    with torch.autograd.graph.saved_tensors_hooks(pack_hook, lambda tensor: tensor):
+        for x in X:
+            saved.clear()
+            x_torch = torch.from_numpy(x).view(1, len(x), model.input_dim).to(model.dtype)
+            y_pred_not_smoothed = model(x_torch, False)
+            predictions_smoothed.append(model.filter_layer(y_pred_not_smoothed).double().detach().numpy()[0])
+            predictions_not_smoothed.append(y_pred_not_smoothed.double().detach().numpy()[0])
+            max_saved = max(max_saved, sum(saved.values()))
+    return predictions_not_smoothed, predictions_smoothed, max_saved
+
+
+def check_lengths(model, X, batch_size=3):
+    """
+    :return: max difference between the predictions of a zero padded batch of sentences with and without their lengths
+    """
+    x = torch.nn.utils.rnn.pad_sequence([torch.from_numpy(x) for x in X[:batch_size]], batch_first=True)
+    x = x.to(model.dtype)
+    with torch.no_grad():
+        return (model(x) - model(x, lengths=[len(x) for x in X[:batch_size]])).abs().max().item()
+
+
+def compare_evaluations(X, precision, packed=False, batch_norma=False, filter_type="fix"):
+    """
+    print the differences of the predictions and the times of the 2 evaluations
+    """
+    torch.manual_seed(0)
+    model = my_ac2art_model(hidden_dim=300, input_dim=429, output_dim=18, batch_size=10, filter_type=filter_type,
+                            precision=precision, packed=packed, batch_norma=batch_norma)
+    t0 = time.perf_counter()
+    reference_not_smoothed, reference_smoothed, saved = predict_one_by_one(model, X)
+    t1 = time.perf_counter()
+    predictions_not_smoothed, predictions_smoothed = model.predict(X)
+    t2 = time.perf_counter()
+    max_diff = max(np.max(np.abs(p - r)) for p, r in zip(predictions_not_smoothed + predictions_smoothed,
+                                                         reference_not_smoothed + reference_smoothed))
+    if not packed:
+        print("not packed : max diff with and without the lengths {:.1e}".format(check_lengths(model, X)))
+    print("packed {}, batch norma {} : one by one {:.2f}s (graph of {:.0f}MB for the longest sentence), batches without "
+          "gradients {:.2f}s (x{:.1f}), max diff {:.1e}".format(packed, batch_norma, t1 - t0, saved / 2 ** 20,
+                                                                  t2 - t1, (t1 - t0) / (t2 - t1), max_diff))
+
+
+def compare_metrics(Y, Y_pred, batch_size=50):
+    """
+    print the differences of the rmse and pearson per articulator computed sentence by sentence (as before) and by
+    Metrics_accumulator, and the times
+    """
+    t0 = time.perf_counter()
+    all_rmse = np.zeros((1, 18))
+    all_pearson = np.zeros((1, 18))
+    for y, y_pred in zip(Y, Y_pred):
+        all_rmse = np.concatenate((all_rmse, np.sqrt(np.mean(np.square(y - y_pred), axis=0)).reshape(1, 18)))
+        pearson = [np.corrcoef(y[:, k], y_pred[:, k])[0, 1] for k in range(18)]
+        all_pearson = np.concatenate((all_pearson, np.array(pearson).reshape(1, 18)))
+    all_pearson[np.isnan(all_pearson)] = 0
+    rmse, pearson = np.mean(all_rmse[1:], axis=0), np.mean(all_pearson[1:], axis=0)
+    t1 = time.perf_counter()
+    metrics = Metrics_accumulator()
+    for i in range(0, len(Y), batch_size):
+        metrics.update(Y[i:i + batch_size], Y_pred[i:i + batch_size])
+    t2 = time.perf_counter()
+    print("metrics of {} sentences : one by one {:.3f}s, Metrics_accumulator {:.3f}s (x{:.1f}), max diff rmse {:.1e}, "
+          "pearson {:.1e}".format(len(Y), t1 - t0, t2 - t1, (t1 - t0) / (t2 - t1),
+                                  np.max(np.abs(metrics.rmse() - rmse)), np.max(np.abs(metrics.pearson() - pearson))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='comparison of the evaluations of the model on test sentences')
+    parser.add_argument('--n_sentences', type=int, default=20,
+                        help='# of sentences')
+    parser.add_argument('--speaker', type=str, default=None,
+                        help='speaker whose preprocessed utterances are used, by default random sentences')
+    parser.add_argument('--precision', type=str, default="float32", choices=precisions,
+                        help='precision of the model')
+    args = parser.parse_args()
+    X = get_sentences(args.n_sentences, args.speaker)
+    for packed, batch_norma in [(False, False), (True, False), (False, True)]:
+        compare_evaluations(X, args.precision, packed, batch_norma)
+    rng = np.random.RandomState(0)
+    Y = [np.cumsum(rng.randn(L, 18), axis=0) for L in rng.randint(100, 1000, 1000)]
+    compare_metrics(Y, [y + rng.randn(*y.shape) for y in Y])
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Comparison of the smoothing of the articulatory trajectories (filter_layer of the model) : one convolution per
+    articulator (as before), one depthwise convolution for all the articulators, and the product of the FFTs.
+    For each # of frames we give the max difference with the loop and the time of the forward + backward.
+    Exemple : python benchmark_filter.py --lengths [100,300,1000] --precision float32
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import time
+import argparse
+import torch
+from Training.model import my_ac2art_model
+from Training.tools_learning import precisions
+
+
+def filter_loop(model, y):
+    """
+    :return: y smoothed articulator by articulator with the lowpass layer (the filter_layer before)
+    """
+    B, L, C = y.shape
+    y_smoothed = torch.zeros(B, L, C, dtype=y.dtype)
+    for i in range(C):
+        y_smoothed[:, :, i] = model.lowpass(y[:, :, i].reshape(B, 1, L)).view(B, L)
+    return y_smoothed
+
+
+def time_filter(function, y, n_repeat=10):
+    """
+    :return: (output, time in ms of the forward + backward)
+    """
+    t0 = time.perf_counter()
+    for _ in range(n_repeat):
+        y_smoothed = function(y)
+        y_smoothed.sum().backward()
+    return y_smoothed.detach(), 1000 * (time.perf_counter() - t0) / n_repeat
+
+
+def compare_filters(lengths, batch_size, precision, filter_type="unfix"):
+    """
+    print for each # of frames the differences with the loop and the times of the 3 methods
+    """
+    model = my_ac2art_model(hidden_dim=300, input_dim=429, output_dim=18, batch_size=batch_size,
+                            filter_type=filter_type, precision=precision)
+    for L in lengths:
+        y = torch.randn(batch_size, L, 18, dtype=model.dtype, requires_grad=True)
+        reference, t_loop = time_filter(lambda y: filter_loop(model, y), y)
+        results = []
+        for fft_length in [0, 1]:  # always the convolution, always the FFTs
+            model.fft_length = fft_length
+            y_smoothed, t = time_filter(model.filter_layer, y)
+            results.append(((y_smoothed - reference).abs().max().item(), t))
+        print("{} frames : loop {:.2f}ms, depthwise conv {:.2f}ms (max diff {:.1e}), fft {:.2f}ms (max diff {:.1e})"
+              .format(L, t_loop, results[0][1], results[0][0], results[1][1], results[1][0]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='comparison of the smoothings of the articulatory trajectories')
+    parser.add_argument('--lengths', type=str, default="[50,100,300,1000]",
+                        help='list of # of frames of the trajectories')
+    parser.add_argument('--batch_size', type=int, default=10,
+                        help='# of trajectories (of 18 articulators) per batch')
+    parser.add_argument('--precision', type=str, default="float32", choices=precisions,
+                        help='precision of the model and the trajectories')
+    parser.add_argument('--filter_type', type=str, default="unfix",
+                        help='"fix" or "unfix"')
+    args = parser.parse_args()
+    lengths = [int(L) for L in args.lengths[1:-1].split(",")]
+    compare_filters(lengths, args.batch_size, args.precision, args.filter_type)
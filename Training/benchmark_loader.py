@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Checks that the batches of Prefetch_loader (see data_loader.py) are the same with and without worker threads, and
+    compares the time of one epoch of training (forward + backward + step) when the batches are loaded before each
+    step (n_workers=0, as before) or in the background.
+    Also compares the zero padding of random batches and of batches of sentences of similar lengths (--bucket_size),
+    and the time to pad the batches in new tensors (pad_batch) or in the buffers of Batch_collate.
+    The speakers must be preprocessed.
+    Exemple : python benchmark_loader.py --speakers [fsew0,msak0] --n_workers 2
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import time
+import argparse
+import torch
+from Training.model import my_ac2art_model
+from Training.tools_learning import criterion_both, load_filenames, load_np_ema_and_mfcc, precisions, get_dtype
+from Training.data_loader import Prefetch_loader, Batch_collate, get_batches, get_bucketed_batches, get_lengths, \
+    padding_ratio, pad_batch
+
+
+def check_batches(batches, precision, n_workers, prefetch):
+    """
+    :return: True if the loader gives the same batches with n_workers threads and without threads
+    """
+    loaded = Prefetch_loader(batches, precision, n_workers=0)
+    prefetched = Prefetch_loader(batches, precision, n_workers=n_workers, prefetch=prefetch)
+    return all(categ_1 == categ_2 and torch.equal(x_1, x_2) and torch.equal(y_1, y_2)
+               for (categ_1, x_1, y_1, lengths_1, mask_1), (categ_2, x_2, y_2, lengths_2, mask_2)
+               in zip(loaded, prefetched))
+
+
+def time_collate(batches, precision, n_repeat=5):
+    """
+    :return: (time per batch of pad_batch, time per batch of Batch_collate) in sec, the files are loaded before
+    """
+    dtype = get_dtype(precision)
+    loaded = [load_np_ema_and_mfcc(filenames) for categ, filenames in batches]
+    collate = Batch_collate(dtype)
+    times = []
+    for function in [lambda x, y: pad_batch(x, y, dtype), collate]:
+        t0 = time.perf_counter()
+        for _ in range(n_repeat):
+            for x, y in loaded:
+                function(x, y)
+        times.append((time.perf_counter() - t0) / n_repeat / len(loaded))
+    return times
+
+
+def time_epoch(model, batches, precision, n_workers, prefetch):
+    """
+    :return: (time of the epoch, time waiting for the batches) in sec
+    """
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+    waiting = 0
+    t0 = time.perf_counter()
+    t_wait = t0
+    for categ, x, y, lengths, mask in Prefetch_loader(batches, precision, n_workers=n_workers, prefetch=prefetch):
+        waiting += time.perf_counter() - t_wait
+        optimizer.zero_grad()
+        loss = criterion_both(y, model(x), 90, False, None)
+        loss.backward()
+        optimizer.step()
+        t_wait = time.perf_counter()
+    return time.perf_counter() - t0, waiting
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='comparison of the loading of the batches with and without threads')
+    parser.add_argument('--speakers', type=str, default="[fsew0]",
+                        help='list of the preprocessed speakers whose training files are used')
+    parser.add_argument('--batch_size', type=int, default=10,
+                        help='# of utterances per batch')
+    parser.add_argument('--n_workers', type=int, default=1,
+                        help='# of threads loading the batches')
+    parser.add_argument('--prefetch', type=int, default=2,
+                        help='max # of batches loaded in advance')
+    parser.add_argument('--bucket_size', type=int, default=10,
+                        help='# of batches per bucket of sentences of similar lengths')
+    parser.add_argument('--precision', type=str, default="float32", choices=precisions,
+                        help='precision of the model and the data')
+    args = parser.parse_args()
+    speakers = args.speakers[1:-1].replace("'", "").replace(' ', '').split(",")
+    filenames = load_filenames(speakers, part=["train", "valid", "test"])
+    lengths = get_lengths(filenames)
+    batches = get_batches(filenames, args.batch_size, shuffle=True)
+    print("padding ratio : random batches {:.3f}, bucketed batches {:.3f}".format(
+        padding_ratio(batches, lengths),
+        padding_ratio(get_bucketed_batches(list(filenames), args.batch_size, lengths, bucket_size=args.bucket_size),
+                      lengths)))
+    print("{} batches, same batches with and without threads : {}".format(
+        len(batches), check_batches(batches, args.precision, args.n_workers, args.prefetch)))
+    print("padding of a batch : new tensors {:.2f}ms, buffers of Batch_collate {:.2f}ms".format(
+        *[1000 * t for t in time_collate(batches, args.precision)]))
+    model = my_ac2art_model(hidden_dim=300, input_dim=429, output_dim=18, batch_size=args.batch_size,
+                            filter_type="fix", precision=args.precision)
+    for n_workers in [0, args.n_workers]:
+        duration, waiting = time_epoch(model, batches, args.precision, n_workers, args.prefetch)
+        print("n_workers {} : epoch {:.2f}s, waiting for the batches {:.2f}s".format(n_workers, duration, waiting))
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Comparison of the precisions of the model (see tools_learning.precisions) : float64 (as before), float32 and
+    bfloat16 (autocast, only if supported by the cpu).
+    For each precision the model has the same weights (those of the float64 model), and we compare to float64 :
+        - the predictions, the loss and the rmse / pearson per articulator on the same batches
+        - the loss after a few steps of training from the same weights on the same batches
+        - the throughput of the training (frames per second, forward + backward + step of the optimizer)
+    The batches are random, or the utterances of a speaker already preprocessed (--speaker).
+    Exemple : python benchmark_precision.py --n_batches 10 --n_steps 20
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import numpy as np
+import torch
+import time
+import argparse
+from Training.model import my_ac2art_model
+from Training.tools_learning import criterion_both, load_filenames, load_np_ema_and_mfcc, precisions, \
+    bfloat16_supported
+
+
+def get_batches(n_batches, batch_size, speaker=None, seed=0):
+    """
+    :param n_batches: # of batches
+    :param batch_size: # of utterances per batch
+    :param speaker: speaker whose preprocessed utterances are used, None for random utterances
+    :return: list of (x, y) lists of mfcc (K,429) and ema (K,18) in float64
+    """
+    rng = np.random.RandomState(seed)
+    if speaker is not None:
+        filenames = load_filenames([speaker], part=["train", "valid", "test"])[:n_batches * batch_size]
+        x, y = load_np_ema_and_mfcc(filenames, "float64")
+        return [(x[k:k + batch_size], y[k:k + batch_size]) for k in range(0, len(x), batch_size)]
+    batches = []
+    for _ in range(n_batches):
+        lengths = rng.randint(100, 400, batch_size)
+        x = [rng.randn(length, 429) for length in lengths]
+        y = [np.cumsum(rng.randn(length, 18), axis=0) / 10 for length in lengths]
+        batches.append((x, y))
+    return batches
+
+
+def create_models(filter_type="fix", seed=0):
+    """
+    :return: dictionnary precision : model, all with the weights of the float64 model
+    """
+    torch.manual_seed(seed)
+    models = {"float64": my_ac2art_model(hidden_dim=300, input_dim=429, output_dim=18, batch_size=10,
+                                         filter_type=filter_type, precision="float64")}
+    for precision in precisions[1:]:
+        if precision == "bfloat16" and not bfloat16_supported():
+            print("bfloat16 not supported on this cpu, not compared")
+            continue
+        models[precision] = my_ac2art_model(hidden_dim=300, input_dim=429, output_dim=18, batch_size=10,
+                                            filter_type=filter_type, precision=precision)
+        models[precision].load_state_dict(models["float64"].state_dict())  # the weights are converted
+    return models
+
+
+def get_metrics(model, batches, alpha=90):
+    """
+    :return: (predictions, mean loss, rmse per arti, pearson per arti) of the model on the batches, in float64
+    """
+    predictions, losses, rmse, pearson = [], [], [], []
+    with torch.no_grad():
+        for x, y in batches:
+            x_torch, y_torch = model.prepare_batch(x, y)
+            y_pred = model(x_torch)
+            losses.append(criterion_both(y_torch, y_pred, alpha, False, None).item())
+            y_pred = y_pred.double().numpy()
+            for j in range(len(x)):
+                L = len(x[j])
+                prediction = y_pred[j, :L]
+                predictions.append(prediction)
+                rmse.append(np.sqrt(np.mean((y[j] - prediction) ** 2, axis=0)))
+                pearson.append([np.corrcoef(y[j][:, k], prediction[:, k])[0, 1] for k in range(18)])
+    return predictions, np.mean(losses), np.mean(rmse, axis=0), np.nanmean(pearson, axis=0)
+
+
+def train_steps(model, batches, n_steps, alpha=90, lr=0.001):
+    """
+    :return: (loss of the last step, frames per second) for n_steps of training on the batches (in a loop)
+    """
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    n_frames = 0
+    t0 = time.perf_counter()
+    for step in range(n_steps):
+        x, y = batches[step % len(batches)]
+        x_torch, y_torch = model.prepare_batch(x, y)
+        optimizer.zero_grad()
+        loss = criterion_both(y_torch, model(x_torch), alpha, False, None)
+        loss.backward()
+        optimizer.step()
+        n_frames += sum(len(u) for u in x)
+    return loss.item(), n_frames / (time.perf_counter() - t0)
+
+
+def compare_precisions(n_batches, batch_size, n_steps, speaker=None, filter_type="fix"):
+    """
+    print for each precision the differences with float64 and the throughput of the training
+    """
+    batches = get_batches(n_batches, batch_size, speaker)
+    models = create_models(filter_type)
+    reference = get_metrics(models["float64"], batches)
+    for precision, model in models.items():
+        predictions, loss, rmse, pearson = get_metrics(model, batches)
+        max_diff = max(np.max(np.abs(p - r)) for p, r in zip(predictions, reference[0]))
+        print("{} : max diff of the predictions {:.2e}, loss {:.6f} (float64 {:.6f}), max diff rmse {:.2e}, "
+              "max diff pearson {:.2e}".format(precision, max_diff, loss, reference[1],
+                                               np.max(np.abs(rmse - reference[2])),
+                                               np.max(np.abs(pearson - reference[3]))))
+    throughput = dict()
+    for precision, model in models.items():
+        loss, throughput[precision] = train_steps(model, batches, n_steps)
+        print("{} : loss after {} steps {:.6f}, {:.0f} frames/s (x{:.2f} wrt float64)".format(
+            precision, n_steps, loss, throughput[precision], throughput[precision] / throughput["float64"]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='comparison of the precisions of the model')
+    parser.add_argument('--n_batches', type=int, default=5,
+                        help='# of batches')
+    parser.add_argument('--batch_size', type=int, default=10,
+                        help='# of utterances per batch')
+    parser.add_argument('--n_steps', type=int, default=10,
+                        help='# of steps of training for the loss and the throughput')
+    parser.add_argument('--speaker', type=str, default=None,
+                        help='speaker whose preprocessed utterances are used, by default random utterances')
+    parser.add_argument('--filter_type', type=str, default="fix",
+                        help='"out", "fix" or "unfix"')
+    args = parser.parse_args()
+    compare_precisions(args.n_batches, args.batch_size, args.n_steps, args.speaker, args.filter_type)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Loading of the batches in the background during the training.
+    The batches of an epoch are known in advance (list of (category, filenames)), so while the model learns on the
+    batch N, worker threads already load the files of the next batches and zero pad them (the reading of the npy
+    files and the copies of numpy/torch release the GIL). At most "prefetch" batches are loaded in advance, so the
+    memory needed stays bounded.
+    The batches are zero padded in buffers allocated once and reused (Batch_collate), on gpu they are in pinned
+    memory so that the transfer to the gpu can be non blocking.
+    The batches can also be made of sentences of similar lengths (get_bucketed_batches) to reduce the zero padding.
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import collections
+import random
+import threading
+import concurrent.futures
+import numpy as np
+import torch
+from Training.tools_learning import load_np_ema_and_mfcc, get_dtype, get_n_frames, get_mask, get_speaker_of_file
+
+
+def pad_batch(x, y, dtype=torch.float64):
+    """
+    :param x: list of B acoustic features (K,429) (K not always the same)
+    :param y: list of B articulatory trajectories (K,18)
+    :param dtype: torch dtype of the tensors
+    :return: 2 tensors (B, K_max, 429) and (B, K_max, 18), the sentences are zero padded at the end
+    """
+    max_length = np.max([len(phrase) for phrase in x])
+    B = len(x)
+    new_x = torch.zeros((B, max_length, x[0].shape[1]), dtype=dtype)
+    new_y = torch.zeros((B, max_length, y[0].shape[1]), dtype=dtype)
+    for j in range(B):
+        new_x[j, :len(x[j])] = torch.from_numpy(x[j])
+        new_y[j, :len(y[j])] = torch.from_numpy(y[j])
+    return new_x, new_y
+
+
+class Batch_collate(object):
+    """
+    zero padding of the batches in a pool of buffers allocated once, so that no memory is allocated for each batch.
+    A batch is written in the next buffer of the pool, so the tensors of a batch are valid until n_buffers other
+    batches are collated : n_buffers must be more than the # of batches loaded in advance + the batch in use.
+    The buffers are not pickled, so an instance can be sent to worker processes, each process has its own pool.
+    """
+    def __init__(self, dtype=torch.float64, batch_size=10, length_cap=500, n_buffers=4, columns=None,
+                 pin_memory=False):
+        """
+        :param dtype: torch dtype of the tensors
+        :param batch_size: # of sentences per batch, for the initial size of the buffers
+        :param length_cap: # of frames per sentence for the initial size of the buffers. A buffer is reallocated
+        bigger only if a batch does not fit in it.
+        :param n_buffers: # of buffers in the pool
+        :param columns: indexes of the articulators to keep in y, None to keep all of them
+        :param pin_memory: whether the buffers are in pinned memory (for a faster transfer to the gpu)
+        """
+        self.dtype = dtype
+        self.batch_size = batch_size
+        self.length_cap = length_cap
+        self.columns = columns
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.buffers = [None] * n_buffers
+        self.next_buffer = 0
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["buffers"] = [None] * len(self.buffers)
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def get_buffer(self, n_frames, dim_x, dim_y):
+        """
+        :param n_frames: # of frames of the padded batch (B*K_max)
+        :param dim_x: # of acoustic features per frame
+        :param dim_y: # of articulatory trajectories
+        :return: the next buffers (1D tensors) of the pool for x and y, of at least n_frames*dim elements
+        """
+        with self.lock:  # several threads can collate at the same time
+            i = self.next_buffer
+            self.next_buffer = (i + 1) % len(self.buffers)
+            if self.buffers[i] is None or len(self.buffers[i][0]) < n_frames * dim_x or \
+                    len(self.buffers[i][1]) < n_frames * dim_y:
+                capacity = max(n_frames, self.batch_size * self.length_cap)
+                self.buffers[i] = (torch.empty(capacity * dim_x, dtype=self.dtype, pin_memory=self.pin_memory),
+                                   torch.empty(capacity * dim_y, dtype=self.dtype, pin_memory=self.pin_memory))
+            return self.buffers[i]
+
+    def __call__(self, x, y, arti=None):
+        """
+        :param x: list of B acoustic features (K,429) (K not always the same)
+        :param y: list of B articulatory trajectories (K,18)
+        :param arti: (B,18) 1 if the articulator is available for the sentence, 0 if not, None if all of them are
+        :return: x (B,K_max,429), y (B,K_max,18 or len(columns)), lengths (B) the # of frames of each sentence and
+        mask (B,K_max,1) 1 for the frames of the sentences, 0 for the zero padding (see tools_learning.get_mask). If
+        arti is given the mask is (B,K_max,18 or len(columns)) and also 0 for the articulators not available.
+        Each sentence is copied once in the buffers (and converted to the dtype at the same time).
+        """
+        lengths = [len(mfcc) for mfcc in x]
+        B, K = len(x), max(lengths)
+        dim_x = x[0].shape[1]
+        dim_y = y[0].shape[1] if self.columns is None else len(self.columns)
+        buffer_x, buffer_y = self.get_buffer(B * K, dim_x, dim_y)
+        new_x = buffer_x[:B * K * dim_x].view(B, K, dim_x)
+        new_y = buffer_y[:B * K * dim_y].view(B, K, dim_y)
+        for j, L in enumerate(lengths):
+            new_x[j, :L] = torch.from_numpy(x[j])
+            new_x[j, L:] = 0
+            new_y[j, :L] = torch.from_numpy(y[j] if self.columns is None else y[j][:, self.columns])
+            new_y[j, L:] = 0
+        lengths = torch.tensor(lengths)
+        if arti is not None and self.columns is not None:
+            arti = torch.as_tensor(arti)[:, self.columns]
+        return new_x, new_y, lengths, get_mask(lengths, K, self.dtype, arti=arti)
+
+
+def get_batches(filenames, batch_size, categ=None, shuffle=False):
+    """
+    :param filenames: list of the files (or segments of files) to go through
+    :param batch_size: # of files per batch, the last batch can be smaller
+    :param categ: category of the files, given with each batch
+    :param shuffle: whether to shuffle the files (in place, like before)
+    :return: list of (categ, filenames of the batch)
+    """
+    if shuffle:
+        random.shuffle(filenames)
+    return [(categ, filenames[i:i + batch_size]) for i in range(0, len(filenames), batch_size)]
+
+
+def get_lengths(filenames):
+    """
+    :param filenames: list of files (or segments of files (name, start, end))
+    :return: dictionnary file : # of frames, read in the dataset index (see tools_learning.get_n_frames)
+    """
+    return {filename: filename[2] - filename[1] if isinstance(filename, tuple) else get_n_frames(filename)
+            for filename in filenames}
+
+
+def get_bucketed_batches(filenames, batch_size, lengths, categ=None, bucket_size=10):
+    """
+    :param filenames: list of the files (or segments of files) to go through, shuffled in place
+    :param batch_size: # of files per batch
+    :param lengths: dictionnary file : # of frames (see get_lengths)
+    :param categ: category of the files, given with each batch
+    :param bucket_size: # of batches per bucket
+    :return: list of (categ, filenames of the batch)
+    The files are shuffled and cut in buckets of bucket_size*batch_size files. In each bucket the files are sorted by
+    length before being cut in batches, so the sentences of a batch have similar lengths and the zero padding is small.
+    Then the batches are shuffled, so that the order and the content of the batches change at each epoch.
+    """
+    random.shuffle(filenames)
+    batches = []
+    n_files_bucket = bucket_size * batch_size
+    for i in range(0, len(filenames), n_files_bucket):
+        bucket = sorted(filenames[i:i + n_files_bucket], key=lambda filename: lengths[filename])
+        batches += [(categ, bucket[j:j + batch_size]) for j in range(0, len(bucket), batch_size)]
+    random.shuffle(batches)
+    return batches
+
+
+def padding_ratio(batches, lengths):
+    """
+    :param batches: list of (categ, filenames)
+    :param lengths: dictionnary file : # of frames (see get_lengths)
+    :return: share of the frames of the padded batches that are zero padding
+    """
+    n_frames, n_padded = 0, 0
+    for categ, filenames in batches:
+        lengths_batch = [lengths[filename] for filename in filenames]
+        n_frames += sum(lengths_batch)
+        n_padded += max(lengths_batch) * len(lengths_batch)
+    return 1 - n_frames / n_padded if n_padded > 0 else 0.
+
+
+def get_n_buffers(n_workers, prefetch):
+    """
+    :return: # of buffers needed by the Batch_collate of a Prefetch_loader : the batches loaded in advance, the batches
+    being loaded by the workers, and the batch in use
+    """
+    return max(prefetch, 1) + n_workers + 1
+
+
+class Prefetch_loader(object):
+    """
+    iterates over the batches as (categ, x, y, lengths, mask) with x and y the padded tensors (see Batch_collate),
+    while the next batches are loaded by worker threads
+    """
+    def __init__(self, batches, precision="float64", collate=None, n_workers=1, prefetch=2, pin_memory=False,
+                 arti_per_speaker=None):
+        """
+        :param batches: list of (categ, filenames) (see get_batches)
+        :param precision: precision of the model (see tools_learning.precisions)
+        :param collate: Batch_collate (or function (x, y) -> (x, y, lengths, mask), also given arti if
+        arti_per_speaker is given), by default a Batch_collate in the dtype of the precision. Its pool must have at
+        least max(prefetch, 1) + n_workers + 1 buffers (see get_n_buffers).
+        :param n_workers: # of threads loading the batches, 0 to load each batch when it is needed (as before)
+        :param prefetch: max # of batches loaded in advance
+        :param pin_memory: whether to put the tensors in pinned memory (for a faster transfer to the gpu)
+        :param arti_per_speaker: dictionnary speaker : 18 0/1, 1 if the articulator is available (see
+        tools_learning.get_arti_per_speaker). If given, the articulators not available for the speaker of each sentence
+        are 0 in the mask of the batch, so that a batch can have sentences of several categories. None to mask only
+        the padding.
+        """
+        self.batches = batches
+        self.precision = precision
+        if collate is None:
+            collate = Batch_collate(get_dtype(precision), n_buffers=get_n_buffers(n_workers, prefetch),
+                                    pin_memory=pin_memory)
+        self.collate = collate
+        self.n_workers = n_workers
+        self.prefetch = max(prefetch, 1)
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.arti_per_speaker = arti_per_speaker
+
+    def __len__(self):
+        return len(self.batches)
+
+    def load_batch(self, batch):
+        """
+        :param batch: (categ, filenames)
+        :return: (categ, x, y, lengths, mask) with the tensors of the batch, the # of frames of each sentence and the
+        mask of the padding
+        """
+        categ, filenames = batch
+        x, y = load_np_ema_and_mfcc(filenames)  # converted to the dtype when they are copied in the batch
+        if self.arti_per_speaker is None:
+            x, y, lengths, mask = self.collate(x, y)
+        else:
+            arti = [self.arti_per_speaker[get_speaker_of_file(filename)] for filename in filenames]
+            x, y, lengths, mask = self.collate(x, y, arti)
+        if self.pin_memory and not x.is_pinned():
+            x, y = x.pin_memory(), y.pin_memory()
+        return categ, x, y, lengths, mask
+
+    def __iter__(self):
+        if self.n_workers == 0:
+            for batch in self.batches:
+                yield self.load_batch(batch)
+            return
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.n_workers)
+        pending = collections.deque(executor.submit(self.load_batch, batch)
+                                    for batch in self.batches[:self.prefetch])
+        next_batch = len(pending)
+        try:
+            while pending:
+                future = pending.popleft()
+                if next_batch < len(self.batches):  # the next batch is loaded while the model uses this one
+                    pending.append(executor.submit(self.load_batch, self.batches[next_batch]))
+                    next_batch += 1
+                yield future.result()
+        finally:  # also when the loop is left before the end
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
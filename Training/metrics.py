@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Metrics of the evaluation of the model : rmse and pearson correlation per articulator between the true and the
+    predicted trajectories of each sentence, averaged over the sentences.
+    The metrics of a batch of sentences are computed at once on the concatenated trajectories (rmse_and_pearson), and
+    Metrics_accumulator sums them batch after batch, so the sentences of a speaker can be evaluated a few at a time
+    (see my_ac2art_model.evaluate_on_files) instead of loading all of them.
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import numpy as np
+
+
+def rmse_and_pearson(y, y_pred, lengths):
+    """
+    :param y: (N,n) target trajectories of a batch of sentences, concatenated (N = sum of the lengths)
+    :param y_pred: (N,n) predicted trajectories, concatenated the same way
+    :param lengths: (B) # of frames of each sentence
+    :return: rmse and pearson (B,n) of each trajectory of each sentence.
+    The pearson is nan if a trajectory is constant (as np.corrcoef).
+    """
+    lengths = np.asarray(lengths)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    n_frames = lengths.reshape(-1, 1)
+
+    def sum_per_sentence(values):
+        return np.add.reduceat(values, starts, axis=0)  # (B,n)
+
+    rmse = np.sqrt(sum_per_sentence(np.square(y - y_pred)) / n_frames)
+    y_1 = y - np.repeat(sum_per_sentence(y) / n_frames, lengths, axis=0)
+    y_pred_1 = y_pred - np.repeat(sum_per_sentence(y_pred) / n_frames, lengths, axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pearson = sum_per_sentence(y_1 * y_pred_1) / (np.sqrt(sum_per_sentence(y_1 ** 2)) *
+                                                      np.sqrt(sum_per_sentence(y_pred_1 ** 2)))
+    return rmse, pearson
+
+
+class Metrics_accumulator(object):
+    """
+    sums of the rmse and pearson per articulator of the sentences evaluated so far
+    """
+    def __init__(self, n_arti=18, std_speaker=1, to_ignore=[]):
+        """
+        :param n_arti: # of articulators
+        :param std_speaker: std of each articulator (or 1), to unormalize the rmse
+        :param to_ignore: indexes of the articulators not available for the speaker, their rmse and pearson are 0
+        """
+        self.std_speaker = std_speaker
+        self.to_ignore = to_ignore
+        self.sum_rmse = np.zeros(n_arti)
+        self.sum_pearson = np.zeros(n_arti)
+        self.n_sentences = 0
+
+    def update(self, y, y_pred):
+        """
+        :param y: list of the target trajectories (L,n) of a batch of sentences
+        :param y_pred: list of the predicted trajectories (L,n) of the same sentences
+        add the rmse and pearson of the sentences (a nan pearson counts as 0)
+        """
+        if len(y) == 0:
+            return
+        lengths = [len(trajectory) for trajectory in y]
+        rmse, pearson = rmse_and_pearson(np.concatenate(y).astype(np.float64, copy=False),
+                                         np.concatenate(y_pred).astype(np.float64, copy=False), lengths)
+        pearson[np.isnan(pearson)] = 0
+        self.sum_rmse += np.sum(rmse, axis=0)
+        self.sum_pearson += np.sum(pearson, axis=0)
+        self.n_sentences += len(y)
+
+    def rmse_without_std(self):
+        """
+        :return: mean rmse per articulator of the normalized trajectories
+        """
+        return self.sum_rmse / max(self.n_sentences, 1)
+
+    def rmse(self):
+        """
+        :return: mean rmse per articulator, unormalized with std_speaker
+        """
+        rmse = self.rmse_without_std() * self.std_speaker
+        rmse[self.to_ignore] = 0
+        return rmse
+
+    def pearson(self):
+        """
+        :return: mean pearson per articulator
+        """
+        pearson = self.sum_pearson / max(self.n_sentences, 1)
+        pearson[self.to_ignore] = 0
+        return pearson
+
+    def print_results(self):
+        rmse = self.rmse()
+        pearson = self.pearson()
+        print("rmse final : ", np.mean(rmse[rmse != 0]))
+        print("rmse mean per arti : \n", rmse)
+        print("pearson final : ", np.mean(pearson[pearson != 0]))
+        print("pearson mean per arti : \n", pearson)
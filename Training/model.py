@@ -27,7 +27,11 @@ import math
 import matplotlib.pyplot as plt
 import numpy as np
 import gc
-from Training.tools_learning import get_right_indexes, criterion_pearson_no_reduction
+import contextlib
+from Training.tools_learning import get_right_indexes, get_dtype, bfloat16_supported, get_mask, \
+    load_np_ema_and_mfcc
+from Training.data_loader import pad_batch
+from Training.metrics import Metrics_accumulator
 
 def memReport(all = False):
     """
@@ -49,7 +53,8 @@ class my_ac2art_model(torch.nn.Module):
     pytorch implementation of neural network
     """
     def __init__(self, hidden_dim, input_dim, output_dim, batch_size,name_file="", sampling_rate=100,
-                  cutoff=10,cuda_avail =False, filter_type=1, batch_norma=False):
+                  cutoff=10,cuda_avail =False, filter_type=1, batch_norma=False, precision="float64", packed=False,
+                  fft_length=64):
         """
         :param hidden_dim: int, hidden dimension of lstm (usually 300)
         :param input_dim: int, input dimension of the acoustic features for 1 frame mfcc (usually 429)
@@ -62,8 +67,24 @@ class my_ac2art_model(torch.nn.Module):
         :param filter type: str, "out": filter outside the nn, "fix" : weights are FIXED,
         "unfix" : weights are updated during the training
         :param batch_norma: bool, whether to add batch normalization after the lstm layers
+        :param precision: str, "float64", "float32" or "bfloat16" (see tools_learning.precisions). The weights are
+        converted to the dtype of the precision, in bfloat16 they stay in float32 and the forward is done in bfloat16
+        (autocast). If bfloat16 is not supported by the cpu/gpu, float32 is used.
+        :param packed: bool, whether the lstm layers go through the frames of each sentence, given as packed sequences
+        so that the padded frames are skipped (see forward). Else the lstm layers go through the first dimension of
+        the input, that is through the sentences of the batch (and each frame is alone when 1 sentence is predicted),
+        as the models trained before.
+        :param fft_length: int, # of frames from which the smoothing is done with FFTs instead of the convolution
+        (see filter_layer), 0 to always use the convolution
         """
         super(my_ac2art_model, self).__init__()
+        if precision == "bfloat16" and not bfloat16_supported(cuda_avail):
+            print("bfloat16 not supported here, float32 is used instead")
+            precision = "float32"
+        self.precision = precision
+        self.dtype = get_dtype(precision)
+        self.packed = packed
+        self.fft_length = fft_length
         self.input_dim = input_dim
         self.output_dim = output_dim
         self.hidden_dim = hidden_dim
@@ -102,6 +123,15 @@ class my_ac2art_model(torch.nn.Module):
             self.device = torch.device("cuda")
         else:
             self.device = None
+        self.to(dtype=self.dtype)
+
+    def autocast(self):
+        """
+        :return: the context in which the forward is done, autocast to bfloat16 for the precision bfloat16
+        """
+        if self.precision != "bfloat16":
+            return contextlib.nullcontext()
+        return torch.autocast(device_type="cuda" if self.cuda_avail else "cpu", dtype=torch.bfloat16)
 
     def prepare_batch(self, x, y):
         """
@@ -112,45 +142,72 @@ class my_ac2art_model(torch.nn.Module):
         :return: 2 np array of sizes (B, K_max, 18) and (B, K_max, 429
         x,y initially data of the batch with different sizes . the script zeropad the acoustic and
         articulatory sequences so that all element in the batch have the same size
+        the tensors are in the dtype of the precision of the model
         """
 
-        max_length = np.max([len(phrase) for phrase in x])
-        B = len(x)  # often batch size but not for validation
-        new_x = torch.zeros((B, max_length, self.input_dim), dtype=torch.double)
-        new_y = torch.zeros((B, max_length, self.output_dim), dtype=torch.double)
-        for j in range(B):
-            zeropad = torch.nn.ZeroPad2d((0, 0, 0, max_length - len(x[j])))
-            new_x[j] = zeropad(torch.from_numpy(x[j])).double()
-            new_y[j] = zeropad(torch.from_numpy(y[j])).double()
-        x = new_x.view((B, max_length, self.input_dim))
-        y = new_y.view((B, max_length, self.output_dim))
+        return pad_batch(x, y, self.dtype)
 
-        return x, y
-
-    def forward(self, x, filter_output=None):
+    def forward(self, x, filter_output=None, lengths=None):
         """
         :param x: (Batchsize,K,429)  acoustic features corresponding to batch size
         :param filter_output: whether or not to pass throught the convolutional layer
-        :return: the articulatory prediction (Batchsize, K,18) based on the current weights
+        :param lengths: # of frames of each sentence of the batch (list or tensor of size Batchsize), None if all the
+        sentences have K frames. Only used if the model is packed, ignored else.
+        :return: the articulatory prediction (Batchsize, K,18) based on the current weights, in the dtype of the
+        precision of the model (float32 for bfloat16). If the model is packed, the predictions of a sentence do not
+        depend on the padding : the lstm layers skip the padded frames, and the padded frames are put to 0 before the
+        smoothing (as the zero padding of the convolution for a sentence alone).
         """
         if filter_output is None :
             filter_output = (self.filter_type != "out")
+        if not self.packed:  # the lstm layers go through the sentences of the batch, as the models trained before
+            lengths = None
+        elif lengths is None:
+            lengths = [x.shape[1]] * x.shape[0]
+        with self.autocast():
+            y_pred = self.forward_layers(x, filter_output, lengths)
+        return y_pred.to(self.dtype)
+
+    def lstm(self, layer, x, lengths):
+        """
+        :param layer: one of the lstm layers
+        :param x: (Batchsize,K,D) input of the layer
+        :param lengths: # of frames of each sentence, None if the model is not packed
+        :return: output of the layer (Batchsize,K,2*hidden_dim), 0 on the padded frames if the model is packed
+        """
+        if lengths is None:
+            return layer(x)[0]
+        K = x.shape[1]
+        x = torch.nn.utils.rnn.pack_padded_sequence(x, torch.as_tensor(lengths, device="cpu"), batch_first=True,
+                                                    enforce_sorted=False)
+        lstm_out = layer(x)[0]
+        return torch.nn.utils.rnn.pad_packed_sequence(lstm_out, batch_first=True, total_length=K)[0]
+
+    def forward_layers(self, x, filter_output, lengths=None):
+        """
+        :param x: (Batchsize,K,429)  acoustic features corresponding to batch size
+        :param filter_output: whether or not to pass throught the convolutional layer
+        :param lengths: # of frames of each sentence if the model is packed, else None
+        :return: the articulatory prediction, see forward
+        """
         dense_out =  torch.nn.functional.relu(self.first_layer(x))
         dense_out_2 = torch.nn.functional.relu(self.second_layer(dense_out))
-        lstm_out, hidden_dim = self.lstm_layer(dense_out_2)
+        lstm_out = self.lstm(self.lstm_layer, dense_out_2, lengths)
         B = lstm_out.shape[0] #presque tjrs batch size
         if self.batch_norma :
             lstm_out_temp = lstm_out.view(B,2*self.hidden_dim,-1)
             lstm_out_temp = torch.nn.functional.relu(self.batch_norm_layer(lstm_out_temp))
             lstm_out= lstm_out_temp.view(B,  -1,2 * self.hidden_dim)
         lstm_out = torch.nn.functional.relu(lstm_out)
-        lstm_out, hidden_dim = self.lstm_layer_2(lstm_out)
+        lstm_out = self.lstm(self.lstm_layer_2, lstm_out, lengths)
         if self.batch_norma :
             lstm_out_temp = lstm_out.view(B,2*self.hidden_dim,-1)
             lstm_out_temp = torch.nn.functional.relu(self.batch_norm_layer_2(lstm_out_temp))
             lstm_out= lstm_out_temp.view(B,  -1,2 * self.hidden_dim)
         lstm_out=torch.nn.functional.relu(lstm_out)
         y_pred = self.readout_layer(lstm_out)
+        if lengths is not None and min(lengths) < x.shape[1]:  # the padded frames would be smoothed with the others
+            y_pred = y_pred * get_mask(lengths, x.shape[1], y_pred.dtype, y_pred.device)
         if filter_output:
             y_pred = self.filter_layer(y_pred)
         return y_pred
@@ -226,25 +283,45 @@ class my_ac2art_model(torch.nn.Module):
         else :  # "out" we don't care the filter won't be applied, or "fix" the wieghts are fixed
             lowpass.weight = torch.nn.Parameter(weight_init,requires_grad=False)
 
-        lowpass = lowpass.double()
+        lowpass = lowpass.to(dtype=self.dtype)
         self.lowpass = lowpass
 
     def filter_layer(self, y):
         """
         :param y: (B,L,18) articulatory prediction not smoothed
         :return:  smoothed articulatory prediction
-        apply the convolution to each articulation, maybe not the best solution (changing n_channel of the conv layer ?)
-        """
-        B = len(y)
-        L = len(y[0])
-        y = y.double()
-        y_smoothed = torch.zeros(B, L, self.output_dim)
-        for i in range(self.output_dim):
-            traj_arti = y[:, :, i].view(B, 1, L)
-            traj_arti_smoothed = self.lowpass(traj_arti)
-            traj_arti_smoothed = traj_arti_smoothed.view(B, L)
-            y_smoothed[:, :, i] = traj_arti_smoothed
-        return y_smoothed
+        the 18 articulators are smoothed with the same weights (the weights of the lowpass layer, learnt if "unfix") :
+        one depthwise convolution for all the articulators, or for the sentences of at least fft_length frames the
+        product of the FFTs (same result, faster for long sentences, see fft_convolution)
+        """
+        C = y.shape[2]
+        L = y.shape[1]
+        weight = self.lowpass.weight  # (1,1,N)
+        padding = self.lowpass.padding[0]
+        y = y.transpose(1, 2)  # (B,18,L)
+        if self.fft_length > 0 and L >= self.fft_length:
+            y_smoothed = self.fft_convolution(y, weight.view(-1), padding)
+        else:
+            y_smoothed = torch.nn.functional.conv1d(y, weight.expand(C, 1, -1), padding=padding, groups=C)
+        return y_smoothed.transpose(1, 2)
+
+    @staticmethod
+    def fft_convolution(y, h, padding):
+        """
+        :param y: (B,18,L) trajectories
+        :param h: (N) weights of the filter
+        :param padding: # of zeros added at each side of the trajectories by the convolution
+        :return: (B,18,L) same result as conv1d(y, h, padding) (that is a correlation with h), calculated with the FFTs
+        of y and h, in float32 at least (no FFT in bfloat16)
+        """
+        N = len(h)
+        L = y.shape[-1]
+        n = L + N - 1  # no circular overlap
+        dtype = torch.promote_types(y.dtype, torch.float32)
+        y_fft = torch.fft.rfft(y.to(dtype), n=n)
+        h_fft = torch.fft.rfft(h.flip(0).to(dtype), n=n)  # correlation = convolution with the reversed filter
+        start = N - 1 - padding
+        return torch.fft.irfft(y_fft * h_fft, n=n)[..., start:start + L]
 
     def plot_results(self, y_target = None, y_pred_smoothed=None, y_pred_not_smoothed= None, to_cons=[]):
         """
@@ -278,6 +355,84 @@ class my_ac2art_model(torch.nn.Module):
             plt.savefig(save_pics_path)
             plt.close('all')
 
+    def predict(self, X, batch_frames=20000):
+        """
+        :param X: list of the acoustic features (L,429) of the sentences to predict
+        :param batch_frames: max # of frames (padding included) predicted at once
+        :return: 2 lists (same order as X) of the predictions (L,18) not smoothed and smoothed, np arrays in float64
+        The sentences are predicted without gradients (inference mode), by batches of sentences of similar lengths.
+        The model is run once per batch, the smoothed predictions are the unsmoothed ones passed through the filter.
+        The predictions are the same as when each sentence is predicted alone (see predict_batch).
+        """
+        order = sorted(range(len(X)), key=lambda i: len(X[i]))
+        predictions_not_smoothed = [None] * len(X)
+        predictions_smoothed = [None] * len(X)
+        batches = [[]]
+        for i in order:  # sorted, so the new sentence is the longest of the batch
+            if batches[-1] and (len(batches[-1]) + 1) * len(X[i]) > batch_frames:
+                batches.append([])
+            batches[-1].append(i)
+        with torch.inference_mode():
+            for batch in batches:
+                if not batch:
+                    continue
+                y_pred_not_smoothed, y_pred_smoothed = self.predict_batch([X[i] for i in batch])
+                for j, i in enumerate(batch):
+                    L = len(X[i])
+                    predictions_not_smoothed[i] = y_pred_not_smoothed[j, :L]
+                    predictions_smoothed[i] = y_pred_smoothed[j, :L]
+        return predictions_not_smoothed, predictions_smoothed
+
+    def predict_batch(self, X):
+        """
+        :param X: list of B acoustic features (L,429)
+        :return: predictions not smoothed and smoothed (B,L_max,18), np arrays in float64, 0 after the end of each
+        sentence.
+        If the model is packed the sentences are zero padded and the lstm layers skip the padding. Else the lstm
+        layers go through the first dimension of the input, so each sentence is predicted alone (1,L,429) as before
+        (its frames are already given all at once to the lstm layers), and the predictions are zero padded.
+        The smoothing is done on the zero padded predictions, which smoothes each sentence as alone.
+        """
+        lengths = [len(x) for x in X]
+        if self.packed:
+            x = torch.nn.utils.rnn.pad_sequence([torch.from_numpy(x) for x in X], batch_first=True)
+            y_pred_not_smoothed = self(x.to(device=self.device, dtype=self.dtype), False, lengths)
+        else:
+            y_pred_not_smoothed = torch.nn.utils.rnn.pad_sequence(
+                [self(torch.from_numpy(x).view(1, len(x), self.input_dim).to(device=self.device, dtype=self.dtype),
+                      False)[0] for x in X], batch_first=True)
+        y_pred_smoothed = self.filter_layer(y_pred_not_smoothed)
+        return y_pred_not_smoothed.double().cpu().numpy(), y_pred_smoothed.double().cpu().numpy()
+
+    def evaluate(self, batches, n_sentences, std_speaker, to_plot=False, to_consider=None, index_common=[],
+                 no_std=False):
+        """
+        :param batches: iterable of (X, Y) lists of the inputs and targets of a few test sentences. The batches can be
+        loaded one after the other (see evaluate_on_files), so that the whole test set is not in memory.
+        :param n_sentences: total # of sentences, to choose the sentences to plot
+        :param std_speaker : list of the std of each articulator, useful to calculate the RMSE of the predicction
+        :param to_plot: wether or not we want to save some predicted smoothed and not and true trajectory
+        :param to_consider: list of 0/1 for the test speaker , 1 if the articulator is ok for the test speaker
+        :return: Metrics_accumulator with the rmse and pearson per articulator of all the sentences
+        """
+        if index_common != [] and not no_std:
+            std_speaker = get_right_indexes(std_speaker, index_common, shape=1)
+        idx_to_ignore = [i for i in range(len(to_consider)) if not(to_consider[i])] if index_common == [] else []
+        metrics = Metrics_accumulator(self.output_dim, std_speaker, idx_to_ignore)
+        indices_to_plot = np.random.choice(n_sentences, 2, replace=False) if to_plot else []
+        i = 0
+        for X, Y in batches:
+            predictions_not_smoothed, predictions_smoothed = self.predict(X)
+            if index_common != []:
+                Y = [get_right_indexes(y, index_common, shape = 2) for y in Y]  # y (L,13)
+            for j in range(len(X)):
+                if i + j in indices_to_plot:
+                    self.plot_results(y_target = Y[j], y_pred_smoothed = predictions_smoothed[j],
+                                      y_pred_not_smoothed = predictions_not_smoothed[j], to_cons = to_consider)
+            metrics.update(Y, predictions_smoothed)
+            i += len(X)
+        return metrics
+
     def evaluate_on_test(self, X_test, Y_test, std_speaker, to_plot=False, to_consider=None, verbose=True, index_common = [], no_std = False):
         """
         :param X_test:  list of all the input of the test set
@@ -287,60 +442,11 @@ class my_ac2art_model(torch.nn.Module):
         :param to_consider: list of 0/1 for the test speaker , 1 if the articulator is ok for the test speaker
         :return: print and return the pearson correlation and RMSE between real and predicted trajectories per articulators.
         """
-        idx_to_ignore = [i for i in range(len(to_consider)) if not(to_consider[i])]
-        all_diff = np.zeros((1, self.output_dim))
-        all_pearson = np.zeros((1, self.output_dim))
-        if to_plot:
-            indices_to_plot = np.random.choice(len(X_test), 2, replace=False)
-        for i in range(len(X_test)):
-            L = len(X_test[i])
-            x_torch = torch.from_numpy(X_test[i]).view(1, L, self.input_dim)  #x (1,L,429)
-            y = Y_test[i].reshape((L, 18))                     #y (L,13)
-            if index_common != []:
-                y = get_right_indexes(y, index_common, shape = 2)
-            if self.cuda_avail:
-                x_torch = x_torch.to(device=self.device)
-            y_pred_not_smoothed = self(x_torch, False).double() #output y_pred (1,L,13)
-            y_pred_smoothed = self(x_torch, True).double()
-            if self.cuda_avail:
-                y_pred_not_smoothed = y_pred_not_smoothed.cpu()
-                y_pred_smoothed = y_pred_smoothed.cpu()
-            y_pred_not_smoothed = y_pred_not_smoothed.detach().numpy().reshape((L, self.output_dim))  # y_pred (L,13)
-            y_pred_smoothed = y_pred_smoothed.detach().numpy().reshape((L, self.output_dim))  # y_pred (L,13)
-            if to_plot:
-                if i in indices_to_plot:
-                    self.plot_results(y_target = y, y_pred_smoothed = y_pred_smoothed,
-                                      y_pred_not_smoothed = y_pred_not_smoothed, to_cons = to_consider)
-            rmse = np.sqrt(np.mean(np.square(y - y_pred_smoothed), axis=0))  # calculate rmse
-            rmse = np.reshape(rmse, (1, self.output_dim))
-
-            std_to_modify = std_speaker
-            if index_common != [] and not no_std:
-                std_to_modify = get_right_indexes(std_to_modify, index_common, shape=1)
-            rmse = rmse*std_to_modify  # unormalize
-            all_diff = np.concatenate((all_diff, rmse))
-            pearson = [0]*self.output_dim
-            for k in range(self.output_dim):
-                pearson[k] = np.corrcoef(y[:, k].T, y_pred_smoothed[:, k].T)[0, 1]
-            pearson = np.array(pearson).reshape((1, self.output_dim))
-            all_pearson = np.concatenate((all_pearson, pearson))
-        all_pearson = all_pearson[1:]
-        if index_common == []:
-            all_pearson[:, idx_to_ignore] = 0
-        all_diff = all_diff[1:]
-        if index_common == []:
-            all_diff[:, idx_to_ignore] = 0
-        all_pearson[np.isnan(all_pearson)] = 0
-
-        pearson_per_arti_mean = np.mean(all_pearson, axis=0)
-        rmse_per_arti_mean = np.mean(all_diff, axis=0)
+        metrics = self.evaluate([(X_test, Y_test)], len(X_test), std_speaker, to_plot=to_plot,
+                                to_consider=to_consider, index_common=index_common, no_std=no_std)
         if verbose:
-            print("rmse final : ", np.mean(rmse_per_arti_mean[rmse_per_arti_mean != 0]))
-            print("rmse mean per arti : \n", rmse_per_arti_mean)
-            print("pearson final : ", np.mean(pearson_per_arti_mean[pearson_per_arti_mean != 0]))
-            print("pearson mean per arti : \n", pearson_per_arti_mean)
-
-        return rmse_per_arti_mean, pearson_per_arti_mean
+            metrics.print_results()
+        return metrics.rmse(), metrics.pearson()
 
     def evaluate_on_test_modified(self,X_test, Y_test, std_speaker, to_plot=False, to_consider=None, verbose=True, index_common = [], no_std = False):
         """
@@ -349,68 +455,30 @@ class my_ac2art_model(torch.nn.Module):
         :param std_speaker : list of the std of each articulator, useful to calculate the RMSE of the predicction
         :param to_plot: wether or not we want to save some predicted smoothed and not and true trajectory
         :param to_consider: list of 0/1 for the test speaker , 1 if the articulator is ok for the test speaker
-        :return: print and return the pearson correlation and RMSE between real and predicted trajectories per articulators.
+        :return: print and return the pearson correlation and RMSE (unormalized and not) between real and predicted
+        trajectories per articulators.
         """
-        idx_to_ignore = [i for i in range(len(to_consider)) if not(to_consider[i])]
-        all_diff = np.zeros((1, self.output_dim))
-        all_diff_without_std = np.zeros((1, self.output_dim))
-        all_pearson = np.zeros((1, self.output_dim))
-        if to_plot:
-            indices_to_plot = np.random.choice(len(X_test), 2, replace=False)
-        for i in range(len(X_test)):
-            L = len(X_test[i])
-            x_torch = torch.from_numpy(X_test[i]).view(1, L, self.input_dim)  #x (1,L,429)
-            y = Y_test[i].reshape((L, 18))                     #y (L,13)
-            if index_common != []:
-                y = get_right_indexes(y, index_common, shape = 2)
-            if self.cuda_avail:
-                x_torch = x_torch.to(device=self.device)
-            y_pred_not_smoothed = self(x_torch, False).double() #output y_pred (1,L,13)
-            y_pred_smoothed = self(x_torch, True).double()
-            if self.cuda_avail:
-                y_pred_not_smoothed = y_pred_not_smoothed.cpu()
-                y_pred_smoothed = y_pred_smoothed.cpu()
-            y_pred_not_smoothed = y_pred_not_smoothed.detach().numpy().reshape((L, self.output_dim))  # y_pred (L,13)
-            y_pred_smoothed = y_pred_smoothed.detach().numpy().reshape((L, self.output_dim))  # y_pred (L,13)
-            if to_plot:
-                if i in indices_to_plot:
-                    self.plot_results(y_target = y, y_pred_smoothed = y_pred_smoothed,
-                                      y_pred_not_smoothed = y_pred_not_smoothed, to_cons = to_consider)
-            rmse = np.sqrt(np.mean(np.square(y - y_pred_smoothed), axis=0))  # calculate rmse
-            rmse = np.reshape(rmse, (1, self.output_dim))
-
-            std_to_modify = std_speaker
-            if index_common != [] and not no_std:
-                std_to_modify = get_right_indexes(std_to_modify, index_common, shape=1)
-
-            rmse_with_std = rmse*std_to_modify  # unormalize
-
-            all_diff = np.concatenate((all_diff, rmse_with_std))
-            all_diff_without_std = np.concatenate((all_diff_without_std, rmse))
-            y_pred_smoothed = y_pred_smoothed.reshape(1,L, self.output_dim)
-            y_pred_smoothed = torch.from_numpy(y_pred_smoothed)
-            y = torch.from_numpy(y.reshape(1, L, self.output_dim))
-            pearson_per_art = criterion_pearson_no_reduction(y, y_pred_smoothed, cuda_avail=self.cuda_avail, device=self.device) # (1,1,18)
-            pearson_per_art = pearson_per_art.reshape(1, self.output_dim)
-            all_pearson = np.concatenate((all_pearson, pearson_per_art))
-        all_pearson = all_pearson[1:]
-        if index_common == []:
-            all_pearson[:, idx_to_ignore] = 0
-        all_diff = all_diff[1:]
-        if index_common == []:
-            all_diff[:, idx_to_ignore] = 0
-        all_pearson[np.isnan(all_pearson)] = 0
-
-        pearson_per_arti_mean = np.mean(all_pearson, axis=0)
-        rmse_per_arti_mean = np.mean(all_diff, axis=0)
-        rmse_per_art_mean_without_std = np.mean(all_diff_without_std, axis=0)
+        metrics = self.evaluate([(X_test, Y_test)], len(X_test), std_speaker, to_plot=to_plot,
+                                to_consider=to_consider, index_common=index_common, no_std=no_std)
         if verbose:
-            print("rmse final : ", np.mean(rmse_per_arti_mean[rmse_per_arti_mean != 0]))
-            print("rmse mean per arti : \n", rmse_per_arti_mean)
-            print("pearson final : ", np.mean(pearson_per_arti_mean[pearson_per_arti_mean != 0]))
-            print("pearson mean per arti : \n", pearson_per_arti_mean)
+            metrics.print_results()
+        return metrics.rmse(), metrics.rmse_without_std(), metrics.pearson()
 
-        return rmse_per_arti_mean, rmse_per_art_mean_without_std, pearson_per_arti_mean
+    def evaluate_on_files(self, filenames, std_speaker, to_plot=False, to_consider=None, verbose=True,
+                          index_common=[], no_std=False, n_files_loaded=50):
+        """
+        :param filenames: list of the test files
+        :param n_files_loaded: # of files loaded at once
+        :return: same as evaluate_on_test_modified, the files are loaded and evaluated n_files_loaded at a time so that
+        the memory needed does not depend on the # of test files
+        """
+        batches = (load_np_ema_and_mfcc(filenames[i:i + n_files_loaded], self.precision)
+                   for i in range(0, len(filenames), n_files_loaded))
+        metrics = self.evaluate(batches, len(filenames), std_speaker, to_plot=to_plot, to_consider=to_consider,
+                                index_common=index_common, no_std=no_std)
+        if verbose:
+            metrics.print_results()
+        return metrics.rmse(), metrics.rmse_without_std(), metrics.pearson()
 
 
 
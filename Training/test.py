@@ -19,7 +19,8 @@ import torch
 import os
 import csv
 import sys
-from Training.tools_learning import load_np_ema_and_mfcc, load_filenames, give_me_common_articulators, criterion_pearson_no_reduction
+from Training.tools_learning import load_filenames, give_me_common_articulators, criterion_pearson_no_reduction, \
+    precisions
 import random
 from scipy import signal
 import matplotlib.pyplot as plt
@@ -31,10 +32,12 @@ fileset_path = os.path.join(root_folder, "Preprocessed_data", "fileset")
 print(sys.argv)
 articulators = ['tt_x', 'tt_y', 'td_x', 'td_y', 'tb_x', 'tb_y', 'li_x', 'li_y',
                     'ul_x', 'ul_y', 'll_x', 'll_y', 'la', 'lp', 'ttcl', 'tbcl', 'v_x', 'v_y']
-def test_model(test_on ,model_name, test_on_per_default = False, ) :
+def test_model(test_on ,model_name, test_on_per_default = False, precision="float64") :
     """
     :param test_on:  the speaker test
     :param model_name: the name of the model (of the .txt file, without the ".txt")
+    :param precision: "float64", "float32" or "bfloat16", precision of the predictions (see tools_learning.precisions),
+    the weights are converted when they are loaded
     Need to have to weights of the models saved in a txt file located in Training/saved_models/
     for example F01_speaker_indep_Haskins__loss_both_90_filter_fix_0.txt
     The test speaker has to be precised (in fact readable in the begining of the filename ==> future work)
@@ -97,8 +100,8 @@ def test_model(test_on ,model_name, test_on_per_default = False, ) :
 
     model = my_ac2art_model(hidden_dim=hidden_dim, input_dim=input_dim, output_dim=output_dim,
                              batch_size=batch_size, cuda_avail=cuda_avail, name_file=model_name,
-                             filter_type=filter_type, batch_norma=batch_norma)
-    model = model.double()
+                             filter_type=filter_type, batch_norma=batch_norma, precision=precision,
+                             packed="_packed" in model_name)  # lstm through the frames (see train.py)
 
     file_weights = os.path.join("saved_models", model_name + ".txt")
 
@@ -117,7 +120,6 @@ def test_model(test_on ,model_name, test_on_per_default = False, ) :
 
 
     random.shuffle(files_for_test)
-    x, y = load_np_ema_and_mfcc(files_for_test)
     print("evaluation on speaker {}".format(test_on))
     std_speaker = np.load(os.path.join(root_folder, "Preprocessing", "norm_values", "std_ema_"+test_on+".npy"))
     arti_per_speaker = os.path.join(root_folder, "Preprocessing", "articulators_per_speaker.csv")
@@ -134,9 +136,9 @@ def test_model(test_on ,model_name, test_on_per_default = False, ) :
     if arti_indexes != []:
         arti_to_consider = [1 for k in range(len(arti_indexes))]
 
-    rmse_per_arti_mean, rmse_per_arti_mean_without_std, pearson_per_arti_mean = model.evaluate_on_test_modified(x,y, std_speaker=std_speaker, to_plot=to_plot
-                                                                       , to_consider=arti_to_consider, verbose=False,
-                                                                                index_common= arti_indexes)
+    rmse_per_arti_mean, rmse_per_arti_mean_without_std, pearson_per_arti_mean = model.evaluate_on_files(
+        files_for_test, std_speaker=std_speaker, to_plot=to_plot, to_consider=arti_to_consider, verbose=False,
+        index_common= arti_indexes)  # a few files at a time
 
 
     show_filter = False #add it in argument
@@ -179,10 +181,12 @@ if __name__ == '__main__':
     parser.add_argument('model_name', type=str,
                         help='name of the model (without .txt)')
 
+    parser.add_argument('--precision', type=str, default="float64", choices=precisions,
+                        help='dtype of the model and the data for the predictions')
 
     args = parser.parse_args()
 
-    rmse,pearson = test_model(test_on=args.test_on, model_name=args.model_name)
+    rmse,pearson = test_model(test_on=args.test_on, model_name=args.model_name, precision=args.precision)
     print("results for model ",args.model_name)
     print("rmse",rmse)
     print("pearson",pearson)
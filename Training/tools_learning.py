@@ -14,7 +14,7 @@ import gc
 import torch
 import sys
 import psutil
-from Preprocessing.tools_preprocessing import get_speakers_per_corpus
+from Preprocessing.tools_preprocessing import get_speakers_per_corpus, mfcc_with_context, load_packed_speaker
 import json
 import random
 import matplotlib.pyplot as plt
@@ -22,42 +22,194 @@ from scipy import signal
 
 
 
+all_speakers = ["F01", "F02", "F03", "F04", "M01", "M02", "M03", "M04","F1", "F5", "M1", "M3"
+    , "maps0", "faet0", 'mjjn0', "ffes0", "MNGU0", "fsew0", "msak0","falh0"]
+
+dataset_index = None  # lookup tables built from Preprocessed_data/dataset_index.json, loaded once per process
+
+""" float64 : weights, data and computations in float64 (as before), float32 : all in float32, bfloat16 : weights
+and data in float32, the computations of the model in bfloat16 (autocast) """
+precisions = ["float64", "float32", "bfloat16"]
+
+
+def get_dtype(precision):
+    """
+    :param precision: one of precisions
+    :return: the torch dtype of the weights of the model, of the data and of the losses for this precision
+    """
+    if precision not in precisions:
+        raise NameError("unknown precision {}, choose among {}".format(precision, precisions))
+    return torch.float64 if precision == "float64" else torch.float32
+
+
+def bfloat16_supported(cuda_avail=False):
+    """
+    :param cuda_avail: whether the model is on gpu
+    :return: whether the computations in bfloat16 are supported by the gpu or by the cpu (instructions avx512_bf16 or
+    amx, else bfloat16 is emulated and slower than float32)
+    """
+    try:
+        if cuda_avail:
+            return torch.cuda.is_bf16_supported()
+        return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):  # older versions of pytorch
+        return False
+
+
+def get_dataset_index():
+    """
+    :return: dictionnary with the lookup tables of the dataset index written by the preprocessing (see
+    update_dataset_index) :
+        - "speaker" : {utterance name : speaker}
+        - "files" : {(speaker, part) : list of the utterance names, in the order of the fileset}
+        - "entries" : {utterance name : entry of the index (speaker, corpus, category, split, n_frames, offsets)}
+    The index is read only once. Empty tables if there is no index (data preprocessed by an older version).
+    """
+    global dataset_index
+    if dataset_index is None:
+        dataset_index = {"speaker": dict(), "files": dict(), "entries": dict()}
+        path_index = os.path.join(os.path.dirname(os.getcwd()), "Preprocessed_data", "dataset_index.json")
+        if os.path.exists(path_index):
+            with open(path_index, 'r') as f:
+                dataset_index["entries"] = json.load(f)["utterances"]
+        for name, entry in dataset_index["entries"].items():
+            dataset_index["speaker"][name] = entry["speaker"]
+            dataset_index["files"].setdefault((entry["speaker"], entry["split"]), []).append(name)
+    return dataset_index
+
+
+def get_speaker_of_file(filename):
+    """
+    :param filename: name of an utterance, or segment of an utterance (name, start, end) (see split_filenames)
+    :return: the speaker of the utterance, from the dataset index (or deduced from the filename if not in the index)
+    """
+    if isinstance(filename, tuple):
+        filename = filename[0]
+    speaker = get_dataset_index()["speaker"].get(filename)
+    if speaker is None:
+        speaker = [s for s in all_speakers if s.lower() in filename.lower()][0]
+    return speaker
+
+
 def load_filenames(speakers, part=["train"]):
     """
     :param speakers: list of speakers we want the filesets
     :param part: list ["train","valid","test"] (or less) of part of fileset we want from the speakers
     :return: a list of the filenames corresponding to the asked part for asked speakers
-    based on the fileset files already
-
+    based on the dataset index, or on the fileset files for the speakers that are not in the index
     """
     path_files = os.path.join(os.path.dirname(os.getcwd()),"Preprocessed_data","fileset")
+    index = get_dataset_index()
     filenames = []
     for speaker in speakers:
         for p in part:
-            names = open(os.path.join( path_files , speaker + "_" + p + ".txt"), "r").read().split()
-            filenames = filenames + names
+            if (speaker, p) in index["files"]:
+                filenames = filenames + index["files"][(speaker, p)]
+            else:
+                names = open(os.path.join( path_files , speaker + "_" + p + ".txt"), "r").read().split()
+                filenames = filenames + names
     return filenames
 
 
-def load_np_ema_and_mfcc(filenames):
+def get_n_frames(filename):
+    """
+    :param filename: name of an utterance
+    :return: # of frames of the utterance, from the dataset index (or from the header of its file if not in the index)
+    """
+    entry = get_dataset_index()["entries"].get(filename)
+    if entry is not None:
+        return entry["n_frames"]
+    folder = os.path.join(os.path.dirname(os.getcwd()), "Preprocessed_data")
+    return len(np.load(os.path.join(folder, get_speaker_of_file(filename), "ema_final", filename + ".npy"),
+                       mmap_mode='r'))
+
+
+def split_filenames(filenames, max_length=0):
     """
-    :param filenames: list of files we want to load the ema and mfcc data
+    :param filenames: list of utterance names
+    :param max_length: max # of frames of the sentences, 0 to keep the whole sentences
+    :return: list where the utterances longer than max_length are replaced by their N segments (name, start, end)
+    of the same length (the last one takes the remaining frames), N = int(K/max_length) + 1 as in split_sentences.
+    Nothing is written on the disk, the segments are sliced when they are loaded (see load_np_ema_and_mfcc), so
+    max_length is just a parameter of the training.
+    """
+    if max_length == 0:
+        return filenames
+    segments = []
+    for filename in filenames:
+        n_frames = get_n_frames(filename)
+        cut_in_N = int(n_frames / max_length) + 1
+        if cut_in_N == 1:
+            segments.append(filename)
+            continue
+        cut_size = int(n_frames / cut_in_N)
+        starts = [k * cut_size for k in range(cut_in_N)]
+        ends = starts[1:] + [n_frames]
+        segments += [(filename, start, end) for start, end in zip(starts, ends)]
+    return segments
+
+
+def group_files_per_speaker(filenames):
+    """
+    :param filenames: list of utterance names
+    :return: dictionnary {speaker : list of the utterances of the speaker, in the same order as in filenames}
+    """
+    files_per_speaker = dict()
+    for filename in filenames:
+        files_per_speaker.setdefault(get_speaker_of_file(filename), []).append(filename)
+    return files_per_speaker
+
+
+packed_speakers = dict()  # packed data of the speakers already opened in this process (None if not packed)
+
+
+def get_packed_speaker(speaker):
+    """
+    :param speaker: name of a speaker
+    :return: the packed data of the speaker (see load_packed_speaker), opened only once per process
+    """
+    if speaker not in packed_speakers:
+        packed_speakers[speaker] = load_packed_speaker(speaker)
+    return packed_speakers[speaker]
+
+
+def load_np_ema_and_mfcc(filenames, precision=None):
+    """
+    :param filenames: list of files we want to load the ema and mfcc data, an element can also be a segment of an
+    utterance (name, start, end) (see split_filenames)
+    :param precision: one of precisions, the arrays are given in the dtype of this precision. None to keep the dtype
+    of the preprocessed data (float64)
     :return: x : the list of mfcc features,
             y : the list of ema traj
     Load the numpy arrays correspondign the ema and mfcc of the files in the list filenames
+    If the data of the speaker is packed (main_preprocessing.py --pack) the utterances are slices of the memory mapped
+    packed arrays, else the 2 files of each utterance are loaded.
+    The mfcc saved in compact mode (K+10,39) are given as a view (K,429) with the context frames (no copy)
     """
     folder = os.path.join(os.path.dirname(os.getcwd()), "Preprocessed_data")
     x = []
     y = []
-    speakers = ["F01", "F02", "F03", "F04", "M01", "M02", "M03", "M04","F1", "F5", "M1", "M3"
-        , "maps0", "faet0", 'mjjn0', "ffes0", "MNGU0", "fsew0", "msak0","falh0"]
     for filename in filenames:
-        speaker = [s for s in speakers if s.lower() in filename.lower()][0] # we can deduce the speaker from the filename
-        files_path = os.path.join(folder,speaker)
-        the_ema_file = np.load(os.path.join(files_path, "ema_final", filename + ".npy"))
-        the_mfcc_file = np.load(os.path.join(files_path, "mfcc", filename + ".npy"))
-        x.append(the_mfcc_file)
-        y.append(the_ema_file)
+        segment = slice(None)
+        if isinstance(filename, tuple):  # only a segment of the utterance
+            filename, start, end = filename
+            segment = slice(start, end)
+        speaker = get_speaker_of_file(filename)
+        packed = get_packed_speaker(speaker)
+        if packed is not None and filename in packed["index"]:
+            mfcc_offset, mfcc_length, ema_offset, ema_length = packed["index"][filename]
+            the_ema_file = packed["ema_final"][ema_offset:ema_offset + ema_length]
+            the_mfcc_file = mfcc_with_context(packed["mfcc"][mfcc_offset:mfcc_offset + mfcc_length])
+        else:
+            files_path = os.path.join(folder,speaker)
+            the_ema_file = np.load(os.path.join(files_path, "ema_final", filename + ".npy"))
+            the_mfcc_file = mfcc_with_context(np.load(os.path.join(files_path, "mfcc", filename + ".npy")))
+        x.append(the_mfcc_file[segment])
+        y.append(the_ema_file[segment])
+    if precision is not None:
+        np_dtype = np.float64 if get_dtype(precision) == torch.float64 else np.float32
+        x = [mfcc.astype(np_dtype, copy=False) for mfcc in x]
+        y = [ema.astype(np_dtype, copy=False) for ema in y]
     return x, y
 
 def memReport(all=False):
@@ -88,25 +240,64 @@ def cpuStats():
 
 
 
-def criterion_pearson(y, y_pred, cuda_avail , device):
+def get_mask(lengths, max_length, dtype=torch.float64, device=None, arti=None):
+    """
+    :param lengths: # of frames of the B sentences of the batch (list or tensor)
+    :param max_length: # of frames of the padded batch
+    :param arti: (B,18) 1 if the articulator is available for the speaker of the sentence, 0 if not, None if all of
+    them are
+    :return: tensor (B,max_length,1) with 1 for the frames of the sentences and 0 for the zero padding, or
+    (B,max_length,18) if arti is given, also 0 for the articulators not available (ignored by the losses)
+    """
+    lengths = torch.as_tensor(lengths, device=device)
+    mask = torch.arange(max_length, device=device).view(1, -1) < lengths.view(-1, 1)
+    mask = mask.to(dtype).unsqueeze(2)
+    if arti is not None:
+        mask = mask * torch.as_tensor(arti, dtype=dtype, device=device).unsqueeze(1)
+    return mask
+
+
+def get_arti_per_speaker(categ_of_speakers):
+    """
+    :param categ_of_speakers: dictionnary categ : {"sp" : speakers of the categ, "arti" : 18 "0"/"1"}
+    (categ_of_speakers.json)
+    :return: dictionnary speaker : list of 18 0/1, 1 if the articulator is available for the speaker
+    """
+    return {speaker: [int(available) for available in categ_of_speakers[categ]["arti"]]
+            for categ in categ_of_speakers for speaker in categ_of_speakers[categ]["sp"]}
+
+
+def criterion_pearson(y, y_pred, cuda_avail , device, mask=None):
     """
     :param y: nparray (B,K,18) target trajectories of the batch (size B) , padded (K = maxlenght)
     :param y_pred: nparray (B,K,18) predicted trajectories of the batch (size B), padded (K = maxlenght
     :param cuda_avail: bool whether gpu is available
     :param device: the device
+    :param mask: (B,K,1) 1 for the frames of the sentences and 0 for the padding (see get_mask), None to use all the
+    frames. With the mask the mean and the correlation of each sentence are calculated on its own frames only.
+    The mask can also be (B,K,18) with 0 for the articulators not available : their correlation is 1 (no gradient), as
+    when their prediction was put to 0.
     :return: loss function for this prediction for loss = pearson correlation
     for each pair of trajectories (target & predicted) we calculate the pearson correlation between the two
     we sum all the pearson correlation to obtain the loss function
     // Idea : integrate the range of the traj here, making the loss for each sentence as the weighted average of the
     losses with weight proportional to the range of the traj (?)
     """
-    y_1 = y.sub(torch.mean(y, dim=1, keepdim=True))
-    y_pred_1 = y_pred.sub(torch.mean(y_pred,dim=1, keepdim=True))
+    not_available = 0
+    if mask is None:
+        y_1 = y.sub(torch.mean(y, dim=1, keepdim=True))
+        y_pred_1 = y_pred.sub(torch.mean(y_pred,dim=1, keepdim=True))
+    else:
+        n_frames = torch.sum(mask, dim=1, keepdim=True)  # (B,1,1) or (B,1,18)
+        not_available = (n_frames == 0).to(y.dtype)  # articulators masked in the whole sentence
+        n_frames = n_frames + not_available
+        y_1 = (y - torch.sum(y * mask, dim=1, keepdim=True) / n_frames) * mask
+        y_pred_1 = (y_pred - torch.sum(y_pred * mask, dim=1, keepdim=True) / n_frames) * mask
     nume = torch.sum(y_1 * y_pred_1, dim=1, keepdim=True)  # (B,1,18)
-    deno = torch.sqrt(torch.sum(y_1 ** 2, dim=1, keepdim=True)) * \
-        torch.sqrt(torch.sum(y_pred_1 ** 2, dim=1, keepdim=True))  # (B,1,18)
+    deno = torch.sqrt(torch.sum(y_1 ** 2, dim=1, keepdim=True) + not_available) * \
+        torch.sqrt(torch.sum(y_pred_1 ** 2, dim=1, keepdim=True) + not_available)  # (B,1,18) no sqrt of 0 if masked
 
-    minim = torch.tensor(0.000001,dtype=torch.float64)  # avoid division by 0
+    minim = torch.tensor(0.000001,dtype=y.dtype)  # avoid division by 0
     if cuda_avail:
         minim = minim.to(device=device)
         deno = deno.to(device=device)
@@ -114,6 +305,8 @@ def criterion_pearson(y, y_pred, cuda_avail , device):
     nume = nume + minim
     deno = deno + minim
     my_loss = torch.div(nume, deno)  # (B,1,18)
+    if mask is not None:  # 1 as before for the predictions put to 0, no gradient
+        my_loss = torch.where(not_available > 0, torch.ones_like(my_loss), my_loss)
     my_loss = torch.sum(my_loss)
     return -my_loss
 
@@ -141,18 +334,40 @@ def criterion_pearson_no_reduction(y, y_pred, cuda_avail, device):
     #return -my_loss
 
 
-def criterion_both(my_y,my_ypred,alpha,cuda_avail,device):
-    compl = torch.tensor(1. - float(alpha) / 100., dtype=torch.float64)
-    alpha = torch.tensor(float(alpha) / 100., dtype = torch.float64)
-    multip = torch.tensor(float(1000), dtype = torch.float64)
-    if cuda_avail:
-        alpha = alpha.to(device = device)
-        multip = multip.to(device = device)
-        compl = compl.to(device= device)
-    a = alpha * criterion_pearson(my_y, my_ypred, cuda_avail, device)*multip
-    b = compl * torch.nn.MSELoss(reduction='sum')(my_y, my_ypred)
-    new_loss = a + b
-    return new_loss
+def criterion_mse(y, y_pred, mask=None):
+    """
+    :param y: (B,K,18) target trajectories of the batch, padded
+    :param y_pred: (B,K,18) predicted trajectories
+    :param mask: (B,K,1) 1 for the frames of the sentences and 0 for the padding (see get_mask), or (B,K,18) also 0
+    for the articulators not available. None to use all the frames
+    :return: sum of the squared errors on the frames of the sentences
+    """
+    if mask is None:
+        return torch.nn.MSELoss(reduction='sum')(y, y_pred)
+    return torch.sum(((y - y_pred) * mask) ** 2)
+
+
+def criterion_both(my_y,my_ypred,alpha,cuda_avail,device, mask=None):
+    """
+    :param mask: (B,K,1) 1 for the frames of the sentences and 0 for the padding (see get_mask), None to use all the
+    frames
+    :return: the combined loss alpha*pearson*1000 + (1-alpha)*mse (alpha in %)
+    """
+    return criterion_both_parts(my_y, my_ypred, alpha, cuda_avail, device, mask)[0]
+
+
+def criterion_both_parts(my_y, my_ypred, alpha, cuda_avail, device, mask=None):
+    """
+    :param mask: (B,K,1) 1 for the frames of the sentences and 0 for the padding (see get_mask), None to use all the
+    frames
+    :return: (the combined loss alpha*pearson*1000 + (1-alpha)*mse (alpha in %), the pearson loss (see
+    criterion_pearson), the mse (see criterion_mse)). The 2 losses are calculated once and give the combined loss, so
+    there is no need to call criterion_pearson and criterion_mse again to follow them.
+    """
+    loss_pearson = criterion_pearson(my_y, my_ypred, cuda_avail, device, mask)
+    loss_mse = criterion_mse(my_y, my_ypred, mask)
+    new_loss = float(alpha) / 100. * loss_pearson * 1000. + (1. - float(alpha) / 100.) * loss_mse
+    return new_loss, loss_pearson, loss_mse
 
 
 def plot_filtre(weights):
@@ -214,12 +429,17 @@ def give_me_common_articulators(list_speakers):
 
 
 
-def give_me_train_valid_test_filenames(train_on, test_on, config, batch_size, valid_on = []):
+def give_me_train_valid_test_filenames(train_on, test_on, config, batch_size, valid_on = [], max_length=0,
+                                       pad_categs=True):
     """
     :param train_on: list of corpus to train on
     :param test_on: the speaker test
     :param config: either spec/dep/indep
     :param batch_size
+    :param max_length: max # of frames of the sentences for the training and validation, the longer ones are split
+    in segments (see split_filenames). 0 to keep the whole sentences. The test sentences are never split.
+    :param pad_categs: whether some files of each category are repeated so that the # of files of the category is a
+    multiple of batch_size (for batches of one category). False to keep each file once (batches of several categories)
     :return: files_per_categ :  dictionnary where keys are the categories present in the training set. For each category
     we have a dictionnary with 2 keys (train, valid), and the values is a list of the namefiles for this categ and this
     part (train/valid)
@@ -256,43 +476,46 @@ def give_me_train_valid_test_filenames(train_on, test_on, config, batch_size, va
     with open('categ_of_speakers.json', 'r') as fp:
         categ_of_speakers = json.load(fp)  # dictionnary { categ : dict_2} where
                                             # dict_2 :{  speakers : [sp_1,..], arti  : [0,1,1...]  }
+    files_for_train = split_filenames(files_for_train, max_length)
+    files_for_valid = split_filenames(files_for_valid, max_length)
     files_per_categ = dict()
+    files_train_per_speaker = group_files_per_speaker(files_for_train)
+    files_valid_per_speaker = group_files_per_speaker(files_for_valid)
 
     for categ in categ_of_speakers.keys():
         sp_in_categ = categ_of_speakers[categ]["sp"]
 
-        files_train_this_categ = [[f for f in files_for_train if sp.lower() in f.lower()]
-                                  for sp in sp_in_categ]  # the speaker name is always in the namefile
-        files_train_this_categ = [item for sublist in files_train_this_categ
-                                  for item in sublist]  # flatten the list of list
-
-        files_valid_this_categ = [[f for f in files_for_valid if sp.lower() in f.lower()] for sp in sp_in_categ]
-        files_valid_this_categ = [item for sublist in files_valid_this_categ for item in sublist]
+        files_train_this_categ = [item for sp in sp_in_categ
+                                  for item in files_train_per_speaker.get(sp, [])]  # files of the speakers of categ
+        files_valid_this_categ = [item for sp in sp_in_categ for item in files_valid_per_speaker.get(sp, [])]
 
         if len(files_train_this_categ) > 0:  # meaning we have at least one file in this categ
             files_per_categ[categ] = dict()
 
-            N_iter_categ = int(len(files_train_this_categ)/batch_size)+1
-            n_a_ajouter = batch_size*N_iter_categ - len(files_train_this_categ)
-            files_train_this_categ = files_train_this_categ +\
-                                    files_train_this_categ[:n_a_ajouter]  #so that lenght is a multiple of batchsize
+            if pad_categs:
+                N_iter_categ = int(len(files_train_this_categ)/batch_size)+1
+                n_a_ajouter = batch_size*N_iter_categ - len(files_train_this_categ)
+                files_train_this_categ = files_train_this_categ +\
+                                        files_train_this_categ[:n_a_ajouter]  #so that lenght is a multiple of batchsize
             random.shuffle(files_train_this_categ)
             files_per_categ[categ]["train"] = files_train_this_categ
 
-            N_iter_categ = int(len( files_valid_this_categ) / batch_size) + 1
-            n_a_ajouter = batch_size * N_iter_categ - len(files_valid_this_categ)
-            files_valid_this_categ = files_valid_this_categ + files_valid_this_categ[:n_a_ajouter]
+            if pad_categs:
+                N_iter_categ = int(len( files_valid_this_categ) / batch_size) + 1
+                n_a_ajouter = batch_size * N_iter_categ - len(files_valid_this_categ)
+                files_valid_this_categ = files_valid_this_categ + files_valid_this_categ[:n_a_ajouter]
             random.shuffle(files_valid_this_categ)
             files_per_categ[categ]["valid"] = files_valid_this_categ
 
     return files_per_categ, files_for_test
 
-def give_me_train_valid_test_filenames_no_cat(train_on, test_on, config, valid_on = []):
+def give_me_train_valid_test_filenames_no_cat(train_on, test_on, config, valid_on = [], max_length=0):
     """
     :param train_on: list of speakers to train on
     :param test_on: the speaker test
     :param config: either spec/dep/indep
     :param batch_size
+    :param max_length: max # of frames of the sentences for the training and validation (see split_filenames)
     :return: files_per_categ :  dictionnary where keys are the categories present in the training set. For each category
     we have a dictionnary with 2 keys (train, valid), and the values is a list of the namefiles for this categ and this
     part (train/valid)
@@ -329,7 +552,8 @@ def give_me_train_valid_test_filenames_no_cat(train_on, test_on, config, valid_o
         files_for_valid = load_filenames(valid_on, part=["train", "test", "valid"])
         files_for_test = load_filenames([test_on], part=["train", "valid", "test"])
 
-
+    files_for_train = split_filenames(files_for_train, max_length)
+    files_for_valid = split_filenames(files_for_valid, max_length)
     return files_for_train, files_for_valid, files_for_test
 
 
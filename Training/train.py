@@ -42,13 +42,17 @@ import csv
 from Training.pytorchtools import EarlyStopping
 import random
 from Training.tools_learning import which_speakers_to_train_on, give_me_train_valid_test_filenames, \
-    cpuStats, memReport, criterion_both, load_np_ema_and_mfcc, plot_filtre, criterion_pearson
+    cpuStats, memReport, plot_filtre, precisions, criterion_both_parts, get_arti_per_speaker
+from Training.data_loader import Prefetch_loader, Batch_collate, get_batches, get_bucketed_batches, get_lengths, \
+    padding_ratio, get_n_buffers
 import json
 
 root_folder = os.path.dirname(os.getcwd())
 
 def train_model(test_on, n_epochs, loss_train, patience, select_arti, corpus_to_train_on, batch_norma, filter_type,
-                to_plot, lr, delta_test, config, speakers_to_train_on = "", speakers_to_valid_on = "", relearn = False):
+                to_plot, lr, delta_test, config, speakers_to_train_on = "", speakers_to_valid_on = "", relearn = False,
+                max_length=0, precision="float64", n_workers=1, prefetch=2, bucket_size=0,
+                packed=False, mix_categs=False):
     """
     :param test_on: (str) one speaker's name we want to test on, the speakers and the corpus the come frome can be seen in
     "fonction_utiles.py", in the function "get_speakers_per_corpus'.
@@ -64,7 +68,7 @@ def train_model(test_on, n_epochs, loss_train, patience, select_arti, corpus_to_
     We usually set it to 5. The more data we have, the smaller it can be (i think)
 
     :param select_arti: (bool) always true, either to use the trick to only train on available articulatory trajectories,
-    fixing the predicted trajectory (to zero) and then the gradient will be 0.
+    the articulators not available for the speaker of each sentence are masked in the losses, so their gradient is 0.
 
     :param corpus_to_train_on: (list) list of the corpuses to train on. Usually at least the corpus the testspeaker comes from.
     (the testspeaker will be by default removed from the training speakers).
@@ -84,6 +88,27 @@ def train_model(test_on, n_epochs, loss_train, patience, select_arti, corpus_to_
     :param config : either "spe" "dep", or "indep", for specific (train only on test sp), dependant (train on test sp
     and others), or independant, train only on other speakers
 
+    :param max_length: (int) max # of frames of the training and validation sentences, the longer ones are split in
+    segments when they are loaded (see split_filenames). 0 to keep the whole sentences.
+
+    :param precision: (str) "float64", "float32" or "bfloat16", dtype of the model, of the data and of the losses (see
+    tools_learning.precisions). float32 is about twice faster than float64 on cpu for the same results.
+
+    :param n_workers: (int) # of threads that load the next batches while the model learns (see data_loader.py), 0 to
+    load each batch when it is needed
+
+    :param prefetch: (int) max # of batches loaded in advance
+
+    :param bucket_size: (int) if > 0, the training batches of a category are made of sentences of similar lengths,
+    sorted by length in buckets of bucket_size batches (see data_loader.get_bucketed_batches). 0 for random batches.
+
+    :param packed: (bool) whether the lstm layers go through the frames of each sentence with packed sequences, so
+    that no computation is spent on the zero padding (see model.forward). "_packed" is added to the name of the model.
+
+    :param mix_categs: (bool) whether a batch can have sentences of several categories (the articulators available
+    for each sentence are in the mask of the batch). Each file is then used once per epoch, and the batches are made
+    from the files of all the categories. If False the batches have one category, as before.
+
     :return: [rmse, pearson] . rmse the is the list of the 18 rmse (1 per articulator), same for pearson.
     """
     f_loss_train = open('training_loss.csv', 'w')
@@ -110,6 +135,8 @@ def train_model(test_on, n_epochs, loss_train, patience, select_arti, corpus_to_
 
     name_file = test_on+"_"+config+"_"+name_corpus_concat+"loss_"+str(loss_train)+"_filter_"+\
                 str(filter_type)+"_bn_"+str(batch_norma)
+    if packed:
+        name_file = name_file + "_packed"
 
     if not os.path.exists("saved_models"):
         os.mkdir("saved_models")
@@ -140,8 +167,7 @@ def train_model(test_on, n_epochs, loss_train, patience, select_arti, corpus_to_
     early_stopping = EarlyStopping(name_file, patience=patience, verbose=True)
     model = my_ac2art_model(hidden_dim=hidden_dim, input_dim=input_dim, name_file=name_file, output_dim=output_dim,
                             batch_size=batch_size, cuda_avail=cuda_avail,
-                            filter_type=filter_type, batch_norma=batch_norma)
-    model = model.double()
+                            filter_type=filter_type, batch_norma=batch_norma, precision=precision, packed=packed)
     file_weights = os.path.join("saved_models", name_file +".pt")
     if cuda_avail:
         model = model.to(device=device)
@@ -162,13 +188,18 @@ def train_model(test_on, n_epochs, loss_train, patience, select_arti, corpus_to_
 
 
 
-    files_per_categ, files_for_test = give_me_train_valid_test_filenames(train_on=train_on,test_on=test_on,config=config,batch_size= batch_size, valid_on=valid_on)
+    files_per_categ, files_for_test = give_me_train_valid_test_filenames(train_on=train_on,test_on=test_on,config=config,batch_size= batch_size, valid_on=valid_on, max_length=max_length,
+                                                                         pad_categs=not mix_categs)  # no repeated files if mixed
 
     optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    collate = Batch_collate(model.dtype, batch_size, max_length if max_length > 0 else 500,
+                            get_n_buffers(n_workers, prefetch), pin_memory=cuda_avail)  # buffers reused by all batches
 
     categs_to_consider = files_per_categ.keys()
+    lengths = get_lengths([filename for categ in categs_to_consider for filename in files_per_categ[categ]["train"]])
     with open('categ_of_speakers.json', 'r') as fp:
         categ_of_speakers = json.load(fp)  # dict that gives for each category the speakers in it and the available arti
+    arti_per_speaker = get_arti_per_speaker(categ_of_speakers) if select_arti else None  # in the mask of each batch
     plot_filtre_chaque_epochs = False
 
     for epoch in range(n_epochs):
@@ -180,40 +211,43 @@ def train_model(test_on, n_epochs, loss_train, patience, select_arti, corpus_to_
         loss_train_this_epoch = 0
         loss_pearson = 0
         loss_rmse = 0
-        for categ in categs_to_consider:
-            files_this_categ_courant = files_per_categ[categ]["train"]
-            random.shuffle(files_this_categ_courant)
-            while len(files_this_categ_courant) > 0: # go through all  the files batch by batch
-                n_this_epoch+=1
-                x, y = load_np_ema_and_mfcc(files_this_categ_courant[:batch_size])
-
-                files_this_categ_courant = files_this_categ_courant[batch_size:] #we a re going to train on this 10 files
-                x, y = model.prepare_batch(x, y)
-                if cuda_avail:
-                    x, y = x.to(device=model.device), y.to( device=model.device)
-                y_pred = model(x).double()
-                if cuda_avail:
-                    y_pred = y_pred.to(device=device)
-                y = y.double ()
-                optimizer.zero_grad()
-                if select_arti:
-                    arti_to_consider = categ_of_speakers[categ]["arti"]  # liste de 18 0/1 qui indique les arti à considérer
-                    idx_to_ignore = [i for i, n in enumerate(arti_to_consider) if n == "0"]
-                    y_pred[:, :, idx_to_ignore] = 0 #the grad associated to this value will be zero  : CHECK THAT
-                   # y_pred[:,:,idx_to_ignore].detach()
-                    #y[:,:,idx_to_ignore].requires_grad = False
-
-                loss = criterion_both(y, y_pred,alpha=loss_train, cuda_avail = cuda_avail, device=device)
-                loss.backward()
-                optimizer.step()
-
-                # computation to have evolution of the losses
-                loss_2 = criterion_pearson(y, y_pred, cuda_avail = cuda_avail, device=device)
-                loss_pearson += loss_2.item()
-                loss_3 = torch.nn.MSELoss(reduction='sum')(y, y_pred)
-                loss_rmse += loss_3.item()
-                torch.cuda.empty_cache()
-                loss_train_this_epoch += loss.item()
+        batches = []
+        if mix_categs:  # batches of files of all the categories
+            files_for_train = [filename for categ in categs_to_consider for filename in files_per_categ[categ]["train"]]
+            if bucket_size > 0:  # batches of sentences of similar lengths
+                batches = get_bucketed_batches(files_for_train, batch_size, lengths, bucket_size=bucket_size)
+            else:
+                batches = get_batches(files_for_train, batch_size, shuffle=True)
+        else:
+            for categ in categs_to_consider:  # go through all  the files batch by batch, category by category
+                if bucket_size > 0:  # batches of sentences of similar lengths
+                    batches += get_bucketed_batches(files_per_categ[categ]["train"], batch_size, lengths, categ,
+                                                    bucket_size)
+                else:
+                    batches += get_batches(files_per_categ[categ]["train"], batch_size, categ, shuffle=True)
+        print("Padding ratio for epoch", epoch, ': ', padding_ratio(batches, lengths))
+        for categ, x, y, lengths_batch, mask in Prefetch_loader(batches, precision, collate, n_workers=n_workers,
+                                                                prefetch=prefetch, pin_memory=cuda_avail,
+                                                                arti_per_speaker=arti_per_speaker):
+            n_this_epoch+=1  # the next batches are loaded meanwhile, the mask removes the padding and the arti not
+            # available from the losses
+            if cuda_avail:
+                x, y = x.to(device=model.device, non_blocking=True), y.to(device=model.device, non_blocking=True)
+                mask = mask.to(device=model.device)
+            y_pred = model(x, lengths=lengths_batch)
+            if cuda_avail:
+                y_pred = y_pred.to(device=device)
+            optimizer.zero_grad()
+            # the 2 losses are also given to follow their evolution
+            loss, loss_2, loss_3 = criterion_both_parts(y, y_pred,alpha=loss_train, cuda_avail = cuda_avail,
+                                                        device=device, mask=mask)
+            loss.backward()
+            optimizer.step()
+
+            loss_pearson += loss_2.item()
+            loss_rmse += loss_3.item()
+            torch.cuda.empty_cache()
+            loss_train_this_epoch += loss.item()
 
         torch.cuda.empty_cache()
 
@@ -225,32 +259,30 @@ def train_model(test_on, n_epochs, loss_train, patience, select_arti, corpus_to_
             n_valid = 0
             loss_pearson = 0
             loss_rmse = 0
-            for categ in categs_to_consider:  # de A à F pour le moment
-                files_this_categ_courant = files_per_categ[categ]["valid"]  # on na pas encore apprit dessus au cours de cette epoch
-                while len(files_this_categ_courant) >0 :
+            batches = []
+            if mix_categs:
+                batches = get_batches([filename for categ in categs_to_consider
+                                       for filename in files_per_categ[categ]["valid"]], batch_size)
+            else:
+                for categ in categs_to_consider:  # de A à F pour le moment
+                    batches += get_batches(files_per_categ[categ]["valid"], batch_size, categ)
+            with torch.no_grad():  # no graph for the validation
+                for categ, x, y, lengths_batch, mask in Prefetch_loader(batches, precision, collate, n_workers=n_workers,
+                                                                        prefetch=prefetch, pin_memory=cuda_avail,
+                                                                        arti_per_speaker=arti_per_speaker):
                     n_valid +=1
-                    x, y = load_np_ema_and_mfcc(files_this_categ_courant[:batch_size])
-                    files_this_categ_courant = files_this_categ_courant[batch_size:]  # on a appris sur ces 10 phrases
-                    x, y = model.prepare_batch(x, y)
                     if cuda_avail:
-                        x, y = x.to(device=model.device), y.to(device=model.device)
-                    y_pred = model(x).double()
+                        x, y = x.to(device=model.device, non_blocking=True), y.to(device=model.device, non_blocking=True)
+                        mask = mask.to(device=model.device)
+                    y_pred = model(x, lengths=lengths_batch)  # (Batchsize, maxL, 18)
                     torch.cuda.empty_cache()
                     if cuda_avail:
                         y_pred = y_pred.to(device=device)
-                    y = y.double()  # (Batchsize, maxL, 18)
-                    if select_arti:
-                        arti_to_consider = categ_of_speakers[categ]["arti"]  # liste de 18 0/1 qui indique les arti à considérer
-                        idx_to_ignore = [i for i, n in enumerate(arti_to_consider) if n == "0"]
-                        y_pred[:, :, idx_to_ignore] = 0
-                    #    y_pred[:, :, idx_to_ignore].detach()
-                   #     y[:, :, idx_to_ignore].requires_grad = False
-                    loss_courant = criterion_both(y, y_pred, loss_train, cuda_avail = cuda_avail, device=device)
-                    loss_vali += loss_courant.item()
                     # to follow both losses
-                    loss_2 = criterion_pearson(y, y_pred, cuda_avail = cuda_avail, device=device)
+                    loss_courant, loss_2, loss_3 = criterion_both_parts(y, y_pred, loss_train, cuda_avail = cuda_avail,
+                                                                        device=device, mask=mask)
+                    loss_vali += loss_courant.item()
                     loss_pearson += loss_2.item()
-                    loss_3 = torch.nn.MSELoss(reduction='sum')(y, y_pred)
                     loss_rmse += loss_3.item()
 
             loss_vali  = loss_vali/n_valid
@@ -275,7 +307,6 @@ def train_model(test_on, n_epochs, loss_train, patience, select_arti, corpus_to_
         model.load_state_dict(torch.load(os.path.join("saved_models",name_file+'.pt')))
         torch.save(model.state_dict(), os.path.join( "saved_models",name_file+".txt")) #lorsque .txt ==> training terminé !
     random.shuffle(files_for_test)
-    x, y = load_np_ema_and_mfcc(files_for_test)
     print("evaluation on speaker {}".format(test_on))
     std_speaker = np.load(os.path.join(root_folder,"Preprocessing","norm_values","std_ema_"+test_on+".npy"))
     arti_per_speaker = os.path.join(root_folder, "Preprocessing", "articulators_per_speaker.csv")
@@ -288,27 +319,23 @@ def train_model(test_on, n_epochs, loss_train, patience, select_arti, corpus_to_
                 arti_to_consider = row[1:19]
                 arti_to_consider = [int(x) for x in arti_to_consider]
 
-    rmse_per_arti_mean, pearson_per_arti_mean = model.evaluate_on_test(x, y, std_speaker = std_speaker, to_plot=to_plot
-                                                                       , to_consider = arti_to_consider)
+    rmse_per_arti_mean, rmse_without_std, pearson_per_arti_mean = model.evaluate_on_files(
+        files_for_test, std_speaker = std_speaker, to_plot=to_plot, to_consider = arti_to_consider)  # a few files at a time
 
 
     """  RESULTS ON VALIDATION SET """
 
-    pearson_valid = np.zeros((1,output_dim))
+    pearson_valid = np.zeros(output_dim)
+    n_valid = 0
     for categ in categs_to_consider:  # de A à F pour le moment
-        files_this_categ_courant = files_per_categ[categ]["valid"]  # on na pas encore apprit dessus au cours de cette epoch
-        while len(files_this_categ_courant) > 0:
-            x, y = load_np_ema_and_mfcc(files_this_categ_courant[:batch_size])
-            files_this_categ_courant = files_this_categ_courant[batch_size:]  # on a appris sur ces 10 phrases
-            arti_to_consider = categ_of_speakers[categ]["arti"]  # liste de 18 0/1 qui indique les arti à considérer
-
-            rien, pearson_valid_temp = model.evaluate_on_test(x,y,std_speaker=1, to_plot=to_plot,
-                                                                 to_consider=arti_to_consider,verbose=False)
-            pearson_valid_temp = np.reshape(np.array(pearson_valid_temp),(1,output_dim))
-            pearson_valid = np.concatenate((pearson_valid,pearson_valid_temp),axis=0)
-    pearson_valid = pearson_valid[1:,:]
-    pearson_valid[np.isnan(pearson_valid)] = 0
-    pearson_valid = np.mean(pearson_valid,axis=0)
+        files_valid_this_categ = files_per_categ[categ]["valid"]
+        arti_to_consider = categ_of_speakers[categ]["arti"]  # liste de 18 0/1 qui indique les arti à considérer
+        rien, rien_2, pearson_valid_categ = model.evaluate_on_files(files_valid_this_categ, std_speaker=1,
+                                                                    to_plot=to_plot, to_consider=arti_to_consider,
+                                                                    verbose=False)
+        pearson_valid += pearson_valid_categ * len(files_valid_this_categ)  # mean over the sentences of all categs
+        n_valid += len(files_valid_this_categ)
+    pearson_valid = pearson_valid / max(n_valid, 1)
     print("on validation set :mean :\n",pearson_valid)
     print("training done for : ",name_file)
 
@@ -394,6 +421,26 @@ if __name__=='__main__':
     parser.add_argument('config', type=str,
                         help='spec or dep or train_indep or indep that stands for speaker specific/dependant/independant')
 
+    parser.add_argument('--max_length', type=int, default=0,
+                        help='max # of frames of the training sentences, the longer ones are split (0 for no split)')
+
+    parser.add_argument('--precision', type=str, default="float64", choices=precisions,
+                        help='dtype of the model and the data, float32 is faster, bfloat16 only on cpu/gpu that support it')
+
+    parser.add_argument('--n_workers', type=int, default=1,
+                        help='# of threads loading the next batches during the training (0 to load them when needed)')
+
+    parser.add_argument('--prefetch', type=int, default=2,
+                        help='max # of batches loaded in advance')
+
+    parser.add_argument('--bucket_size', type=int, default=0,
+                        help='# of batches per bucket of sentences of similar lengths (0 for random batches)')
+
+    parser.add_argument('--packed', type=bool, default=False,
+                        help='whether the lstm layers go through the frames of each sentence, skipping the padding')
+    parser.add_argument('--mix_categs', type=bool, default=False,
+                        help='whether a batch can have sentences of several categories (no repeated files)')
+
     args = parser.parse_args()
     print('arguments given:', args.test_on, args.speakers_to_train, args.n_epochs, args.loss_train,
           args.patience, args.select_arti, args.corpus_to_train_on, args.batch_norma, args.filter_type, args.to_plot,args.lr, args.delta_test, args.config )
@@ -401,4 +448,6 @@ if __name__=='__main__':
                 patience=args.patience, select_arti=args.select_arti, corpus_to_train_on=args.corpus_to_train_on,
                 batch_norma=args.batch_norma, filter_type=args.filter_type, to_plot=args.to_plot,
                 lr=args.lr, delta_test=args.delta_test, config=args.config, speakers_to_train_on=args.speakers_to_train,
-                relearn=args.relearn, speakers_to_valid_on=args.speakers_to_valid)
\ No newline at end of file
+                relearn=args.relearn, speakers_to_valid_on=args.speakers_to_valid, max_length=args.max_length,
+                precision=args.precision, n_workers=args.n_workers, prefetch=args.prefetch,
+                bucket_size=args.bucket_size, packed=args.packed, mix_categs=args.mix_categs)
@@ -42,13 +42,15 @@ import csv
 from Training.pytorchtools import EarlyStopping
 import random
 from Training.tools_learning import which_speakers_to_train_on, give_me_train_valid_test_filenames_no_cat, \
-    criterion_both, load_np_ema_and_mfcc, plot_filtre, give_me_common_articulators, get_right_indexes
+    plot_filtre, give_me_common_articulators, precisions, criterion_both_parts
+from Training.data_loader import Prefetch_loader, Batch_collate, get_batches, get_n_buffers
 import json
 
 root_folder = os.path.dirname(os.getcwd())
 
 def train_model_arti_common(test_on, n_epochs, loss_train, patience, corpus_to_train_on, batch_norma, filter_type,
-                to_plot, lr, delta_valid, delta_test, config, speakers_to_train_on = "", speakers_to_valid_on = ""):
+                to_plot, lr, delta_valid, delta_test, config, speakers_to_train_on = "", speakers_to_valid_on = "",
+                max_length=0, precision="float64", n_workers=1, prefetch=2, packed=False):
     """
     :param test_on: (str) one speaker's name we want to test on, the speakers and the corpus the come frome can be seen in
     "fonction_utiles.py", in the function "get_speakers_per_corpus'.
@@ -85,6 +87,20 @@ def train_model_arti_common(test_on, n_epochs, loss_train, patience, corpus_to_t
     and others), or independant, train only on other speakers, and training independant for training on a certain list, validation
     on another an d test on another speaker
 
+    :param max_length: (int) max # of frames of the training and validation sentences, the longer ones are split in
+    segments when they are loaded (see split_filenames). 0 to keep the whole sentences.
+
+    :param precision: (str) "float64", "float32" or "bfloat16", dtype of the model, of the data and of the losses (see
+    tools_learning.precisions)
+
+    :param n_workers: (int) # of threads that load the next batches while the model learns (see data_loader.py), 0 to
+    load each batch when it is needed
+
+    :param prefetch: (int) max # of batches loaded in advance
+
+    :param packed: (bool) whether the lstm layers go through the frames of each sentence with packed sequences, so
+    that no computation is spent on the zero padding (see model.forward). "_packed" is added to the name of the model.
+
     :return: [rmse, pearson] . rmse the is the list of the 18 rmse (1 per articulator), same for pearson.
     """
 
@@ -112,6 +128,8 @@ def train_model_arti_common(test_on, n_epochs, loss_train, patience, corpus_to_t
 
     name_file = 'only_arti_common_' + test_on+"_"+config+"_train_"+'_'.join(train_on)+'_valid_'+ '_'.join(valid_on) + "_loss_"+str(loss_train)+"_filter_"+\
                 str(filter_type)+"_bn_"+str(batch_norma)
+    if packed:
+        name_file = name_file + "_packed"
 
     f_loss_train = open('training_loss'+ name_file +'.csv', 'w')
     f_loss_valid = open('valid_loss'+ name_file +'.csv', 'w')
@@ -148,8 +166,7 @@ def train_model_arti_common(test_on, n_epochs, loss_train, patience, corpus_to_t
     early_stopping = EarlyStopping(name_file, patience=patience, verbose=True)
     model = my_ac2art_model(hidden_dim=hidden_dim, input_dim=input_dim, name_file=name_file, output_dim=output_dim,
                             batch_size=batch_size, cuda_avail=cuda_avail,
-                            filter_type=filter_type, batch_norma=batch_norma)
-    model = model.double()
+                            filter_type=filter_type, batch_norma=batch_norma, precision=precision, packed=packed)
     file_weights = os.path.join("saved_models", name_file +".pt")
     if cuda_avail:
         model = model.to(device=device)
@@ -169,10 +186,15 @@ def train_model_arti_common(test_on, n_epochs, loss_train, patience, corpus_to_t
 
 
 
-    files_for_train, files_for_valid, files_for_test = give_me_train_valid_test_filenames_no_cat(train_on,test_on,config, valid_on=valid_on)
+    files_for_train, files_for_valid, files_for_test = give_me_train_valid_test_filenames_no_cat(train_on,test_on,config, valid_on=valid_on,
+                                                                                                 max_length=max_length)
     print('train on', len(files_for_train), 'valid on', len(files_for_valid), 'test on', len(files_for_test))
     optimizer = torch.optim.Adam(model.parameters(), lr=lr)
 
+    collate_common = Batch_collate(model.dtype, batch_size, max_length if max_length > 0 else 500,
+                                   get_n_buffers(n_workers, prefetch), columns=arti_common,
+                                   pin_memory=cuda_avail)  # only the common articulators in y
+
     plot_filtre_chaque_epochs = False
 
     for epoch in range(n_epochs):
@@ -185,32 +207,28 @@ def train_model_arti_common(test_on, n_epochs, loss_train, patience, corpus_to_t
         loss_pearson = 0
         loss_rmse = 0
         nb_batch = len(files_for_train)/ batch_size
-        for i in range(int(nb_batch)):
+        batches = get_batches(files_for_train, batch_size)[:int(nb_batch)]  # the last incomplete batch is left out
+        for categ, x, y, lengths_batch, mask in Prefetch_loader(batches, precision, collate=collate_common,
+                                                                n_workers=n_workers, prefetch=prefetch,
+                                                                pin_memory=cuda_avail):
 
             n_this_epoch+=1
 
-            x, y = load_np_ema_and_mfcc(files_for_train[i*batch_size:(i+1)*batch_size])
-            model.output_dim = 18
-            x, y = model.prepare_batch(x, y)
-
-            model.output_dim = len(arti_common)
-            y = get_right_indexes(y,arti_common)
             if cuda_avail:
-                x, y = x.to(device=model.device), torch.from_numpy(y).double().to(device=model.device)
-            y_pred = model(x).double()
+                x, y = x.to(device=model.device, non_blocking=True), y.to(device=model.device, non_blocking=True)
+                mask = mask.to(device=model.device)
+            y_pred = model(x, lengths=lengths_batch)
             if cuda_avail:
                 y_pred = y_pred.to(device=device)
-            y = y.double ()
             optimizer.zero_grad()
 
-            loss = criterion_both(y, y_pred,alpha=loss_train, cuda_avail = cuda_avail, device=device)
+            # the 2 losses are also given to follow their evolution
+            loss, loss_2, loss_3 = criterion_both_parts(y, y_pred,alpha=loss_train, cuda_avail = cuda_avail,
+                                                        device=device, mask=mask)
             loss.backward()
             optimizer.step()
 
-            # computation to have evolution of the losses
-            loss_2 = criterion_both(y, y_pred, alpha=100, cuda_avail=cuda_avail, device=device)
-            loss_pearson += loss_2.item()
-            loss_3 = criterion_both(y, y_pred, alpha=0, cuda_avail=cuda_avail, device=device)
+            loss_pearson += 1000. * loss_2.item()
             loss_rmse += loss_3.item()
             torch.cuda.empty_cache()
             loss_train_this_epoch += loss.item()
@@ -228,29 +246,25 @@ def train_model_arti_common(test_on, n_epochs, loss_train, patience, corpus_to_t
             loss_pearson = 0
             loss_rmse = 0
             nb_batch = len(files_for_valid) / batch_size
-            for i in range(int(nb_batch)):
-                n_valid +=1
-                x, y = load_np_ema_and_mfcc(files_for_valid[i * batch_size:(i + 1) * batch_size])
-                model.output_dim = 18
-                x, y = model.prepare_batch(x, y)
-                model.output_dim = len(arti_common)
-                y = get_right_indexes(y, arti_common)
-                if cuda_avail:
-                    x, y = x.to(device=model.device), torch.from_numpy(y).double().to(
-                        device=model.device)
-                y_pred = model(x).double()
-                torch.cuda.empty_cache()
-                if cuda_avail:
-                    y_pred = y_pred.to(device=device)
-                y = y.double()  # (Batchsize, maxL, art_common_nb)
-                loss_courant = criterion_both(y, y_pred, loss_train, cuda_avail = cuda_avail, device=device)
-                loss_vali += loss_courant.item()
-
-                # to follow both losses
-                loss_2 = criterion_both(y, y_pred, alpha=100, cuda_avail=cuda_avail, device=device)
-                loss_pearson += loss_2.item()
-                loss_3 = criterion_both(y, y_pred, alpha=0, cuda_avail=cuda_avail, device=device)
-                loss_rmse += loss_3.item()
+            batches = get_batches(files_for_valid, batch_size)[:int(nb_batch)]
+            with torch.no_grad():  # no graph for the validation
+                for categ, x, y, lengths_batch, mask in Prefetch_loader(batches, precision, collate=collate_common,
+                                                                        n_workers=n_workers, prefetch=prefetch,
+                                                                        pin_memory=cuda_avail):
+                    n_valid += 1
+                    if cuda_avail:
+                        x, y = x.to(device=model.device, non_blocking=True), y.to(device=model.device, non_blocking=True)
+                        mask = mask.to(device=model.device)
+                    y_pred = model(x, lengths=lengths_batch)  # (Batchsize, maxL, art_common_nb)
+                    torch.cuda.empty_cache()
+                    if cuda_avail:
+                        y_pred = y_pred.to(device=device)
+                    # to follow both losses
+                    loss_courant, loss_2, loss_3 = criterion_both_parts(y, y_pred, loss_train, cuda_avail=cuda_avail,
+                                                                        device=device, mask=mask)
+                    loss_vali += loss_courant.item()
+                    loss_pearson += 1000. * loss_2.item()
+                    loss_rmse += loss_3.item()
 
             loss_vali  = loss_vali/n_valid
             f_loss_valid.write(str(epoch) + ',' + str(loss_vali) + ',' +  str(loss_pearson/n_valid/1000./batch_size/len(arti_common)*(-1.)) +
@@ -262,29 +276,25 @@ def train_model_arti_common(test_on, n_epochs, loss_train, patience, corpus_to_t
             loss_pearson = 0
             loss_rmse = 0
             nb_batch = len(files_for_test) / batch_size
-            for i in range(int(nb_batch)):
-                n_test += 1
-                x, y = load_np_ema_and_mfcc(files_for_test[i * batch_size:(i + 1) * batch_size])
-                model.output_dim = 18
-                x, y = model.prepare_batch(x, y)
-                model.output_dim = len(arti_common)
-                y = get_right_indexes(y, arti_common)
-                if cuda_avail:
-                    x, y = x.to(device=model.device), torch.from_numpy(y).double().to(
-                        device=model.device)
-                y_pred = model(x).double()
-                torch.cuda.empty_cache()
-                if cuda_avail:
-                    y_pred = y_pred.to(device=device)
-                y = y.double()  # (Batchsize, maxL, art_common_nb)
-                loss_courant = criterion_both(y, y_pred, loss_train, cuda_avail=cuda_avail, device=device)
-                loss_test += loss_courant.item()
-
-                # to follow both losses
-                loss_2 = criterion_both(y, y_pred, alpha=100, cuda_avail=cuda_avail, device=device)
-                loss_pearson += loss_2.item()
-                loss_3 = criterion_both(y, y_pred, alpha=0, cuda_avail=cuda_avail, device=device)
-                loss_rmse += loss_3.item()
+            batches = get_batches(files_for_test, batch_size)[:int(nb_batch)]
+            with torch.no_grad():
+                for categ, x, y, lengths_batch, mask in Prefetch_loader(batches, precision, collate=collate_common,
+                                                                        n_workers=n_workers, prefetch=prefetch,
+                                                                        pin_memory=cuda_avail):
+                    n_test += 1
+                    if cuda_avail:
+                        x, y = x.to(device=model.device, non_blocking=True), y.to(device=model.device, non_blocking=True)
+                        mask = mask.to(device=model.device)
+                    y_pred = model(x, lengths=lengths_batch)  # (Batchsize, maxL, art_common_nb)
+                    torch.cuda.empty_cache()
+                    if cuda_avail:
+                        y_pred = y_pred.to(device=device)
+                    # to follow both losses
+                    loss_courant, loss_2, loss_3 = criterion_both_parts(y, y_pred, loss_train, cuda_avail=cuda_avail,
+                                                                        device=device, mask=mask)
+                    loss_test += loss_courant.item()
+                    loss_pearson += 1000. * loss_2.item()
+                    loss_rmse += loss_3.item()
 
             loss_test = loss_test / n_test
             f_loss_test.write(str(epoch) + ',' + str(loss_test) + ',' + str(
@@ -311,29 +321,19 @@ def train_model_arti_common(test_on, n_epochs, loss_train, patience, corpus_to_t
         model.load_state_dict(torch.load(os.path.join("saved_models",name_file+'.pt')))
         torch.save(model.state_dict(), os.path.join( "saved_models",name_file+".txt")) #lorsque .txt ==> training terminé !
     random.shuffle(files_for_test)
-    x, y = load_np_ema_and_mfcc(files_for_test)
-    #y = get_right_indexes(y, arti_common)
     print("evaluation on speaker {}".format(test_on))
     std_speaker = np.load(os.path.join(root_folder,"Preprocessing","norm_values","std_ema_"+test_on+".npy"))
     arti_to_consider = [1 for i in range(len(arti_common))]
-    rmse_per_arti_mean, pearson_per_arti_mean = model.evaluate_on_test(x, y, std_speaker = std_speaker, to_plot=to_plot
-                                                                       , to_consider = arti_to_consider, index_common=arti_common)
+    rmse_per_arti_mean, rmse_without_std, pearson_per_arti_mean = model.evaluate_on_files(
+        files_for_test, std_speaker = std_speaker, to_plot=to_plot, to_consider = arti_to_consider,
+        index_common=arti_common)  # a few files at a time
 
 
     """  RESULTS ON VALIDATION SET """
 
-    pearson_valid = np.zeros((1,output_dim))
-    nb_batch = len(files_for_valid) / batch_size
-    for i in range(int(nb_batch)):
-        x, y = load_np_ema_and_mfcc(files_for_valid[i * batch_size:(i + 1) * batch_size])
-        #y = get_right_indexes(y, arti_common)
-        rien, pearson_valid_temp = model.evaluate_on_test(x,y,std_speaker=1, to_plot=to_plot,
-                                                             to_consider=arti_to_consider,verbose=False, index_common=arti_common , no_std = True)
-        pearson_valid_temp = np.reshape(np.array(pearson_valid_temp),(1,output_dim))
-        pearson_valid = np.concatenate((pearson_valid,pearson_valid_temp),axis=0)
-    pearson_valid = pearson_valid[1:,:]
-    pearson_valid[np.isnan(pearson_valid)] = 0
-    pearson_valid = np.mean(pearson_valid,axis=0)
+    rien, rien_2, pearson_valid = model.evaluate_on_files(files_for_valid, std_speaker=1, to_plot=to_plot,
+                                                          to_consider=arti_to_consider, verbose=False,
+                                                          index_common=arti_common, no_std=True)
     print("on validation set :mean :\n",pearson_valid)
     print("training done for : ",name_file)
 
@@ -418,10 +418,27 @@ if __name__=='__main__':
     parser.add_argument('config', type=str,
                         help='spec or dep or indep that stands for speaker specific/dependant/independant')
 
+    parser.add_argument('--max_length', type=int, default=0,
+                        help='max # of frames of the training sentences, the longer ones are split (0 for no split)')
+
+    parser.add_argument('--precision', type=str, default="float64", choices=precisions,
+                        help='dtype of the model and the data, float32 is faster, bfloat16 only on cpu/gpu that support it')
+
+    parser.add_argument('--n_workers', type=int, default=1,
+                        help='# of threads loading the next batches during the training (0 to load them when needed)')
+
+    parser.add_argument('--prefetch', type=int, default=2,
+                        help='max # of batches loaded in advance')
+
+    parser.add_argument('--packed', type=bool, default=False,
+                        help='whether the lstm layers go through the frames of each sentence, skipping the padding')
+
     args = parser.parse_args()
 
     train_model_arti_common(test_on=args.test_on, n_epochs=args.n_epochs, loss_train=args.loss_train,
                 patience=args.patience,  corpus_to_train_on=args.corpus_to_train_on,
                 batch_norma=args.batch_norma, filter_type=args.filter_type, to_plot=args.to_plot,
                 lr=args.lr, delta_valid=args.delta_valid, delta_test=args.delta_test, config=args.config,
-                            speakers_to_train_on=args.speakers_to_train, speakers_to_valid_on=args.speakers_to_valid)
\ No newline at end of file
+                            speakers_to_train_on=args.speakers_to_train, speakers_to_valid_on=args.speakers_to_valid,
+                            max_length=args.max_length, precision=args.precision, n_workers=args.n_workers,
+                            prefetch=args.prefetch, packed=args.packed)
\ No newline at end of file